@@ -0,0 +1,113 @@
+'''
+Runs the benchmark suite.
+
+    python -m benchmarks                          # small and medium scores
+    python -m benchmarks -s large -c render_track
+    python -m benchmarks -o results.json          # machine readable results
+    python -m benchmarks --save-baseline          # update benchmarks/baseline.json
+
+Results are compared against the stored baseline and the exit status is
+non-zero if any case is slower by more than the tolerance.
+'''
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+from twiddle import containers
+
+from . import fixtures
+from .suite import CASES
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+def measure(f, repeat):
+    ' Best of repeat runs, in seconds '
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        f()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def run(cases, sizes, repeat):
+    results = {}
+    for name, f in CASES:
+        if cases and name not in cases:
+            continue
+        for size in sizes:
+            key = "%s/%s" % (name, size)
+            results[key] = measure(f(fixtures.SIZES[size]), repeat)
+            print("%-28s %10.4fs" % (key, results[key]))
+            sys.stdout.flush()
+    return results
+
+def compare(results, baseline, tolerance):
+    ' Returns the keys that are slower than the baseline by more than tolerance '
+    regressions = []
+    print("")
+    print("%-28s %10s %10s %8s" % ("case", "baseline", "now", "ratio"))
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        ratio = results[key] / baseline[key] if baseline[key] else 1.0
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(key)
+            flag = " REGRESSION"
+        print("%-28s %9.4fs %9.4fs %8.2f%s" % (key, baseline[key], results[key], ratio, flag))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the twiddle benchmarks")
+    parser.add_argument('-c', '--case', action='append', help="Only run the given case (repeatable)")
+    parser.add_argument('-s', '--size', action='append', choices=sorted(fixtures.SIZES),
+            help="Score sizes to run (default small and medium)")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="Runs per case, the best is kept")
+    parser.add_argument('-o', '--output', help="Write the results as JSON")
+    parser.add_argument('-b', '--baseline', default=BASELINE, help="Baseline results to compare against")
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25, help="Allowed slowdown as a fraction")
+    parser.add_argument('--save-baseline', action='store_true', help="Store the results as the new baseline")
+
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    if containers.validation_mode() != containers.OFF:
+        sys.stderr.write("TWIDDLE_VALIDATE=%s will slow the cases down\n" % containers.validation_mode())
+
+    sizes = options.size or ['small', 'medium']
+    results = run(options.case, sizes, options.repeat)
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if options.save_baseline:
+        baseline = {}
+        if os.path.exists(options.baseline):
+            with open(options.baseline) as f:
+                baseline = json.load(f)['results']
+        baseline.update(results)
+        report['results'] = baseline
+        with open(options.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        return 0
+
+    if not os.path.exists(options.baseline):
+        return 0
+    with open(options.baseline) as f:
+        baseline = json.load(f)['results']
+    return 1 if compare(results, baseline, options.tolerance) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
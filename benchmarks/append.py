@@ -0,0 +1,42 @@
+'''
+Builds tracks from shuffled events one append() at a time and with a single extend().
+
+    python -m benchmarks.append
+'''
+import random
+import time
+
+from twiddle.containers import EventList
+from twiddle.objects import Event, Note, TimeRange
+
+def shuffled_events(n, seed=1):
+    rnd = random.Random(seed)
+    events = [ Event(TimeRange(i * 12, i * 12 + rnd.choice((6, 12, 24))), Note(60 + i % 12, ())) for i in range(n) ]
+    rnd.shuffle(events)
+    return events
+
+def timed(f, *args):
+    start = time.time()
+    f(*args)
+    return time.time() - start
+
+def append_all(events):
+    c = EventList()
+    for e in events:
+        c.append(e)
+    return c
+
+def extend_all(events):
+    return EventList().extend(events)
+
+def main(sizes=(12500, 25000, 50000, 100000)):
+    print("%8s %10s %10s %12s" % ("n", "append", "extend", "append/nlogn"))
+    from math import log
+    for n in sizes:
+        events = shuffled_events(n)
+        a = timed(append_all, events)
+        e = timed(extend_all, events)
+        print("%8d %9.3fs %9.3fs %12.3g" % (n, a, e, a / (n * log(n))))
+
+if __name__ == '__main__':
+    main()
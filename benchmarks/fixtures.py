@@ -0,0 +1,75 @@
+'''
+Generated scores and MIDI files for the benchmarks.
+Everything is seeded so runs are repeatable.
+'''
+import random
+from io import BytesIO
+
+from twiddle import midifile
+from twiddle.containers import EventList
+from twiddle.objects import Event, Note, TimeRange
+
+RESOLUTION = 96
+
+LENGTHS = (24, 48, 72, 96, 144, 192, 288, 384)
+
+# number of notes in a score
+SIZES = {
+    'small': 1000,
+    'medium': 10000,
+    'large': 50000,
+}
+
+def melody(n, resolution=RESOLUTION, seed=1, rests=0.2, chords=0.1):
+    '''
+    A single line of n notes with some rests and chords.
+    '''
+    rnd = random.Random(seed)
+    events = []
+    clock = 0
+    for i in range(n):
+        if rnd.random() < rests:
+            clock += rnd.choice(LENGTHS)
+        length = rnd.choice(LENGTHS)
+        pitch = rnd.randint(36, 96)
+        if rnd.random() < chords:
+            pitch = [pitch, pitch + 4, pitch + 7]
+        events.append(Event(TimeRange(clock, clock + length), Note(pitch, ())))
+        clock += length
+    return events
+
+def score(n, resolution=RESOLUTION, seed=1):
+    return EventList(resolution=resolution).extend(melody(n, resolution, seed))
+
+def sparse(n, resolution=RESOLUTION, seed=1):
+    ' A part that is mostly rests '
+    rnd = random.Random(seed)
+    bar = resolution * 4
+    events = []
+    for i in range(n):
+        start = i * bar * 3 + rnd.choice((0, 24, 96, 144))
+        events.append(Event(TimeRange(start, start + rnd.choice(LENGTHS)), Note(60, ())))
+    return EventList(resolution=resolution).extend(events)
+
+def performed(n, resolution=RESOLUTION, seed=1, jitter=6):
+    ' A melody as played, every start and stop off the grid by up to jitter ticks '
+    rnd = random.Random(seed)
+    events = []
+    for e in melody(n, resolution, seed):
+        start = max(0, e.time.start + rnd.randint(-jitter, jitter))
+        stop = max(start + 1, e.time.stop + rnd.randint(-jitter, jitter))
+        events.append(Event(TimeRange(start, stop), e.item))
+    return events
+
+def shuffled(n, seed=1):
+    events = melody(n, seed=seed)
+    random.Random(seed).shuffle(events)
+    return events
+
+def midi(n, tracks=4, resolution=RESOLUTION, seed=1):
+    '''
+    A MIDI file as bytes with n notes spread over the given number of tracks.
+    '''
+    f = BytesIO()
+    midifile.write_midifile(f, [ melody(n // tracks, resolution, seed + i) for i in range(tracks) ], resolution)
+    return f.getvalue()
@@ -0,0 +1,51 @@
+'''
+Pitch and duration spelling on a 50k note score.
+
+    python -m benchmarks.lily
+'''
+import random
+import time
+
+from twiddle import lily
+from twiddle.containers import EventList
+from twiddle.objects import Event, Note, TimeRange
+from twiddle.views import TrackView
+
+
+LENGTHS = (24, 48, 72, 96, 144, 192, 288, 384)
+
+def score(n, resolution=96, seed=1):
+    rnd = random.Random(seed)
+    events = []
+    clock = 0
+    for i in range(n):
+        length = rnd.choice(LENGTHS)
+        events.append(Event(TimeRange(clock, clock + length), Note(rnd.randint(36, 96), ())))
+        clock += length
+    return EventList(resolution=resolution).extend(events)
+
+def timed(f, *args):
+    start = time.time()
+    f(*args)
+    return time.time() - start
+
+def spell(notes, resolution, pitch, length):
+    for e in notes:
+        pitch(e.item.pitch, 0)
+        length(e.time.ticks, resolution)
+
+def main(n=50000):
+    notes = score(n)
+    r = notes.resolution
+
+    untabled = timed(spell, notes, r, lambda i, key: lily.spell_note(i, key >= 0), lily.length_token)
+    tabled = timed(spell, notes, r, lily.int_to_note, lily.duration_to_length)
+    render = timed(notes.render_track, TrackView(r), {})
+
+    print("%d notes" % n)
+    print("spelling without tables %8.3fs" % untabled)
+    print("spelling with tables    %8.3fs" % tabled)
+    print("render_track            %8.3fs" % render)
+
+if __name__ == '__main__':
+    main()
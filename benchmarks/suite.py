@@ -0,0 +1,126 @@
+'''
+The benchmark cases.
+
+Each case takes a number of notes and returns a function to time.
+Building the fixture is not part of the measurement.
+'''
+from io import BytesIO
+
+from twiddle import cache, functions
+from twiddle.containers import EventList, VoiceList
+from twiddle.objects import Event, TimeRange
+from twiddle.views import TrackView
+
+from . import fixtures
+
+CASES = []
+
+def case(f):
+    CASES.append((f.__name__, f))
+    return f
+
+def meter_changes(resolution, bars, every=4):
+    view = TrackView(resolution)
+    for bar in range(1 + every, bars, every):
+        view.set_meter(bar, (3, 4) if bar % (every * 2) else (4, 4))
+    return view
+
+@case
+def from_midi(n):
+    data = fixtures.midi(n)
+    return lambda: VoiceList.from_midi(BytesIO(data))
+
+@case
+def load_cache(n):
+    f = BytesIO()
+    cache.save(VoiceList.from_midi(BytesIO(fixtures.midi(n))), f)
+    data = f.getvalue()
+    return lambda: cache.load(BytesIO(data))
+
+@case
+def append(n):
+    events = fixtures.shuffled(n)
+    def run():
+        c = EventList(resolution=fixtures.RESOLUTION)
+        for e in events:
+            c.append(e)
+    return run
+
+@case
+def extend(n):
+    events = fixtures.shuffled(n)
+    return lambda: EventList(resolution=fixtures.RESOLUTION).extend(events)
+
+@case
+def get(n):
+    track = fixtures.score(n)
+    bar = track.resolution * 4
+    windows = [ TimeRange(t, t + bar) for t in range(0, track.time.stop, track.time.stop // 100) ]
+    def run():
+        for w in windows:
+            track.get(w)
+    return run
+
+@case
+def slice(n):
+    track = fixtures.score(n)
+    bar = track.resolution * 4
+    windows = [ TimeRange(t, t + bar) for t in range(0, track.time.stop, track.time.stop // 100) ]
+    def run():
+        for w in windows:
+            track.slice(w)
+    return run
+
+@case
+def split_sections(n):
+    track = fixtures.score(n)
+    view = meter_changes(track.resolution, track.time.stop // (track.resolution * 4))
+    def run():
+        for b, key, section in view.split_sections(track):
+            pass
+    return run
+
+@case
+def get_rests(n):
+    track = fixtures.sparse(n)
+    view = TrackView(track.resolution)
+    def run():
+        clock = 0
+        for e in track:
+            b = view.bar_info(clock)
+            for r in b.get_rests(clock, e.time.start - clock):
+                pass
+            clock = e.time.stop
+    return run
+
+@case
+def render_track(n):
+    track = fixtures.score(n)
+    view = meter_changes(track.resolution, track.time.stop // (track.resolution * 4), every=16)
+    def run():
+        # from scratch rather than from the render cache
+        track.touch()
+        track.render_track(view, {})
+    return run
+
+@case
+def edit_render(n):
+    ' Single note edits each followed by a render, as in a preview loop '
+    track = fixtures.score(n)
+    view = meter_changes(track.resolution, track.time.stop // (track.resolution * 4), every=16)
+    track.render_track(view, {})
+    positions = [ track[i].time.start for i in range(0, len(track), len(track) // 10) ]
+    def run():
+        for p in positions:
+            functions.attribute_list(track, [(p, 'f')])
+            track.render_track(view, {})
+    return run
+
+@case
+def quantize(n):
+    ' Includes copying the events as quantizing changes them in place '
+    events = fixtures.performed(n)
+    def run():
+        track = EventList([ Event(e.time, e.item) for e in events ], resolution=fixtures.RESOLUTION)
+        functions.quantize(track, 16)
+    return run
@@ -0,0 +1,80 @@
+from unittest import TestCase
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from io import BytesIO
+
+from twiddle import batch, midifile
+from twiddle.containers import VoiceList
+from twiddle.generators import from_string
+
+class BatchTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, 'sub'))
+        for name in ('a.mid', os.path.join('sub', 'b.MID')):
+            with open(os.path.join(self.dir, name), 'wb') as f:
+                midifile.write_midifile(f, [from_string('C-2 D-2 E-4', resolution=4)], 4)
+        with open(os.path.join(self.dir, 'broken.mid'), 'wb') as f:
+            f.write(b'not a midi file')
+        with open(os.path.join(self.dir, 'notes.txt'), 'w') as f:
+            f.write('ignored')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_find_files(self):
+        found = [ os.path.relpath(p, self.dir) for root, p in batch.find_files([self.dir]) ]
+        self.assertEqual(found, ['a.mid', 'broken.mid', os.path.join('sub', 'b.MID')])
+
+        self.assertEqual(batch.output_path(self.dir, os.path.join(self.dir, 'sub', 'b.MID'), '/out'),
+                os.path.join('/out', 'sub', 'b.ly'))
+        self.assertEqual(batch.output_path('', 'a.mid'), 'a.ly')
+
+    def test_convert(self):
+        source = os.path.join(self.dir, 'a.mid')
+        target = os.path.join(self.dir, 'out', 'a.ly')
+        s, t, elapsed, error = batch.convert((source, target, 1))
+        self.assertEqual(error, None)
+        with open(target) as f:
+            self.assertTrue('TrackA = {' in f.read())
+
+        s, t, elapsed, error = batch.convert((os.path.join(self.dir, 'broken.mid'), target + '2', 1))
+        self.assertTrue('MidiError' in error)
+        self.assertFalse(os.path.exists(target + '2'))
+        self.assertFalse(os.path.exists(target + '2.tmp'))
+
+    def test_failed_render(self):
+        source = os.path.join(self.dir, 'a.mid')
+        target = os.path.join(self.dir, 'a.ly')
+
+        def write_lily(self, stream, context={}):
+            stream.write('TrackA = {')
+            raise ValueError("render failed")
+
+        original = VoiceList.write_lily
+        VoiceList.write_lily = write_lily
+        try:
+            s, t, elapsed, error = batch.convert((source, target, 1))
+        finally:
+            VoiceList.write_lily = original
+        self.assertTrue('render failed' in error)
+        self.assertFalse(os.path.exists(target))
+        self.assertFalse(os.path.exists(target + '.tmp'))
+
+    def test_main(self):
+        out = os.path.join(self.dir, 'out')
+        handlers, level, stdout = logging.root.handlers[:], logging.root.level, sys.stdout
+        sys.stdout = BytesIO()
+        try:
+            self.assertEqual(batch.main([self.dir, '-o', out, '-j', '2', '-q', '1']), 1)
+            report = sys.stdout.getvalue()
+        finally:
+            logging.root.handlers[:], sys.stdout = handlers, stdout
+            logging.root.setLevel(level)
+        self.assertTrue('3 files, 1 failed' in report)
+        self.assertTrue(os.path.exists(os.path.join(out, 'a.ly')))
+        self.assertTrue(os.path.exists(os.path.join(out, 'sub', 'b.ly')))
@@ -0,0 +1,120 @@
+from unittest import TestCase, skipIf
+from io import BytesIO
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from twiddle import cache, midifile
+from twiddle.containers import EventList, VoiceList, ParallelEventList
+from twiddle.objects import TimeRange, Event, Note, Comment, KeySignature
+from twiddle.generators import from_string, sequence_builder
+
+class CacheTest(TestCase):
+
+    def setUp(self):
+        part = from_string('A-2 Bb-1 R-1 D-2 E-1 R-2 G-1 A-6 R-1 D-3', resolution=4)
+        part.append(Event(TimeRange(4, 6), Note([60, 64, 67], ('!', ))))
+        part.add_event(8, 'FOO')
+        part.append(Event(TimeRange(12, 12), Comment('caf\xc3\xa9')))
+        part.append(Event(TimeRange(0, 0), KeySignature(-2, True)))
+        part.add_attr('(')
+
+        self.voices = VoiceList()
+        self.voices['melody'] = part
+        self.voices['bass'] = from_string('C-4 G-4', resolution=4)
+        self.voices.resolution = 4
+
+    def round_trip(self, obj, **kwargs):
+        f = BytesIO()
+        cache.save(obj, f)
+        f.seek(0)
+        return cache.load(f, **kwargs)
+
+    def assertSameVoices(self, a, b):
+        self.assertEqual(sorted(a), sorted(b))
+        for name in a:
+            self.assertEqual(repr(a[name]), repr(b[name]))
+            self.assertEqual(a[name].resolution, b[name].resolution)
+            self.assertEqual(a[name].render_track(), b[name].render_track())
+
+    def test_round_trip(self):
+        loaded = self.round_trip(self.voices)
+        self.assertTrue(isinstance(loaded, VoiceList))
+        self.assertEqual(loaded.resolution, 4)
+        self.assertSameVoices(loaded, self.voices)
+
+        part = self.round_trip(self.voices['melody'])
+        self.assertTrue(isinstance(part, EventList))
+        self.assertEqual(repr(part), repr(self.voices['melody']))
+
+        empty = self.round_trip(EventList())
+        self.assertEqual((len(empty), empty.time), (0, (-1, -1)))
+
+    def test_errors(self):
+        with self.assertRaises(cache.CacheError):
+            cache.load(BytesIO(b'MThd' + b'\0' * 20))
+
+    def test_separated(self):
+        self.voices['melody'].apply('sequential')
+        self.assertTrue(any(( isinstance(e, ParallelEventList) for e in self.voices['melody'] )))
+
+        loaded = self.round_trip(self.voices)
+        self.assertSameVoices(loaded, self.voices)
+
+    @skipIf(numpy is None, "numpy not installed")
+    def test_load_columns(self):
+        d = tempfile.mkdtemp()
+        try:
+            path = os.path.join(d, 'score.twc')
+            cache.save(self.voices, path)
+            for use_mmap in (True, False):
+                columns = cache.load_columns(path, use_mmap)
+                self.assertTrue(getattr(columns['melody'], 'columnar', False))
+                self.assertSameVoices(VoiceList(( (k, v.to_events()) for k, v in columns.items() )), self.voices)
+            self.assertTrue(columns['melody'].pitch.flags.writeable)
+        finally:
+            shutil.rmtree(d)
+
+    @skipIf(numpy is None, "numpy not installed")
+    def test_load_separated_columns(self):
+        part = sequence_builder([ Event(TimeRange(*t), Note(60 + i)) for i, t in enumerate(((0, 2), (1, 10), (3, 4))) ], 4)
+        self.assertTrue(any(( isinstance(e, ParallelEventList) for e in part )))
+        f = BytesIO()
+        cache.save(part, f)
+        f.seek(0)
+        columns = cache.load_columns(f, use_mmap=False)
+        self.assertEqual(columns.start.tolist(), [0, 1, 3])
+        self.assertEqual([ (e.time, e.item.pitch) for e in columns.to_events() ],
+            [ ((0, 2), 60), ((1, 10), 61), ((3, 4), 62) ])
+        self.assertEqual([ e.item.pitch for e in columns.slice(TimeRange(2, 4)).to_events() ], [61, 62])
+
+    def test_load_midi(self):
+        d = tempfile.mkdtemp()
+        try:
+            path = os.path.join(d, 'score.mid')
+            with open(path, 'wb') as f:
+                midifile.write_midifile(f, [self.voices['bass'], self.voices['melody'].note_events()], 4)
+            voices = cache.load_midi(path, quantize=1)
+            cached = path + '.q1.twc'
+            self.assertTrue(os.path.exists(cached))
+
+            # later loads come from the cache
+            past = int(time.time()) - 10
+            os.utime(path, (past, past))
+            os.utime(cached, (past, past))
+            self.assertSameVoices(cache.load_midi(path, quantize=1), voices)
+            self.assertEqual(os.path.getmtime(cached), past)
+
+            # a newer MIDI file replaces it
+            os.utime(path, None)
+            cache.load_midi(path, quantize=1)
+            self.assertNotEqual(os.path.getmtime(cached), past)
+            self.assertSameVoices(cache.load(cached), VoiceList.from_midi(path, 1))
+        finally:
+            shutil.rmtree(d)
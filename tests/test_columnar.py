@@ -0,0 +1,144 @@
+from unittest import TestCase, skipIf
+import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from twiddle.containers import EventList
+from twiddle.objects import TimeRange, Event, Note, Instruction
+from twiddle.generators import from_string, sequence_builder
+from twiddle.views import TrackView
+
+@skipIf(numpy is None, "numpy not installed")
+class ColumnarEventListTest(TestCase):
+
+    def setUp(self):
+        self.part = from_string('A-2 Bb-1 R-1 D-2 E-1 R-2 G-1 A-6 R-1 D-3')
+        self.part.append(Event(TimeRange(4, 6), Note([60, 64, 67], ('!', ))))
+        self.part.add_event(8, 'FOO')
+        self.columns = self.part.to_columns()
+
+    def assertSameEvents(self, columns, events):
+        self.assertEqual(repr(columns.to_events()), repr(events))
+
+    def test_round_trip(self):
+        self.assertEqual(len(self.columns), len(self.part))
+        self.assertEqual(len(self.columns.start), len(self.part) + 2)
+        self.assertSameEvents(self.columns, self.part)
+        self.assertEqual(self.columns.time, self.part.time)
+
+    def test_get(self):
+        for w in (TimeRange(0, 4), TimeRange(3, 9), TimeRange(8, 8), TimeRange(5, 20)):
+            self.assertSameEvents(self.columns.get(w), self.part.get(w))
+        self.assertSameEvents(self.columns.get(4), self.part.get(4))
+
+    def test_slice(self):
+        for w in (TimeRange(0, 5), TimeRange(3, 9), TimeRange(5, 20), TimeRange(8, 8)):
+            self.assertSameEvents(self.columns.slice(w), self.part.slice(w))
+
+        a, b = self.columns.split(5)
+        x, y = self.part.split(5)
+        self.assertSameEvents(a, x)
+        self.assertSameEvents(b, y)
+
+    def test_paste(self):
+        other = from_string('C-1 D-1')
+        self.columns.paste(other.to_columns(), 2)
+        self.part.paste(other, 2)
+        self.assertSameEvents(self.columns, self.part)
+
+        self.columns.remove(TimeRange(0, 4))
+        self.part.remove(TimeRange(0, 4))
+        self.assertSameEvents(self.columns, self.part)
+
+        self.assertSameEvents(self.columns.remove(8), self.part.remove(8))
+        self.assertSameEvents(self.columns, self.part)
+
+    def test_render(self):
+        view = TrackView(resolution=self.part.resolution)
+        self.assertEqual(self.columns.render_track(view, {}), self.part.render_track(view, {}))
+        self.assertEqual([ repr(x) for x in self.columns.note_iter() ],
+                [ repr(x) for x in self.part.note_iter() ])
+
+@skipIf(numpy is None, "numpy not installed")
+class BatchFunctionsTest(TestCase):
+
+    def setUp(self):
+        self.part = from_string('A-2 Bb-1 R-1 D-2 E-1 R-2 G-1 A-6 R-1 D-3', resolution=4)
+        self.part.append(Event(TimeRange(20, 21), Note([60, 64, 67], ('!', ))))
+        self.part.add_event(8, 'FOO')
+
+    def check(self, name, *args):
+        columns = self.part.to_columns().apply(name, *args)
+        self.part.apply(name, *args)
+        self.assertEqual(repr(columns.to_events()), repr(self.part))
+
+    def test_transpose(self):
+        self.check('transpose', 3)
+
+    def test_add_attr(self):
+        self.check('add_attr', '-.')
+        self.assertEqual(self.part.note_events()[0].item.attr, ('-.', ))
+
+    def test_extend(self):
+        self.check('extend', 4)
+        self.check('extend', 1)
+
+@skipIf(numpy is None, "numpy not installed")
+class QuantizeTest(TestCase):
+
+    def setUp(self):
+        # loosely played 16ths, triplets, swung 8ths and a straight 8th
+        rnd = random.Random(1)
+        self.expected = [(0, 24), (24, 48), (48, 72), (72, 96), (96, 128), (128, 160), (160, 192),
+                (192, 256), (256, 288), (288, 336)]
+        events = []
+        for start, stop in self.expected:
+            events.append(Event(TimeRange(start + rnd.randrange(-3, 4), stop + rnd.randrange(-3, 4)), Note(60)))
+        events.append(Event(TimeRange(100, 100), Instruction('FOO')))
+        self.part = EventList(events, resolution=96)
+
+    def times(self, seq):
+        return [ tuple(e.time) for e in seq if isinstance(e.item, Note) ]
+
+    def test_grids(self):
+        self.part.apply('quantize', 16)
+        self.assertEqual(self.times(self.part), self.expected)
+        self.assertEqual(self.part.time, (0, 336))
+        self.assertEqual(self.part[4].time, (96, 96))
+
+        # only a straight grid
+        part = EventList([Event(TimeRange(0, 30), Note(60)), Event(TimeRange(30, 70), Note(62))], resolution=96)
+        part.apply('quantize', 8, ('straight', ))
+        self.assertEqual(self.times(part), [(0, 48), (48, 96)])
+
+        with self.assertRaises(ValueError):
+            part.apply('quantize', 8, ('bogus', ))
+
+    def test_order(self):
+        part = EventList([Event(TimeRange(0, 25), Note(60)), Event(TimeRange(25, 44), Note(62)),
+                Event(TimeRange(22, 40), Note(64))], resolution=96)
+        part.apply('quantize', 16, ('straight', ))
+        self.assertEqual([ e.item.pitch for e in part ], [60, 62, 64])
+        self.assertEqual(self.times(part), [(0, 24), (24, 48), (24, 48)])
+
+        # too short notes are kept a step long
+        part = EventList([Event(TimeRange(1, 5), Note(60))], resolution=96)
+        part.apply('quantize', 16)
+        self.assertEqual(self.times(part), [(0, 24)])
+
+    def test_columnar(self):
+        columns = self.part.to_columns().apply('quantize', 16)
+        self.part.apply('quantize', 16)
+        self.assertEqual(repr(columns.to_events()), repr(self.part))
+        self.assertEqual(columns.time, self.part.time)
+
+    def test_voices(self):
+        part = sequence_builder([Event(TimeRange(0, 94), Note(60)), Event(TimeRange(2, 50), Note(64)),
+                Event(TimeRange(46, 98), Note(67))], 96)
+        self.assertEqual(len(part), 1)
+        part.apply('quantize', 16, ('straight', ))
+        self.assertEqual([ [ tuple(e.time) for e in voice ] for voice in part[0] ],
+                [[(0, 48), (48, 96)], [(0, 96)]])
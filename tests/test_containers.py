@@ -1,8 +1,13 @@
 from unittest import TestCase
+from io import BytesIO
+import os
+import random
+import threading
 
-from twiddle.containers import EventList, VoiceList, SequenceError
+from twiddle import containers, functions, midifile
+from twiddle.containers import EventList, VoiceList, ParallelEventList, SequenceError, TimeIndex
 from twiddle.objects import TimeRange, Event, Note
-from twiddle.generators import from_string, from_tuples, sequence_builder, notes_from_tuples
+from twiddle.generators import from_string, from_tuples, sequence_builder, notes_from_tuples, assign_voices
 from twiddle.views import TrackView
 
 class EventListTest(TestCase):
@@ -70,6 +75,26 @@ class EventListTest(TestCase):
         c.extend(f())
         self.assertEqual(c.time, (10, 30))
 
+    def test_ordered_insertion(self):
+        events = [ Event(TimeRange(s, s + l), Note(s, ())) for s, l in ((30, 5), (10, 5), (10, 2), (50, 0), (20, 5), (10, 5)) ]
+
+        c = EventList()
+        for e in events:
+            c.append(e)
+        self.assertEqual([ x.time for x in c ], sorted(x.time for x in events))
+        # equal times keep their insertion order
+        self.assertTrue(c[1] is events[1] and c[2] is events[5])
+
+        c = EventList(resolution=1).extend(events[:3])
+        c.extend(events[3:])
+        self.assertEqual([ x.time for x in c ], sorted(x.time for x in events))
+        self.assertEqual(c.time, (10, 50))
+
+        # a list built out of order is sorted by extend
+        c = EventList(events[:3], resolution=1)
+        c.extend(events[3:4])
+        self.assertEqual([ x.time for x in c ], sorted(x.time for x in events[:4]))
+
     def test_paste(self):
         c = EventList(self.TEST_EVENTS)
         self.assertEqual(c.time, (10, 30))
@@ -111,6 +136,31 @@ class EventListTest(TestCase):
         self.assertEqual(repr(c.slice(TimeRange(15, 20))),
                 "[<1 (15,20)>](15,20)")
 
+        # trimmed events stay in time order
+        c = EventList([Event(TimeRange(10, 30), Note(1, ())), Event(TimeRange(20, 20), 'FOO')])
+        self.assertEqual(repr(c.slice(TimeRange(20, 25))), "[<'FOO' (20)>, <1~ (20,25)>](20,25)")
+
+
+    def test_view(self):
+        c = EventList([Event(TimeRange(0, 50), Note(1, ())), Event(TimeRange(5, 30), Note(2, ())),
+                Event(TimeRange(20, 40), Note(3, ()))], resolution=10)
+        c.add_event(20, "FOO")
+
+        w = TimeRange(10, 40)
+        v = c.view(w)
+        self.assertEqual(repr(v), repr(c.slice(w)))
+        self.assertTrue(v.events()[-1] is c[-1])
+
+        v.add_event(10, "BAR")
+        self.assertEqual(len(c), 4)
+        a, b = v.split(25)
+        x, y = c.slice(w).add_event(10, "BAR").split(25)
+        self.assertEqual(repr(a), repr(x))
+        self.assertEqual(repr(b), repr(y))
+
+        # repeated trimming behaves as repeated slices
+        self.assertEqual(repr(a.split(15)[0]), repr(x.split(15)[0]))
+        self.assertEqual(a.render_section(), x.render_section())
 
     def test_lily_context(self):
         part = from_string('A-2 Bb-1 C-1 D-2 E-1 F-2 G-1 A-2')
@@ -147,6 +197,387 @@ class EventListTest(TestCase):
 
         
 
+class TimeIndexTest(TestCase):
+
+    def setUp(self):
+        rnd = random.Random(42)
+        events = []
+        for i in range(300):
+            start = rnd.randint(0, 500)
+            events.append(Event(TimeRange(start, start + rnd.choice((0, 1, 5, 20, 100))), Note(i, ())))
+        self.events = EventList(resolution=4).extend(events)
+        self.windows = [ TimeRange(s, s + l) for s in range(-10, 620, 7) for l in (0, 1, 10, 50) ]
+
+    def test_index_built(self):
+        self.assertTrue(isinstance(self.events.time_index(), TimeIndex))
+
+        small = EventList([Event(TimeRange(10, 20), Note(1, ()))])
+        self.assertEqual(small.time_index(), None)
+
+        unordered = EventList([ Event(TimeRange(100 - i, 100), Note(i, ())) for i in range(50) ])
+        self.assertEqual(unordered.time_index(), None)
+        self.assertEqual(len(unordered.get(TimeRange(90, 100))), 10)
+
+    def test_queries(self):
+        index = self.events.time_index()
+        for w in self.windows:
+            self.assertEqual([ self.events[i] for i in index.intersecting(w) ],
+                    [ e for e in self.events if w.intersects(e.time) ])
+            self.assertEqual([ self.events[i] for i in index.contained(w) ],
+                    [ e for e in self.events if w.contains(e.time) ])
+
+        for tick in (0, 17, 250, 499):
+            self.assertEqual(list(self.events.get(tick)),
+                    [ e for e in self.events if e.time.start == tick ])
+
+    def test_mutation(self):
+        c = self.events
+        c.time_index()
+        c.append(Event(TimeRange(3, 400), Note(1000, ())))
+        w = TimeRange(300, 310)
+        self.assertTrue(1000 in [ e.item.pitch for e in c.slice(w) ])
+
+        c.remove(TimeRange(0, 250))
+        self.assertEqual([ e for e in c if e.time.start < 250 and e.time.stop <= 250 ], [])
+        self.assertEqual(list(c.get(w)), [ e for e in c if w.contains(e.time) ])
+
+        c.paste(EventList([Event(TimeRange(0, 10), Note(2000, ()))]))
+        self.assertEqual(c.slice(TimeRange(c.time.stop - 5, c.time.stop)).items()[-1].pitch, 2000)
+
+    def test_functions(self):
+        # functions that move events in place drop the index
+        c = EventList([ Event(TimeRange(i * 8, i * 8 + 4), Note(60 + i % 12, ())) for i in range(40) ], resolution=4)
+        self.assertTrue(c.time_index() is not None)
+        functions.extend(c, 4)
+        self.assertEqual(repr(c.slice(TimeRange(4, 8))), repr(EventList(list(c)).slice(TimeRange(4, 8))))
+        self.assertEqual(len(c.slice(TimeRange(4, 8))), 1)
+
+        c.time_index()
+        functions.mark(c, 'A', 'B')
+        self.assertEqual([ e.item for e in c.get(0) ][0], 'A')
+
+class RenderCacheTest(TestCase):
+
+    def setUp(self):
+        rnd = random.Random(7)
+        events = []
+        clock = 0
+        for i in range(200):
+            clock += rnd.choice((0, 0, 0, 4, 8))
+            length = rnd.choice((2, 4, 8, 16))
+            events.append(Event(TimeRange(clock, clock + length), Note(rnd.randint(40, 80), ())))
+            clock += length
+        self.track = EventList(events, resolution=4)
+        self.view = TrackView(4)
+        self.view.set_meter(9, (3, 4))
+        self.view.set_key(20, 'G')
+
+    def assertFresh(self):
+        fresh = EventList(list(self.track), self.track.time, self.track.resolution)
+        self.assertEqual(self.track.render_track(self.view, {}), fresh.render_track(self.view, {}))
+
+    def test_dirty(self):
+        c = self.track
+        self.assertEqual(c.dirty, None)
+        c.render_track(self.view, {})
+        self.assertEqual(c.dirty, [])
+
+        c.add_event(100, 'FOO')
+        c.remove(TimeRange(200, 216))
+        self.assertEqual(c.dirty, [TimeRange(100, 100), TimeRange(200, 216)])
+        self.assertEqual(c.dirty_bars(self.view), [7, 15, 16])
+
+        c.render_track(self.view, {})
+        c.apply('transpose', 1)
+        self.assertEqual(c.dirty, None)
+
+        # called directly, the functions mark what they change too
+        for name, args in (('transpose', (2, )), ('extend', (4, )), ('add_attr', ('!', )),
+                ('group', (2, '[', ']')), ('slur', ()), ('cres', ()), ('mark', ('<<', '>>'))):
+            c.render_track(self.view, {})
+            getattr(functions, name)(c, *args)
+            self.assertEqual(c.dirty, None, name)
+            self.assertFresh()
+
+        # nothing starts at 1, so nothing is touched
+        c.render_track(self.view, {})
+        functions.attribute_list(c, [(1, 'f')])
+        self.assertEqual(c.dirty, [])
+
+    def test_streaming(self):
+        # streamed output reads the cache but doesn't fill it
+        c = self.track
+        text = c.to_lily({ 'track_view': self.view })
+        self.assertEqual(c.dirty, None)
+        self.assertEqual(c.render_track(self.view, {}), text)
+        self.assertEqual(c.dirty, [])
+        c.add_event(100, 'FOO')
+        self.assertEqual(c.to_lily({ 'track_view': self.view }), c.render_track(self.view, {}, cache=False))
+        self.assertEqual(c.dirty, [TimeRange(100, 100)])
+        self.assertFresh()
+
+    def test_edits(self):
+        c = self.track
+        self.assertFresh()
+
+        starts = [ e.time.start for e in c ]
+        functions.attribute_list(c, [(starts[10], 'f'), (starts[150], 'p')])
+        self.assertFresh()
+
+        c.append(Event(TimeRange(43, 47), Note(90, ())))
+        c.replace(TimeRange(300, 316), from_string('C-4 D-4 E-8', resolution=4))
+        self.assertFresh()
+
+        del c[5]
+        self.assertFresh()
+
+        self.view.set_meter(30, (2, 4))
+        self.assertFresh()
+
+class ValidationTest(TestCase):
+
+    def setUp(self):
+        self.part = from_string('C-2 D-2 E-4 F-2', resolution=4)
+
+    def test_validate(self):
+        self.part.validate()
+        self.part[1].time = TimeRange(7, 8)
+        with self.assertRaises(SequenceError):
+            self.part.validate()
+        self.part.validate(2)
+
+        self.part[1].time = TimeRange(30, 40)
+        with self.assertRaises(SequenceError):
+            self.part.validate(1, 2)
+
+        nested = sequence_builder(from_string('C-2 D-2', resolution=4).event_iter(), 4)
+        nested.append(from_string('C-2 D-2', resolution=4, start=4))
+        nested[-1][0].time = TimeRange(7, 8)
+        with self.assertRaises(SequenceError):
+            nested.validate()
+
+        # each voice of a parallel list is checked
+        voices = ParallelEventList(TimeRange(0, 8))
+        list.extend(voices, [ from_string('C-2 D-2', resolution=4), from_string('E-4', resolution=4) ])
+        voices.validate()
+        voices[1][0].time = TimeRange(9, 12)
+        with self.assertRaises(SequenceError):
+            voices.validate()
+        part = from_string('C-2', resolution=4)
+        part.time = TimeRange(0, 8)
+        list.append(part, voices)
+        with self.assertRaises(SequenceError):
+            part.validate()
+
+    def test_local(self):
+        self.assertEqual(containers.validation_mode(), containers.OFF)
+        with containers.validation():
+            self.part.append(Event(TimeRange(1, 2), Note(60)))
+            self.part[2] = Event(TimeRange(2, 3), Note(60))
+            with self.assertRaises(SequenceError):
+                self.part[2] = Event(TimeRange(9, 10), Note(60))
+            with self.assertRaises(SequenceError):
+                self.part[1:3] = [Event(TimeRange(9, 10), Note(60))]
+        self.assertEqual(containers.validation_mode(), containers.OFF)
+
+        # checks are off outside the block
+        self.part[0] = Event(TimeRange(9, 10), Note(60))
+
+        # and in other threads
+        found = []
+        def change():
+            found.append(containers.validation_mode())
+            self.part[1] = Event(TimeRange(0, 1), Note(60))
+        with containers.validation():
+            t = threading.Thread(target=change)
+            t.start()
+            t.join()
+        self.assertEqual(found, [containers.OFF])
+
+    def test_deferred(self):
+        with self.assertRaises(SequenceError):
+            with containers.validation(containers.DEFERRED):
+                self.part.append(Event(TimeRange(1, 2), Note(60)))
+                self.part[0] = Event(TimeRange(9, 10), Note(60))
+                self.part[0] = Event(TimeRange(0, 1), Note(60))
+                self.part[1] = Event(TimeRange(9, 10), Note(60))
+        self.assertEqual(getattr(containers._local, 'deferred', None), None)
+
+        with containers.validation(containers.DEFERRED):
+            self.part[1] = Event(TimeRange(1, 2), Note(60))
+
+        with self.assertRaises(ValueError):
+            with containers.validation('sometimes'):
+                pass
+
+    def test_deferred_threads(self):
+        # as if TWIDDLE_VALIDATE=deferred: changes in any thread wait for exit
+        saved = containers._default_mode
+        containers._default_mode = containers.DEFERRED
+        try:
+            def change():
+                self.part[0] = Event(TimeRange(9, 10), Note(60))
+            t = threading.Thread(target=change)
+            t.start()
+            t.join()
+            self.assertEqual(len(containers._pending), 1)
+            with self.assertRaises(SequenceError):
+                containers.validate_deferred()
+            self.assertEqual(len(containers._pending), 0)
+        finally:
+            containers._default_mode = saved
+
+        # a block in another thread doesn't take them
+        with containers.validation(containers.DEFERRED):
+            self.part[0] = Event(TimeRange(0, 1), Note(60))
+            t = threading.Thread(target=containers.validate_deferred)
+            t.start()
+            t.join()
+            self.assertEqual(len(containers._local.deferred), 1)
+
+    def test_environment(self):
+        saved = os.environ.get('TWIDDLE_VALIDATE')
+        try:
+            for value, mode in (('LOCAL', 'local'), ('', 'off'), ('bogus', 'off')):
+                os.environ['TWIDDLE_VALIDATE'] = value
+                self.assertEqual(containers._mode_from_environment(), mode)
+        finally:
+            if saved is None:
+                del os.environ['TWIDDLE_VALIDATE']
+            else:
+                os.environ['TWIDDLE_VALIDATE'] = saved
+
+class VoiceSeparationTest(TestCase):
+
+    TEST_NOTES = (
+      (0, 10, 57),
+      (0, 10, 57),
+      (10, 20, 59),
+      (15, 40, 60),
+      (30, 50, 62),
+      (45, 55, 64),
+      (45, 55, 65),
+      (55, 70, 67),
+      (80, 90, 69)
+    )
+
+    def events(self, seq):
+        return [ Event(TimeRange(start, stop), Note(pitch)) for start, stop, pitch in seq ]
+
+    def test_build(self):
+        c = sequence_builder(self.events(self.TEST_NOTES), 10)
+        self.assertEqual(c.time, (0, 90))
+        self.assertEqual(len(c), 4)
+
+        parallel = c[1]
+        self.assertTrue(isinstance(parallel, ParallelEventList))
+        self.assertEqual(parallel.time, (10, 55))
+        self.assertEqual([ [ e.item.pitch for e in voice ] for voice in parallel ],
+                [[59, 62], [60, [64, 65]]])
+        self.assertEqual([ voice.time for voice in parallel ], [(10, 55), (10, 55)])
+
+        self.assertEqual(len(list(c.note_iter())), 7)
+        # note_events() keeps to the notes in sequence
+        self.assertEqual([ e.item.pitch for e in c.note_events() ], [[57], 67, 69])
+        self.assertEqual(c.slice(TimeRange(20, 60))[0].time, (20, 55))
+
+    def test_render(self):
+        c = sequence_builder(self.events([(0, 4, 60), (0, 2, 64), (2, 4, 67), (4, 8, 72)]), 4)
+        self.assertEqual(c.render_section(),
+                "{ << { e'8 g'8 } \\\\ { c'4 } >> c''4 }")
+
+    def test_slice(self):
+        c = sequence_builder(self.events([(0, 4, 60), (2, 6, 64), (8, 12, 67)]), 4)
+        text = "{ << { c'4 r8 } \\\\ { r8 e'4 } >> r8 g'4 }"
+        self.assertEqual(c.render_section(), text)
+        self.assertEqual(c.clone().render_section(), text)
+        self.assertEqual(c[0].slice(TimeRange(2, 20)).time, (2, 6))
+        self.assertEqual([ v.time for v in c[0].slice(TimeRange(2, 20)) ], [(2, 6), (2, 6)])
+
+        # the voices don't run on to the end of a section
+        c = sequence_builder(self.events([(0, 8, 60), (4, 12, 64), (16, 24, 67)]), 4)
+        view = TrackView(4)
+        view.set_meter(2, (2, 4))
+        self.assertEqual(c.render_track(view, {}).split("\n")[3], r" \key c \major << { c'2 r4 } \\ { r4 e'2 } >> r4 | }")
+
+    def test_add_attr(self):
+        c = sequence_builder(self.events(self.TEST_NOTES), 10)
+        functions.add_attr(c, '!')
+        self.assertEqual(set(( e.item.attr for e in c.note_iter() )), set([('!', )]))
+        self.assertEqual(len(list(c.note_iter())), 7)
+
+    def test_resolution(self):
+        c = sequence_builder(self.events([(0, 4, 60), (2, 6, 64), (8, 12, 67)]), 4)
+        c.add_event(8, 'FOO')
+        doubled = EventList(c.at_resolution(8), resolution=8)
+        self.assertEqual(repr(doubled), "[[[<60 (0,8)>](0,12), [<64 (4,12)>](0,12)], <'FOO' (16)>, <67 (16,24)>](0,24)")
+        self.assertEqual(doubled[0].time, (0, 12))
+        self.assertEqual(doubled.render_section(), c.render_section())
+        self.assertEqual(doubled[0][0].resolution, 8)
+
+    def test_extend(self):
+        # notes stop at the voices, which are filled up to their own end
+        c = sequence_builder(self.events([(0, 3, 72), (4, 8, 60), (6, 10, 64), (12, 16, 67)]), 4)
+        c.apply('extend', 4)
+        self.assertEqual(c.render_section(), "{ c''4 << { c'4. } \\\\ { r8 e'4 } >> r8 g'4 | }")
+
+    def test_flat_forms(self):
+        c = sequence_builder(self.events(self.TEST_NOTES), 10)
+        events = sorted(c.event_iter(), key=lambda e: e.time)
+
+        f = BytesIO()
+        midifile.write_midifile(f, [c], 10)
+        f.seek(0)
+        found = VoiceList.from_midi(f, 1)['TrackA']
+        notes = lambda x: sorted(( (e.time, e.item.pitch if isinstance(e.item.pitch, list) else [e.item.pitch])
+            for e in x.note_iter() ))
+        self.assertEqual(notes(found), notes(c))
+
+        try:
+            columns = c.to_columns()
+        except ImportError:
+            return
+        self.assertEqual(notes(columns.to_events()), notes(c))
+        self.assertEqual([ e.time for e in columns.to_events() ], [ e.time for e in events ])
+
+    def test_dense(self):
+        rnd = random.Random(7)
+        seq = []
+        for i in range(500):
+            start = rnd.randrange(0, 1000)
+            seq.append((start, start + rnd.randrange(1, 40), rnd.randrange(40, 90)))
+
+        c = sequence_builder(self.events(seq), 96)
+        found = sorted(( (e.time.start, e.time.stop, p) for e in c.note_iter()
+                for p in (e.item.pitch if isinstance(e.item.pitch, list) else [e.item.pitch]) ))
+        self.assertEqual(found, sorted(set(seq)))
+
+        for x in c:
+            if not isinstance(x, ParallelEventList): continue
+            for voice in x:
+                for a, b in zip(voice, voice[1:]):
+                    self.assertTrue(a.time.stop <= b.time.start)
+            # the fewest voices is the most events sounding at once
+            starts = sorted(( e.time.start for e in x.event_iter() ))
+            depth = max(( sum(( 1 for e in x.event_iter() if e.time.start <= t < e.time.stop )) for t in starts ))
+            self.assertEqual(len(x), depth)
+
+        self.assertFalse('<<' in sequence_builder(from_string('C-2 D-2 E-4'), 1).render_section())
+
+    def test_assign_voices(self):
+        voices = assign_voices(self.events([(0, 10, 1), (0, 5, 2), (5, 10, 3), (2, 4, 4), (10, 12, 5)]))
+        self.assertEqual([ [ e.item.pitch for e in v ] for v in voices ], [[1, 5], [2, 3], [4]])
+
+    def test_sequential(self):
+        part = EventList(self.events(self.TEST_NOTES), resolution=10)
+        part.apply('sequential')
+        self.assertTrue(isinstance(part[1], ParallelEventList))
+        self.assertEqual(len(list(part.note_iter())), 7)
+
+        part.apply('flatten')
+        self.assertEqual(len(part), 7)
+        self.assertEqual(part.time, (0, 90))
+
 class VoiceListTest(TestCase):
     
     def setUp(self):
@@ -166,6 +597,54 @@ class VoiceListTest(TestCase):
         s = self.parts.slice(TimeRange(15, 35))
         self.assertEqual(s['One'].to_lily(), "b8 c4 d8~")
 
+    def test_write_lily(self):
+        expected = self.parts.to_lily()
+        self.assertEqual(self.parts.write_lily(BytesIO()).getvalue(), expected)
+
+        view = TrackView(resolution=10)
+        track = self.parts['Two']
+        self.assertEqual(track.write_lily(BytesIO(), {'track_view': view}).getvalue(),
+                track.to_lily({'track_view': view}))
+
+    def check_executor(self, executor):
+        view = TrackView(resolution=10)
+        expected = self.parts.to_lily({'track_view': view})
+        parts = VoiceList(self.parts, executor)
+
+        self.assertEqual(parts.to_lily({'track_view': view}), expected)
+        self.assertEqual(parts.write_lily(BytesIO(), {'track_view': view}).getvalue(), expected)
+        self.assertEqual(parts.slice(TimeRange(15, 35))['One'].to_lily(), "b8 c4 d8~")
+        self.assertEqual(parts.get(TimeRange(15, 40))['Two'].to_lily(), "g4")
+
+        # queries leave the tracks alone
+        for name in parts:
+            self.assertTrue(dict.__getitem__(parts, name) is self.parts[name])
+
+        # changes made by the tasks are kept
+        parts.add_event(20, 'FOO')
+        parts.apply('transpose', 12)
+        self.assertEqual(parts['One'].items()[2], 'FOO')
+        self.assertEqual(parts['Two'][0].item.pitch, 64)
+        self.assertEqual(parts.slice(TimeRange(0, 10)).executor, executor)
+
+    def test_thread_executor(self):
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(2)
+        try:
+            self.check_executor(pool)
+        finally:
+            pool.close()
+            pool.join()
+
+    def test_process_executor(self):
+        from multiprocessing import Pool
+        pool = Pool(2)
+        try:
+            self.check_executor(pool)
+        finally:
+            pool.close()
+            pool.join()
+
 
 """
 class SequentialContainerTest(TestCase):
@@ -0,0 +1,112 @@
+from unittest import TestCase
+
+from twiddle.containers import EventList
+from twiddle.objects import TimeRange, Event, Note
+from twiddle.generators import from_string, sequence_builder
+from twiddle import diff
+from twiddle.diff import _key
+
+class DiffTest(TestCase):
+
+    def setUp(self):
+        self.a = from_string('C-4 D-4 E-4 F-4 G-8 A-8 B-16 C-16', resolution=4)
+        self.a.add_event(16, 'FOO')
+        self.track_view = self.a.get_track_view()
+
+    def check_patch(self, a, b):
+        d = a.diff(b, self.track_view)
+        patched = d.apply(a.clone())
+        items = {}
+        self.assertEqual([ _key(e, items) for e in patched ], [ _key(e, items) for e in b ])
+        return d
+
+    def test_same(self):
+        d = self.a.diff(self.a.clone())
+        self.assertFalse(d)
+        self.assertEqual(d.bars, [])
+        # notes aren't compared by identity
+        b = EventList([ Event(e.time, Note(e.item.pitch)) if isinstance(e.item, Note) else e
+            for e in self.a ], resolution=4)
+        self.assertFalse(self.a.diff(b))
+
+    def test_changes(self):
+        b = from_string('C-4 D-4 E-4 F-4 G-8 A-4 G-4 B-16 C-8', resolution=4)
+        b.add_event(16, 'FOO')
+        d = self.check_patch(self.a, b)
+        self.assertEqual([ x.bar for x in d.bars ], [2, 4])
+
+        bar = d.bars[0]
+        self.assertEqual(bar.removed, [])
+        self.assertEqual(bar.inserted, [b[7]])
+        self.assertEqual(bar.modified, [(self.a[6], b[6])])
+        self.assertEqual(d.bars[1].modified, [(self.a[8], b[9])])
+        self.assertEqual(d.patch[0][0], TimeRange(16, 32))
+
+        # removing the instruction
+        b = self.a.clone()
+        del b[4]
+        d = self.check_patch(self.a, b)
+        self.assertEqual(d.bars[0].removed, [self.a[4]])
+
+    def test_collisions(self):
+        b = from_string('C-4 D-4 E-4 F-4 G-8 A-4 G-4 B-16 C-8', resolution=4)
+        b.add_event(16, 'FOO')
+        # every bar hashes the same, so the keys tell them apart
+        diff.hash = lambda x: 0
+        try:
+            d = self.check_patch(self.a, b)
+        finally:
+            del diff.hash
+        self.assertEqual([ x.bar for x in d.bars ], [2, 4])
+
+    def test_marker_at_window_stop(self):
+        a = EventList([Event(TimeRange(0, 16), Note(60)), Event(TimeRange(16, 16), 'X'),
+            Event(TimeRange(32, 48), Note(70))], resolution=4)
+        b = a.clone()
+        b[0] = Event(TimeRange(0, 16), Note(62))
+        # the marker on the next bar line is left alone rather than written twice
+        d = self.check_patch(a, b)
+        self.assertEqual(d.patch[0][0], TimeRange(0, 16))
+        self.assertEqual(repr(d.apply(a.clone())), repr(b))
+
+    def test_plain_items(self):
+        class Marker(object):
+            def __init__(self, text):
+                self.text = text
+            def __repr__(self):
+                return "Marker(%r)" % self.text
+
+        b = self.a.clone()
+        b.append(Event(TimeRange(60, 60), Marker('x')))
+        c = self.a.clone()
+        c.append(Event(TimeRange(60, 60), Marker('y')))
+        self.assertEqual(diff._item_key(Marker('x')), ('Marker', "Marker('x')"))
+        self.assertFalse(b.diff(b.clone(), self.track_view))
+        self.assertEqual([ x.bar for x in b.diff(c, self.track_view).bars ], [4])
+
+    def test_tied(self):
+        # a note crossing into bar 3 takes the window with it
+        b = from_string('C-4 D-4 E-4 F-4 G-8 A-12 B-12 C-16', resolution=4)
+        b.add_event(16, 'FOO')
+        d = self.check_patch(self.a, b)
+        self.assertEqual([ x.bar for x in d.bars ], [2, 3])
+        self.assertEqual(len(d.patch), 1)
+
+        b = self.a.clone()
+        b.append(Event(TimeRange(28, 40), Note(72)))
+        d = self.check_patch(self.a, b)
+        self.assertEqual(d.patch[0][0], TimeRange(16, 40))
+
+    def test_resolution(self):
+        b = EventList(self.a.at_resolution(8), resolution=8)
+        self.assertFalse(self.a.diff(b))
+
+    def test_voices(self):
+        events = [ Event(TimeRange(0, 8), Note(60)), Event(TimeRange(0, 4), Note(64)),
+                Event(TimeRange(4, 8), Note(67)), Event(TimeRange(16, 20), Note(72)) ]
+        a = sequence_builder(events, 4)
+        events[2] = Event(TimeRange(4, 8), Note(65))
+        b = sequence_builder(events, 4)
+        d = self.check_patch(a, b)
+        self.assertEqual(d.bars[0].modified, [(a[0], b[0])])
+        self.assertEqual(d.apply(a.clone()).to_lily(), b.to_lily())
@@ -1,6 +1,8 @@
 from unittest import TestCase
+from io import BytesIO
 
 from twiddle import lily
+from twiddle.objects import Raw
 
 class LilyTest(TestCase):
 
@@ -20,3 +22,25 @@ class LilyTest(TestCase):
 
         for d, expected in TESTS:
             self.assertEqual(lily.duration_to_length(d, 96), expected)
+
+    def test_tables(self):
+        self.assertEqual(lily.int_to_note(61), "cis'")
+        self.assertEqual(lily.int_to_note(61, -1), "des'")
+        self.assertEqual(lily.int_to_note([60, 64], 'c'), "<c' e'>")
+        self.assertRaises(IndexError, lily.int_to_note, 200)
+
+        table = lily.duration_table(96)
+        self.assertTrue(table is lily.duration_table(96))
+        self.assertEqual(table[96+48+24], '4..')
+        self.assertFalse(100 in table)
+        self.assertEqual(lily.duration_to_length(100, 96), lily.length_token(100, 96))
+
+    def test_blocks(self):
+        staff = lily.PianoStaff([lily.Staff([Raw('a')]), lily.Staff([Raw('b')])])
+        expected = "\\new PianoStaff <<\n\\new Staff {\n% raw output\na\n% end raw output\n\n}" \
+                "\n\\new Staff {\n% raw output\nb\n% end raw output\n\n}\n>>"
+        self.assertEqual(staff.to_lily(), expected)
+        self.assertEqual(staff.write_lily(BytesIO()).getvalue(), expected)
+
+        with self.assertRaises(Exception):
+            lily.Staff().to_lily()
@@ -0,0 +1,66 @@
+from unittest import TestCase
+from io import BytesIO
+import sys
+
+from twiddle import memory
+from twiddle.containers import VoiceList
+from twiddle.objects import TimeRange, Event, Note
+from twiddle.generators import from_string
+
+class MemoryTest(TestCase):
+
+    def setUp(self):
+        self.part = from_string('C-2 D-2 C-2 D-2 E-4', resolution=4)
+        self.part.add_event(4, 'FOO')
+        self.part.append(Event(TimeRange(12, 14), Note([60, 64], ('!', ))))
+
+    def test_report(self):
+        r = self.part.memory_report()
+        self.assertEqual((r['events'], r['notes']), (7, 6))
+        categories = r['categories']
+        self.assertEqual(categories['events']['count'], 7)
+        self.assertEqual(categories['objects']['count'], 1)
+        # C and D are shared, so 4 notes plus their pitches and the chord's list
+        self.assertEqual(categories['notes']['count'], 4 + 3 + 1 + 2)
+        self.assertEqual(r['bytes'], sum(( c['bytes'] for c in categories.values() )))
+        self.assertTrue(r['bytes_per_note'] > 0)
+
+        self.part.render_track()
+        self.assertTrue(self.part.memory_report()['categories']['render_cache']['bytes'] > 0)
+
+    def test_columns(self):
+        try:
+            columns = self.part.to_columns()
+        except ImportError:
+            return
+        r = memory.report(columns)
+        self.assertEqual((r['events'], r['notes']), (7, 6))
+        self.assertEqual(r['categories']['columns']['bytes'], columns.nbytes)
+
+    def test_voices(self):
+        voices = VoiceList()
+        voices['a'] = self.part
+        voices['b'] = from_string('C-2 D-2', resolution=4)
+        r = voices.memory_report()
+        self.assertEqual(sorted(r['tracks']), ['a', 'b'])
+        self.assertEqual(r['notes'], 8)
+        # the notes of b are shared with a
+        self.assertTrue(r['bytes'] < r['tracks']['a']['bytes'] + r['tracks']['b']['bytes'])
+
+        out = BytesIO()
+        memory.write_report(r, out)
+        self.assertTrue('bytes per note' in out.getvalue())
+
+    def test_allocations(self):
+        with memory.allocations() as found:
+            kept = [ Event(TimeRange(i, i + 1), Note([i])) for i in range(1000) ]
+        self.assertTrue(found.method in ('tracemalloc', 'objects'))
+        self.assertTrue(found.top)
+        if found.method == 'objects':
+            events = [ x for x in found.top if x[0] == 'Event' ]
+            self.assertEqual(events, [('Event', 1000 * sys.getsizeof(kept[0]), 1000)])
+            self.assertTrue(found.bytes >= events[0][1])
+
+        out = BytesIO()
+        memory.write_allocations(found, out)
+        self.assertTrue(out.getvalue().startswith('%d bytes' % found.bytes))
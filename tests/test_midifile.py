@@ -0,0 +1,76 @@
+from unittest import TestCase
+from io import BytesIO
+
+from twiddle import midifile
+from twiddle.containers import VoiceList
+from twiddle.generators import from_string, notes_from_midi
+from twiddle.objects import Event, Note, TimeRange
+
+class MidiFileTest(TestCase):
+
+    def test_vlq(self):
+        for value in (0, 0x40, 0x7F, 0x80, 0x2000, 0x3FFF, 0x4000, 0x0FFFFFFF):
+            data = midifile.write_vlq(value)
+            self.assertEqual(midifile.read_vlq(data, 0), (value, len(data)))
+
+    def test_running_status(self):
+        track = bytearray([
+            0x00, 0x90, 60, 100,    # note on
+            0x00, 64, 100,          # running status note on
+            0x00, 0xFF, 0x51, 0x03, 0x07, 0xA1, 0x20, # tempo (meta keeps status)
+            0x60, 60, 0,            # note on velocity 0
+            0x10, 0x80, 64, 0,      # note off
+            0x00, 0xFF, 0x2F, 0x00,
+        ])
+        self.assertEqual(list(midifile.note_messages(track)),
+                [(0, 60, 100), (0, 64, 100), (96, 60, 0), (112, 64, 0)])
+
+        notes = list(midifile.track_notes(track, quantize=24))
+        self.assertEqual([ (e.time, e.item.pitch) for e in notes ], [((0, 96), 60), ((0, 120), 64)])
+
+        with self.assertRaises(midifile.MidiError):
+            list(midifile.note_messages(bytearray([0x00, 60, 100])))
+
+    def test_bad_data(self):
+        for track in ([0x00, 0xF2, 0x00, 0x00], [0x00, 0xF6], [0x00, 0x90, 60], [0x00, 0x90, 60, 100, 0x81]):
+            with self.assertRaises(midifile.MidiError):
+                list(midifile.note_messages(bytearray(track)))
+
+        f = BytesIO()
+        midifile.write_midifile(f, [from_string('C-2 D-2', resolution=4)], 4)
+        with self.assertRaises(midifile.MidiError):
+            midifile.parse_midifile(f.getvalue()[:10])
+        with self.assertRaises(midifile.MidiError):
+            VoiceList.from_midi(BytesIO(f.getvalue()[:-6]))
+
+    def test_round_trip(self):
+        melody = from_string('A-2 Bb-1 R-1 D-2 E-1', resolution=96)
+        for e in melody:
+            e.time *= 96
+        chords = [Event(TimeRange(0, 192), Note([60, 64, 67], ()))]
+
+        f = BytesIO()
+        midifile.write_midifile(f, [melody, chords], resolution=96)
+        f.seek(0)
+
+        pattern = midifile.read_midifile(f)
+        self.assertEqual((pattern.format, pattern.resolution, len(pattern)), (1, 96, 2))
+        self.assertEqual([ (e.time, e.item.pitch) for e in notes_from_midi(pattern.tracks[0]) ],
+                [ (e.time, e.item.pitch) for e in melody ])
+
+        f.seek(0)
+        voices = VoiceList.from_midi(f)
+        self.assertEqual(voices['TrackA'].to_lily(), melody.to_lily())
+        chord, = voices['TrackB']
+        self.assertEqual((chord.time, sorted(chord.item.pitch)), ((0, 192), [60, 64, 67]))
+
+        f.seek(0)
+        parallel = VoiceList.from_midi(f, workers=2)
+        self.assertEqual(sorted(parallel), sorted(voices))
+        for name in voices:
+            self.assertEqual(repr(parallel[name]), repr(voices[name]))
+            self.assertEqual(parallel[name].resolution, 96)
+
+    def test_pack(self):
+        events = [Event(TimeRange(0, 10), Note(60, ())), Event(TimeRange(10, 20), Note([60, 64], ()))]
+        self.assertEqual(repr(list(midifile.unpack_events(midifile.pack_events(events)))), repr(events))
@@ -1,4 +1,5 @@
 from unittest import TestCase
+from twiddle import objects
 from twiddle.objects import *
 
 class TimeRangeTest(TestCase):
@@ -48,6 +49,25 @@ class TimeRangeTest(TestCase):
         t = TimeRange(12, 24)
         self.assertEqual(t - 3, (9, 21))
 
+    def test_interned(self):
+        a = TimeRange.interned(1000, 2000)
+        self.assertTrue(isinstance(a, TimeRange))
+        self.assertTrue(TimeRange.interned(1000, 2000) is a)
+        # neighbours share their boundary
+        self.assertTrue(TimeRange.interned(2000, 3000).start is a.stop)
+
+        table = InternTable(lambda x: x, size=2)
+        for x in (1, 2, 3):
+            table[x]
+        self.assertEqual(len(table), 1)
+
+        # attribute sets stay unique, as they compare by identity
+        table = InternTable(lambda x: x, size=None)
+        for x in (1, 2, 3):
+            table[x]
+        self.assertEqual(len(table), 3)
+        self.assertTrue(objects.ATTRS.size is None)
+
 class EventTest(TestCase):
 
     def test_attr(self):
@@ -60,6 +80,60 @@ class EventTest(TestCase):
         self.assertEqual(e1.time, (10, 20)) 
         self.assertEqual(e2.time, (25, 35))
 
+    def test_shared_notes(self):
+        a = Event(TimeRange(0, 10), Note.interned(60))
+        b = Event(TimeRange(10, 20), Note.interned(60, []))
+        self.assertTrue(a.item is b.item)
+
+        # copy on write
+        a.add_attr('(')
+        self.assertEqual(a.item.attr, ('(', ))
+        self.assertEqual(b.item.attr, ())
+        self.assertTrue(a.item is Note.interned(60, ('(', )))
+        a.remove_attr('(')
+        self.assertTrue(a.item is b.item)
+
+        self.assertEqual(b.item.transposed(2).pitch, 62)
+        self.assertEqual(b.item.pitch, 60)
+        chord = Note([60, 64])
+        self.assertFalse(Note.interned([60, 64]) is Note.interned([60, 64]))
+        self.assertEqual(chord.transposed(1).pitch, [61, 65])
+
+        # attribute tuples are always shared
+        self.assertTrue(Note(1, ('!', )).attr is Note(2, ['!']).attr)
+
+        with self.assertRaises(AttributeError):
+            Event(TimeRange(0, 0), Instruction('x')).add_attr('(')
+
+    def test_attribute_sets(self):
+        empty = AttributeSet.get(())
+        slurred = empty.add('(')
+        self.assertTrue(slurred is AttributeSet.get(['(']))
+        self.assertTrue(empty.add('(') is slurred)
+        self.assertTrue(slurred.add('-.').remove('(') is empty.add('-.'))
+        self.assertEqual(slurred.add('-.').suffix, '(-.')
+
+        # the attr tuple still reads, but notes are never changed in place
+        note = Note(60, slurred)
+        self.assertEqual(note.attr, ('(', ))
+        with self.assertRaises(AttributeError):
+            note.attr = ('[', ']')
+        with self.assertRaises(AttributeError):
+            note.add_attr('[')
+        note = note.without_attr('(').with_attr('[').with_attr(']')
+        self.assertTrue(note.attrs is AttributeSet.get(('[', ']')))
+        self.assertEqual(repr(note), '60[]')
+
+        chord = Note(60, ('(', )) & Note(64, ('(', '!'))
+        self.assertEqual(sorted(chord.attr), ['!', '('])
+        self.assertTrue(chord.attrs is Note(62, ('(', )).attrs.merge(AttributeSet.get(('(', '!'))))
+
+        import pickle
+        copy = pickle.loads(pickle.dumps(note, 2))
+        self.assertTrue(copy is note)
+        copy = pickle.loads(pickle.dumps(chord, 2))
+        self.assertTrue(copy.attrs is chord.attrs)
+
 class ObjectTest(TestCase):
 
     def test_keysignature(self):
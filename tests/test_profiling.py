@@ -0,0 +1,65 @@
+from unittest import TestCase
+from io import BytesIO
+
+from twiddle import midifile, profiling
+from twiddle.containers import VoiceList
+from twiddle.generators import from_string
+
+class ProfilingTest(TestCase):
+
+    def setUp(self):
+        profiling.reset()
+        profiling.enable()
+
+    def tearDown(self):
+        profiling.disable()
+        profiling.reset()
+
+    def test_disabled(self):
+        profiling.disable()
+        self.assertTrue(profiling.span('a') is profiling.NULL_SPAN)
+        items = [1, 2]
+        self.assertTrue(profiling.timed_iter('a', items) is items)
+        with profiling.span('a'):
+            pass
+        self.assertEqual(profiling.stats, {})
+
+    def test_nesting(self):
+        seen = []
+        hook = lambda path, elapsed: seen.append(path)
+        profiling.add_hook(hook)
+        try:
+            with profiling.span('outer'):
+                for i in range(2):
+                    with profiling.span('inner'):
+                        pass
+        finally:
+            profiling.remove_hook(hook)
+
+        self.assertEqual(seen, [('outer', 'inner'), ('outer', 'inner'), ('outer', )])
+        count, total, own = profiling.stats[('outer', )]
+        self.assertEqual(count, 1)
+        self.assertTrue(own <= total)
+        self.assertEqual(profiling.stats[('outer', 'inner')][0], 2)
+
+        lines = BytesIO()
+        profiling.write_collapsed(lines)
+        self.assertEqual([ l.split(' ')[0] for l in lines.getvalue().splitlines() ], ['outer', 'outer;inner'])
+
+    def test_timed_iter(self):
+        self.assertEqual(list(profiling.timed_iter('gen', iter(range(3)))), [0, 1, 2])
+        # one call per item and one for the exhausted generator
+        self.assertEqual(profiling.stats[('gen', )][0], 4)
+
+    def test_pipeline(self):
+        f = BytesIO()
+        midifile.write_midifile(f, [from_string("C-2 D-2 E-2 R-2 F-2 G-2 A-4")])
+        f.seek(0)
+        voices = VoiceList.from_midi(f, quantize=1)
+        voices['TrackA'].render_track()
+
+        stages = set(( x[0] for x in profiling.summary() ))
+        for name in ('midi.read', 'midi.decode', 'midi.chords', 'midi.build', 'sections', 'render', 'rests'):
+            self.assertTrue(name in stages, name)
+        # the rests are timed as they are made, one rest and the end of the gap
+        self.assertEqual(profiling.stats[('render', 'rests')][0], 2)
@@ -0,0 +1,101 @@
+from unittest import TestCase
+import json
+import os
+import shutil
+import tempfile
+import threading
+import httplib
+from io import BytesIO
+
+from twiddle import server, midifile
+from twiddle.containers import VoiceList
+from twiddle.generators import from_string
+from twiddle.views import TrackView
+
+class ServerTest(TestCase):
+
+    def setUp(self):
+        f = BytesIO()
+        midifile.write_midifile(f, [from_string('C-2 D-2 E-4 F-2 G-6', resolution=4)], 4)
+        self.data = f.getvalue()
+        self.servers = []
+
+    def tearDown(self):
+        for s, converter in self.servers:
+            s.shutdown()
+            s.server_close()
+            converter.close()
+
+    def start(self, workers=0, path=None):
+        converter = server.Converter(workers)
+        s = server.make_server(converter, port=0, path=path)
+        t = threading.Thread(target=s.serve_forever)
+        t.daemon = True
+        t.start()
+        self.servers.append((s, converter))
+        return s
+
+    def expected(self, quantize=48, **kwargs):
+        voices = VoiceList.from_midi(BytesIO(self.data), quantize)
+        return voices.to_lily({'track_view': TrackView(voices.resolution, **kwargs)})
+
+    def test_parse_options(self):
+        self.assertEqual(server.parse_options('meter=3/4&key=F&quantize=1'),
+                { 'quantize': 1, 'meter': (3, 4), 'key': 'F', 'partial': 0 })
+        for query in ('meter=3', 'key=H', 'quantize=x', 'quantize=0', 'colour=red'):
+            with self.assertRaises(server.RequestError):
+                server.parse_options(query)
+
+    def test_render(self):
+        s = self.start()
+        port = s.server_address[1]
+        self.assertEqual(server.request(self.data, port=port, quantize=1), self.expected(1))
+        self.assertEqual(server.request(self.data, port=port, quantize=1, meter='3/4', key='F'),
+                self.expected(1, meter=(3, 4), key='F'))
+
+        with self.assertRaises(server.RequestError):
+            server.request(self.data, port=port, key='H')
+        connection = httplib.HTTPConnection('127.0.0.1', port)
+        connection.request('POST', '/render', b'not a midi file')
+        response = connection.getresponse()
+        self.assertEqual((response.status, response.read()), (400, "Bad MIDI file: Not a MIDI file\n"))
+        connection.close()
+
+        connection = httplib.HTTPConnection('127.0.0.1', port)
+        connection.request('GET', '/status')
+        status = json.loads(connection.getresponse().read())
+        connection.close()
+        self.assertEqual((status['requests'], status['errors']), (3, 1))
+        # the file was only parsed once
+        self.assertEqual(status['cache']['hits'], 1)
+
+    def test_unix_socket(self):
+        d = tempfile.mkdtemp()
+        try:
+            path = os.path.join(d, 'twiddle.sock')
+            self.start(path=path)
+            self.assertEqual(server.request(self.data, path=path, quantize=1), self.expected(1))
+
+            # anything else at the path is left alone
+            other = os.path.join(d, 'twiddle.txt')
+            open(other, 'w').close()
+            with self.assertRaises(IOError):
+                server.make_server(None, path=other)
+            self.assertFalse(server.remove_socket(other))
+            self.assertTrue(os.path.exists(other))
+        finally:
+            shutil.rmtree(d)
+
+    def test_workers(self):
+        s = self.start(workers=1)
+        self.assertEqual(server.request(self.data, port=s.server_address[1]), self.expected())
+        # the MidiError comes back from the worker
+        with self.assertRaisesRegexp(server.RequestError, '^400 '):
+            server.request(self.data[:-6], port=s.server_address[1])
+
+    def test_lru(self):
+        lru = server.LRU(2)
+        for key in 'abac':
+            lru.get(key, lambda: key.upper())
+        self.assertEqual(list(lru.items), ['a', 'c'])
+        self.assertEqual((lru.hits, lru.misses), (1, 3))
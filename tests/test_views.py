@@ -1,6 +1,7 @@
 from unittest import TestCase
 
 from twiddle.containers import EventList
+from twiddle import views
 from twiddle.views import TrackView, Boundary
 from twiddle.objects import Note, Event, TimeRange
 
@@ -33,6 +34,20 @@ class BoundaryTest(TestCase):
         self.assertEqual(rest_output(54, 96), "r4 r2 | R1*3 | r4")
         self.assertEqual(rest_output(51, 48), "r8 r4 r2 | R1 | r8")
 
+    def test_rest_cache(self):
+        b = Boundary(3, 48, 24, 4)
+
+        first = list(b.get_rests(54, 48))
+        again = list(b.get_rests(54 + 24 * 5, 48))
+        self.assertEqual(len(b._rest_shapes), 1)
+        self.assertEqual([ (x.time + 24 * 5, type(x.item)) for x in first ],
+                [ (x.time, type(x.item)) for x in again ])
+        self.assertEqual([ x.item.bar for x in again if hasattr(x.item, 'bar') ], [9, 10])
+
+        for i in range(views.REST_CACHE_SIZE + 1):
+            b.rest_shape(0, i + 1)
+        self.assertTrue(len(b._rest_shapes) <= views.REST_CACHE_SIZE)
+
     def test_split_note(self):
         b = Boundary(3, 48, 24, 4)
 
@@ -91,6 +106,39 @@ class TrackViewTest(TestCase):
         self.assertEqual(c.beat(4), 33)
         self.assertEqual(c.beat(4, 4), 42)
 
+    def test_beat_within_meter(self):
+        c = TrackView(1, meter=(3, 4))
+        c.set_meter(3, meter=(2, 4))
+        c.set_meter(4, meter=(3, 4))
+
+        self.assertEqual([ c.beat(n) for n in range(1, 7) ], [0, 3, 6, 8, 11, 14])
+        self.assertEqual(c.beat(2, 3), 5)
+
+    def test_incremental_meter(self):
+        c = TrackView(3, meter=(3, 4), partial=1)
+        c.set_meter(7, (2, 4))
+        c.set_meter(3, (4, 4))
+        d = TrackView(3, meter=(3, 4), partial=1)
+        d.set_meter(3, (4, 4))
+        d.set_meter(7, (2, 4))
+        self.assertEqual(c._boundaries, d._boundaries)
+        self.assertEqual(c._boundaries, [(1, 3, 9, 3), (3, 21, 12, 4), (7, 69, 6, 2)])
+        self.assertEqual((c._bar_starts, c._tick_starts), ([1, 3, 7], [3, 21, 69]))
+
+        c.set_key(5, 'F')
+        c.set_key(2, 'G')
+        self.assertEqual(c._key_ticks, [ s for s, _ in c.keys ])
+        self.assertEqual([ c.key(b) for b in (1, 2, 5) ], [0, 1, -1])
+
+    def test_bar_at(self):
+        c = TrackView(1, meter=(3, 4), partial=1)
+        c.set_meter(3, meter=(2, 4))
+
+        ticks = [0, 1, 3, 4, 6, 7, 9, 100]
+        bars = [0, 1, 1, 2, 2, 3, 4, 49]
+        self.assertEqual([ c.bar_at(t) for t in ticks ], bars)
+        self.assertEqual(list(c.bar_numbers(ticks)), bars)
+
     def test_keys(self):
         c = TrackView(3)
         self.assertEqual(c.key(12), 0)
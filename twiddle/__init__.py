@@ -8,10 +8,16 @@ def init_midi():
     parser = argparse.ArgumentParser(description="Twiddle a midifile")
     parser.add_argument('-q', '--quantize', type=int, default=48, help="Quantize input")
     parser.add_argument('-l', '--level', default="info", help="Logging level")
+    parser.add_argument('-p', '--profile', metavar='PREFIX',
+            help="Write stage timings and cProfile output to PREFIX.txt, PREFIX.prof and PREFIX.folded")
 
     options = parser.parse_args()
 
     import logging
     logging.basicConfig(level=getattr(logging, options.level.upper(), logging.INFO))
 
+    if options.profile:
+        from . import profiling
+        profiling.start(options.profile)
+
     return options
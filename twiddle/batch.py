@@ -0,0 +1,125 @@
+'''
+Converts a corpus of MIDI files to LilyPond in a pool of processes.
+
+    python -m twiddle.batch corpus/ -o out/ -j 8
+    python -m twiddle.batch a.mid b.mid
+
+Directories are searched recursively and the output keeps their layout.
+Without --output each .ly is written next to its source.
+'''
+import os
+import sys
+import time
+import traceback
+from multiprocessing import Pool, cpu_count
+
+import logging
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = ('.mid', '.midi')
+
+def find_files(paths):
+    '''
+    Yields (root, path) for each MIDI file, where root is the directory given
+    on the command line (or the file's own directory).
+    '''
+    for p in paths:
+        if os.path.isdir(p):
+            for dirpath, dirnames, filenames in os.walk(p):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if name.lower().endswith(EXTENSIONS):
+                        yield p, os.path.join(dirpath, name)
+        else:
+            yield os.path.dirname(p), p
+
+def output_path(root, source, output=None):
+    target = os.path.splitext(source)[0] + '.ly'
+    if output is None:
+        return target
+    return os.path.join(output, os.path.relpath(target, root or '.'))
+
+def convert(job):
+    '''
+    Pool worker: converts one file, returning (source, target, elapsed, error).
+    The output is written to a temporary file first so failures never leave partial output.
+    '''
+    source, target, quantize = job
+    from .containers import VoiceList
+    from .views import TrackView
+
+    start = time.time()
+    try:
+        voices = VoiceList.from_midi(source, quantize)
+        context = { 'track_view': TrackView(voices.resolution) }
+
+        directory = os.path.dirname(target)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # another worker got there first
+                if not os.path.isdir(directory): raise
+
+        tmp = target + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                voices.write_lily(f, context)
+            os.rename(tmp, target)
+        except:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    return source, target, time.time() - start, error
+
+def run(jobs, workers=None):
+    '''
+    Converts the jobs in a pool of workers (default one per core),
+    yielding the results of convert() as files complete.
+    '''
+    pool = Pool(workers or cpu_count())
+    try:
+        for result in pool.imap_unordered(convert, jobs):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert MIDI files to LilyPond")
+    parser.add_argument('paths', nargs='+', help="MIDI files or directories")
+    parser.add_argument('-o', '--output', help="Output directory")
+    parser.add_argument('-j', '--jobs', type=int, default=cpu_count(), help="Worker processes (default all cores)")
+    parser.add_argument('-q', '--quantize', type=int, default=48, help="Quantize input")
+    parser.add_argument('-l', '--level', default="warning", help="Logging level")
+
+    options = parser.parse_args(argv)
+    logging.basicConfig(level=getattr(logging, options.level.upper(), logging.WARNING))
+
+    jobs = [ (source, output_path(root, source, options.output), options.quantize)
+            for root, source in find_files(options.paths) ]
+
+    start = time.time()
+    failed = 0
+    for source, target, elapsed, error in run(jobs, options.jobs):
+        if error:
+            failed += 1
+            sys.stdout.write("FAILED %8.3fs %s\n%s" % (elapsed, source, error))
+        else:
+            sys.stdout.write("ok     %8.3fs %s -> %s\n" % (elapsed, source, target))
+        sys.stdout.flush()
+
+    sys.stdout.write("%d files, %d failed in %.3fs with %d workers\n" %
+            (len(jobs), failed, time.time() - start, options.jobs))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
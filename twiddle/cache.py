@@ -0,0 +1,301 @@
+'''
+Binary cache of parsed scores.
+
+A cache file holds a VoiceList (or a single EventList) in the column layout
+of twiddle.columnar, so it can be memory mapped and handed to numpy without
+building an object per event:
+
+    magic     4s    'TWDC'
+    version   H
+    reserved  H
+    length    L     bytes of JSON header that follow
+    header          JSON: byte order, attribute and object tables, and per voice
+                    its name, resolution, time, row count and column offsets
+    columns         per voice the start, stop, pitch, attr and event arrays,
+                    each starting on an 8 byte boundary
+
+Rows are one per pitch, so the rows of a chord share an event number.  Pitch
+is -1 for items that aren't Notes and attr then indexes the object table.
+Voices split by sequence_builder() are stored flattened and split again on load.
+
+    cache.save(voices, 'score.twc')
+    voices = cache.load('score.twc')            # EventLists
+    columns = cache.load_columns('score.twc')   # ColumnarEventLists (numpy)
+    voices = cache.load_midi('score.mid')       # decodes once, cached alongside
+'''
+import json
+import os
+import struct
+import sys
+from array import array
+
+from .containers import EventList, VoiceList, CONTAINERS, time_key
+from .objects import Event, Note, TimeRange, Instruction, Comment, Raw, KeySignature, AttributeSet
+
+import logging
+logger = logging.getLogger(__name__)
+
+MAGIC = b'TWDC'
+VERSION = 1
+PREAMBLE = struct.Struct('<4sHHL')
+EXTENSION = '.twc'
+
+# name, array typecode, numpy dtype
+COLUMNS = (
+    ('start', 'l', 'int64'),
+    ('stop', 'l', 'int64'),
+    ('pitch', 'h', 'int16'),
+    ('attr', 'i', 'int32'),
+    ('event', 'i', 'int32'),
+)
+
+# str based items are stored as their text
+TEXT_ITEMS = {
+    'instruction': Instruction,
+    'comment': Comment,
+    'raw': Raw,
+    'str': str,
+}
+TEXT_KINDS = dict(( (v, k) for k, v in TEXT_ITEMS.items() ))
+
+if array('l').itemsize != 8:
+    raise ImportError("twiddle.cache needs 64 bit longs")
+
+class CacheError(Exception):
+    pass
+
+def _pad(n):
+    return (8 - n % 8) % 8
+
+def _encode_item(item):
+    try:
+        return [TEXT_KINDS[type(item)], item.decode('utf-8')]
+    except KeyError:
+        pass
+    if isinstance(item, KeySignature):
+        return ['key', item.key, item.minor]
+    raise CacheError("Can't cache %r" % (item, ))
+
+def _decode_item(value):
+    kind = value[0]
+    if kind == 'key':
+        return KeySignature(value[1], value[2])
+    return TEXT_ITEMS[kind](value[1].encode('utf-8'))
+
+def _voices(obj):
+    if isinstance(obj, VoiceList):
+        return 'voices', [ (name, obj[name]) for name in sorted(obj) ]
+    return 'events', [ ('', obj) ]
+
+def _columns(events, attrs, objects):
+    ' Flattens an EventList into column arrays, extending the shared tables '
+    columns = dict(( (name, array(code)) for name, code, _ in COLUMNS ))
+    start, stop, pitch, attr, event = [ columns[name] for name, _, _ in COLUMNS ]
+
+    seq = events.event_iter()
+    if any(( isinstance(e, CONTAINERS) for e in events )):
+        # rows stay in time order with the voices merged
+        seq = sorted(seq, key=time_key)
+
+    for n, e in enumerate(seq):
+        item = e.item
+        if isinstance(item, Note) and item.pitch is not None:
+            pitches = item.pitch if isinstance(item.pitch, (list, tuple)) else (item.pitch, )
+            try:
+                a = attrs[item.attrs]
+            except KeyError:
+                a = attrs[item.attrs] = len(attrs)
+        else:
+            pitches = (-1, )
+            a = len(objects)
+            objects.append(_encode_item(item))
+        for p in pitches:
+            start.append(e.time.start)
+            stop.append(e.time.stop)
+            pitch.append(p)
+            attr.append(a)
+            event.append(n)
+    return columns
+
+def save(obj, target):
+    '''
+    Writes a VoiceList or EventList to a filename or binary file object.
+    '''
+    if isinstance(target, basestring):
+        tmp = target + '.tmp'
+        with open(tmp, 'wb') as f:
+            save(obj, f)
+        os.rename(tmp, target)
+        return
+
+    kind, voices = _voices(obj)
+    attrs, objects = {}, []
+    data = [ (name, events, _columns(events, attrs, objects)) for name, events in voices ]
+
+    header = {
+        'kind': kind,
+        'byteorder': sys.byteorder,
+        'attrs': [ [ a.decode('utf-8') for a in attr.values ]
+            for attr, i in sorted(attrs.items(), key=lambda x: x[1]) ],
+        'objects': objects,
+        'voices': [],
+    }
+
+    # the header holds the column offsets so lay them out first
+    offset = 0
+    for name, events, columns in data:
+        voice = {
+            'name': name,
+            'resolution': events.resolution,
+            'time': list(events.time),
+            'rows': len(columns['event']),
+            'separated': any(( isinstance(e, CONTAINERS) for e in events )),
+            'offsets': {},
+        }
+        for column, code, _ in COLUMNS:
+            voice['offsets'][column] = offset
+            size = len(columns[column]) * columns[column].itemsize
+            offset += size + _pad(size)
+        header['voices'].append(voice)
+
+    text = json.dumps(header, sort_keys=True).encode('utf-8')
+    text += b' ' * _pad(PREAMBLE.size + len(text))
+    target.write(PREAMBLE.pack(MAGIC, VERSION, 0, len(text)))
+    target.write(text)
+
+    for name, events, columns in data:
+        for column, code, _ in COLUMNS:
+            raw = columns[column].tostring()
+            target.write(raw + b'\0' * _pad(len(raw)))
+
+def _read_header(buf):
+    magic, version, reserved, length = PREAMBLE.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise CacheError("Not a twiddle cache file")
+    if version != VERSION:
+        raise CacheError("Unsupported cache version %d" % version)
+    header = json.loads(buf[PREAMBLE.size:PREAMBLE.size + length].decode('utf-8'))
+    header['base'] = PREAMBLE.size + length
+    return header
+
+def _open(source, use_mmap):
+    if not isinstance(source, basestring):
+        return source.read()
+    with open(source, 'rb') as f:
+        if use_mmap:
+            import mmap
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return f.read()
+
+def _arrays(buf, header, voice):
+    ' The columns of a voice as arrays, copied out of the buffer '
+    columns = {}
+    for name, code, _ in COLUMNS:
+        a = array(code)
+        start = header['base'] + voice['offsets'][name]
+        a.fromstring(buf[start:start + voice['rows'] * a.itemsize])
+        if header['byteorder'] != sys.byteorder:
+            a.byteswap()
+        columns[name] = a
+    return columns
+
+def _events(columns, attrs, objects):
+    ' Rebuilds the Events, sharing Notes and TimeRanges where possible '
+    result = []
+    last = -1
+    pitches = None
+    for start, stop, pitch, attr, event in zip(*[ columns[name] for name, _, _ in COLUMNS ]):
+        if event == last:
+            # another row of a chord
+            if pitches is None:
+                pitches = [result[-1].item.pitch]
+            pitches.append(pitch)
+            result[-1].item = Note(pitches, result[-1].item.attrs)
+            continue
+        pitches = None
+        last = event
+        if pitch < 0:
+            item = objects[attr]
+        else:
+            item = Note.interned(pitch, attrs[attr])
+        result.append(Event(TimeRange.interned(start, stop), item))
+    return result
+
+def _build(header, voice_list):
+    if header['kind'] == 'events':
+        return voice_list[0][1]
+    result = VoiceList(voice_list)
+    if voice_list:
+        result.resolution = voice_list[0][1].resolution
+    return result
+
+def load(source, use_mmap=False):
+    '''
+    Reads a cache file (filename or file object) back into EventLists.
+    '''
+    buf = _open(source, use_mmap)
+    header = _read_header(buf)
+
+    attrs = [ AttributeSet.get(( a.encode('utf-8') for a in attr )) for attr in header['attrs'] ]
+    objects = [ _decode_item(x) for x in header['objects'] ]
+
+    voices = []
+    for voice in header['voices']:
+        events = _events(_arrays(buf, header, voice), attrs, objects)
+        if voice.get('separated'):
+            from .generators import sequence_builder
+            events = sequence_builder(events, voice['resolution'])
+        voices.append((voice['name'].encode('utf-8'),
+            EventList(events, TimeRange(*voice['time']), voice['resolution'])))
+    return _build(header, voices)
+
+def load_columns(source, use_mmap=True):
+    '''
+    Reads a cache file as ColumnarEventLists.
+    With use_mmap the columns are read only views onto the mapped file,
+    otherwise they are copied into writable arrays.
+    '''
+    import numpy
+    from .columnar import AttributeTable, ColumnarEventList
+
+    buf = _open(source, use_mmap)
+    header = _read_header(buf)
+
+    attrs = AttributeTable([ tuple(( a.encode('utf-8') for a in attr )) for attr in header['attrs'] ])
+    objects = [ _decode_item(x) for x in header['objects'] ]
+
+    voices = []
+    for voice in header['voices']:
+        columns = {}
+        for name, code, dtype in COLUMNS:
+            dtype = numpy.dtype(dtype)
+            if header['byteorder'] != sys.byteorder:
+                dtype = dtype.newbyteorder()
+            columns[name] = numpy.frombuffer(buf, dtype, voice['rows'],
+                    header['base'] + voice['offsets'][name])
+            if not use_mmap:
+                columns[name] = columns[name].copy()
+        voices.append((voice['name'].encode('utf-8'),
+            ColumnarEventList(columns, TimeRange(*voice['time']), voice['resolution'], attrs, objects)))
+    return _build(header, voices)
+
+def load_midi(filename, quantize=48, path=None):
+    '''
+    VoiceList.from_midi() through a cache file, by default next to the MIDI file.
+    The cache is rebuilt if it is older than the MIDI file or used a different quantize.
+    '''
+    if path is None:
+        path = "%s.q%d%s" % (filename, quantize, EXTENSION)
+
+    try:
+        if os.path.getmtime(path) >= os.path.getmtime(filename):
+            return load(path)
+    except (OSError, CacheError) as e:
+        logger.debug("Not using cache %s: %s", path, e)
+
+    voices = VoiceList.from_midi(filename, quantize)
+    try:
+        save(voices, path)
+    except (IOError, OSError) as e:
+        logger.warning("Unable to write cache %s: %s", path, e)
+    return voices
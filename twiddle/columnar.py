@@ -0,0 +1,446 @@
+'''
+Columnar storage for large scores.
+
+A ColumnarEventList keeps a track as parallel numpy arrays with one row per
+pitch, so a chord takes several rows sharing the same event number.
+
+    start, stop  tick range of the event
+    pitch        MIDI pitch, or -1 for anything that isn't a Note
+    attr         Note attribute tuple id, or object id for other items
+    event        event number, rows of a chord share one
+
+Attribute tuples and non-note items live in side tables.  The class mirrors
+the query and editing API of EventList and converts both ways with it.
+Rendering goes through the object form.
+'''
+import numpy
+
+from .containers import EventList
+from .objects import Event, Note, TimeRange
+
+import logging
+logger = logging.getLogger(__name__)
+
+COLUMNS = (
+    ('start', numpy.int64),
+    ('stop', numpy.int64),
+    ('pitch', numpy.int16),
+    ('attr', numpy.int32),
+    ('event', numpy.int32),
+)
+
+class AttributeTable(object):
+    '''
+    Interned attribute tuples.
+    Tables only ever grow so they can be shared between derived lists.
+    '''
+    __slots__ = ('values', 'ids')
+
+    def __init__(self, values=((), )):
+        self.values = []
+        self.ids = {}
+        for v in values:
+            self.id(v)
+
+    def id(self, attr):
+        try:
+            return self.ids[attr]
+        except KeyError:
+            self.ids[attr] = len(self.values)
+            self.values.append(attr)
+            return self.ids[attr]
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+    def __len__(self):
+        return len(self.values)
+
+class ColumnarEventList(object):
+    '''
+    A collection of Events stored as numpy columns.
+    '''
+    columnar = True
+
+    def __init__(self, columns=None, time=None, resolution=96, attrs=None, objects=()):
+        if columns is None:
+            columns = dict(( (name, numpy.zeros(0, dtype)) for name, dtype in COLUMNS ))
+        for name, dtype in COLUMNS:
+            setattr(self, name, numpy.asarray(columns[name], dtype))
+
+        self.attrs = attrs if attrs is not None else AttributeTable()
+        self.objects = list(objects)
+        self.resolution = resolution
+
+        if time is None:
+            if len(self.start):
+                time = TimeRange(int(self.start.min()), int(self.stop.max()))
+            else:
+                time = TimeRange(-1, -1)
+        self.time = time
+
+    @classmethod
+    def from_events(cls, seq, time=None, resolution=None, attrs=None):
+        '''
+        Builds the columns from Event objects (usually an EventList).
+        Single element pitch lists come back as plain ints.
+        '''
+        if resolution is None:
+            resolution = getattr(seq, 'resolution', 96)
+        if time is None:
+            time = getattr(seq, 'time', None)
+        if attrs is None:
+            attrs = AttributeTable()
+
+        starts, stops, pitches, ids, events = [], [], [], [], []
+        objects = []
+        for n, e in enumerate(seq):
+            item = getattr(e, 'item', e)
+            if isinstance(item, Note) and item.pitch is not None:
+                pitch = item.pitch if isinstance(item.pitch, (list, tuple)) else (item.pitch, )
+                attr = attrs.id(tuple(item.attr))
+            else:
+                pitch = (-1, )
+                attr = len(objects)
+                objects.append(item)
+            for p in pitch:
+                starts.append(e.time.start)
+                stops.append(e.time.stop)
+                pitches.append(p)
+                ids.append(attr)
+                events.append(n)
+
+        columns = { 'start': starts, 'stop': stops, 'pitch': pitches, 'attr': ids, 'event': events }
+        return cls(columns, time, resolution, attrs, objects)
+
+    def to_events(self):
+        ' Returns the equivalent EventList '
+        return EventList(self, self.time, self.resolution)
+
+    def _derive(self, rows, time, columns=None, objects=None):
+        ' New list from a row selection, renumbering the events '
+        if columns is None:
+            columns = dict(( (name, getattr(self, name)[rows]) for name, _ in COLUMNS ))
+        event = columns['event']
+        if len(event):
+            first = numpy.ones(len(event), bool)
+            first[1:] = event[1:] != event[:-1]
+            columns['event'] = numpy.cumsum(first) - 1
+        return self.__class__(columns, time, self.resolution, self.attrs,
+                self.objects if objects is None else objects)
+
+    @property
+    def duration(self):
+        return self.time.ticks
+
+    @property
+    def nbytes(self):
+        ' Bytes used by the columns '
+        return sum(( getattr(self, name).nbytes for name, _ in COLUMNS ))
+
+    def __len__(self):
+        if len(self.event) == 0:
+            return 0
+        return int(self.event[-1]) + 1
+
+    def _item(self, rows):
+        r = rows[0]
+        pitch = int(self.pitch[r])
+        if pitch < 0:
+            return self.objects[self.attr[r]]
+        attr = self.attrs[self.attr[r]]
+        if len(rows) == 1:
+            return Note.interned(pitch, attr)
+        return Note([ int(self.pitch[x]) for x in rows ], attr)
+
+    def __iter__(self):
+        if len(self.event) == 0:
+            return
+        bounds = numpy.flatnonzero(numpy.diff(self.event)) + 1
+        lo = 0
+        for hi in list(bounds) + [len(self.event)]:
+            rows = range(lo, hi)
+            yield Event(TimeRange.interned(int(self.start[lo]), int(self.stop[lo])), self._item(rows))
+            lo = hi
+
+    def items(self):
+        return [ x.item for x in self ]
+
+    def note_iter(self):
+        for x in self:
+            if isinstance(x.item, Note): yield x
+
+    def note_events(self):
+        return list(self.note_iter())
+
+    def get(self, window):
+        '''
+        Get all elements that occur within a given TimeRange
+        If an integer tick position is passed then the result will be all elements starting
+        at that position.
+        '''
+        if isinstance(window, int):
+            rows = self.start == window
+            return self._derive(rows, None)
+
+        rows = (self.start >= window.start) & (self.start < window.stop) & (self.stop <= window.stop)
+        return self._derive(rows, window)
+
+    def remove(self, window):
+        '''
+        Removes the elements within a TimeRange.
+        Like EventList.remove(), an integer tick returns a new list without the
+        elements starting there and leaves this one alone.
+        '''
+        if isinstance(window, int):
+            return self._derive(self.start != window, None)
+
+        rows = (self.start >= window.start) & (self.start < window.stop) & (self.stop <= window.stop)
+        kept = self._derive(~rows, self.time)
+        for name, _ in COLUMNS:
+            setattr(self, name, getattr(kept, name))
+        return self
+
+    def slice(self, window):
+        rows = ~(((self.start < window.start) & (self.stop <= window.start)) | (self.start >= window.stop))
+        columns = dict(( (name, getattr(self, name)[rows]) for name, _ in COLUMNS ))
+        numpy.maximum(columns['start'], window.start, out=columns['start'])
+        numpy.minimum(columns['stop'], window.stop, out=columns['stop'])
+
+        # events trimmed at the window start can land out of order
+        order = numpy.lexsort((columns['event'], columns['stop'], columns['start']))
+        columns = dict(( (name, columns[name][order]) for name in columns ))
+        trimmed = self.stop[rows][order] > window.stop
+
+        objects = None
+        if trimmed.any():
+            # tie marker on anything cut off at the end of the window
+            attr = columns['attr']
+            notes = trimmed & (columns['pitch'] >= 0)
+            original = attr.copy()
+            for old in numpy.unique(original[notes]):
+                attr[notes & (original == old)] = self.attrs.id(self.attrs[old] + ('~', ))
+
+            other = numpy.flatnonzero(trimmed & (columns['pitch'] < 0))
+            if len(other):
+                objects = list(self.objects)
+                for r in other:
+                    item = self.objects[attr[r]] + "~"
+                    attr[r] = len(objects)
+                    objects.append(item)
+
+        return self._derive(None, window, columns, objects)
+
+    def split(self, position):
+        return (
+            self.slice(TimeRange(self.time.start, position)),
+            self.slice(TimeRange(position, self.time.stop))
+        )
+
+    def __getitem__(self, key):
+        if isinstance(key, TimeRange):
+            return self.get(key)
+        raise TypeError("ColumnarEventList can only be indexed by TimeRange")
+
+    def _merge(self, seq, offset):
+        ' Merges in another list shifted by offset, mapping its ids onto our tables '
+        if not isinstance(seq, ColumnarEventList):
+            seq = ColumnarEventList.from_events(seq, resolution=self.resolution, attrs=self.attrs)
+        if seq.resolution != self.resolution:
+            seq = ColumnarEventList.from_events(EventList(seq.to_events().at_resolution(self.resolution)),
+                    seq.time * (self.resolution, seq.resolution), self.resolution, self.attrs)
+        if len(seq.start) == 0: return self
+
+        columns = dict(( (name, getattr(seq, name).copy()) for name, _ in COLUMNS ))
+        notes = columns['pitch'] >= 0
+        if seq.attrs is not self.attrs:
+            mapping = numpy.array([ self.attrs.id(a) for a in seq.attrs.values ], numpy.int32)
+            columns['attr'][notes] = mapping[columns['attr'][notes]]
+        columns['attr'][~notes] += len(self.objects)
+        columns['event'] += len(self)
+        columns['start'] += offset
+        columns['stop'] += offset
+
+        self.objects.extend(seq.objects)
+        for name, _ in COLUMNS:
+            columns[name] = numpy.concatenate((getattr(self, name), columns[name]))
+
+        # stable ordering by (start, stop) keeps chord rows together
+        order = numpy.lexsort((columns['event'], columns['stop'], columns['start']))
+        merged = self._derive(None, self.time & (seq.time + offset),
+                dict(( (name, columns[name][order]) for name in columns )))
+        for name, _ in COLUMNS:
+            setattr(self, name, getattr(merged, name))
+        self.time = merged.time
+        return self
+
+    def extend(self, seq):
+        '''
+        Appends all the items from container to this one.
+        '''
+        return self._merge(seq, 0)
+
+    def paste(self, seq, offset=0, start=None):
+        '''
+        Appends all the items from container to this one.
+        The items are offset to follow sequentially from the current.
+        You can specify a gap by giving a positive offset.
+        '''
+        if start is None:
+            start = self.time.stop
+        offset += start - seq.time.start
+        return self._merge(seq, offset)
+
+    def apply(self, f, *args, **kwargs):
+        '''
+        Convenience function to call other functions
+        '''
+        if isinstance(f, basestring):
+            from . import functions
+            f = getattr(functions, f)
+
+        f(self, *args, **kwargs)
+        return self
+
+    def render_section(self, bar_info=None, context={}, **kwargs):
+        return self.to_events().render_section(bar_info, context, **kwargs)
+
+    def render_track(self, track_view=None, context={}, **kwargs):
+        return self.to_events().render_track(track_view, context, **kwargs)
+
+    def to_lily(self, context={}):
+        return self.to_events().to_lily(context)
+
+    def __repr__(self):
+        return "<Columns {0} events {1} rows>{2}".format(len(self), len(self.start), self.time)
+
+# Batch versions of the twiddle.functions transforms.
+# twiddle.functions dispatches to these for columnar containers.
+
+def transpose(container, offset):
+    notes = container.pitch >= 0
+    container.pitch[notes] += offset
+    return container
+
+def add_attr(container, attr):
+    notes = container.pitch >= 0
+    ids = container.attr
+    original = ids.copy()
+    for old in numpy.unique(original[notes]):
+        ids[notes & (original == old)] = container.attrs.id(container.attrs[old] + (attr, ))
+    return container
+
+def extend(container, max_gap):
+    '''
+    Removes gaps of up to max_gap between consecutive notes.
+    '''
+    gap_ticks = float(container.resolution * 4 / max_gap)
+    logger.debug("Removing gaps shorter than %d", gap_ticks)
+
+    # one row per note event
+    rows = numpy.flatnonzero(container.pitch >= 0)
+    first = numpy.ones(len(rows), bool)
+    first[1:] = container.event[rows[1:]] != container.event[rows[:-1]]
+    rows = rows[first]
+
+    next_start = numpy.append(container.start[rows[1:]], container.time.stop)
+    gap = next_start - container.stop[rows]
+    extended = (gap > 0) & (gap <= gap_ticks)
+
+    # spread the new stops over every row of the event
+    new_stop = numpy.full(len(container), -1, numpy.int64)
+    new_stop[container.event[rows[extended]]] = next_start[extended]
+    stretched = new_stop[container.event]
+    container.stop = numpy.where(stretched >= 0, stretched, container.stop)
+    return container
+
+# candidate grids for quantize(), tried per beat
+GRIDS = ('straight', 'triplet', 'swing')
+
+def _snap(x, spacing, grid, swing):
+    '''
+    Snaps tick positions to a grid, returning the positions and the shortest
+    step of the grid.
+    '''
+    if grid == 'straight':
+        period = spacing
+    elif grid == 'triplet':
+        period = spacing * 2.0 / 3
+    elif grid == 'swing':
+        # pairs of steps with the second delayed to swing of the pair
+        period = spacing * 2.0
+        late = period * swing
+        base = numpy.floor(x / period) * period
+        offset = x - base
+        offset = numpy.where(offset < late / 2, 0, numpy.where(offset < (late + period) / 2, late, period))
+        return numpy.rint(base + offset).astype(numpy.int64), period - late
+    else:
+        raise ValueError("Unknown grid: %s" % grid)
+    return numpy.rint(numpy.round(x / period) * period).astype(numpy.int64), period
+
+def quantize_times(start, stop, notes, resolution, step=16, grids=GRIDS, swing=2.0/3):
+    '''
+    Snaps start and stop tick arrays to the grid that fits each beat best.
+    notes marks the rows with a length (Notes), whose stops are snapped too
+    and which are kept at least one grid step long.
+    Returns the new start and stop arrays.
+    '''
+    start = numpy.asarray(start, numpy.int64)
+    stop = numpy.asarray(stop, numpy.int64)
+    notes = numpy.asarray(notes, bool)
+    spacing = resolution * 4.0 / step
+
+    # every position belongs to the beat it falls in
+    x = numpy.concatenate((start, stop[notes]))
+    beat = x // resolution
+    beat -= beat.min() if len(beat) else 0
+    beats = int(beat.max()) + 1 if len(beat) else 0
+
+    snapped = []
+    error = numpy.empty((len(grids), beats))
+    shortest = numpy.empty(len(grids))
+    for i, grid in enumerate(grids):
+        s, shortest[i] = _snap(x, spacing, grid, swing)
+        snapped.append(s)
+        error[i] = numpy.bincount(beat, numpy.abs(s - x), beats)
+
+    # ties go to the earlier grid so straight material stays straight
+    best = error.argmin(axis=0)[beat]
+    x = numpy.choose(best, snapped)
+
+    n = len(start)
+    new_start = x[:n]
+    new_stop = new_start + (stop - start)
+    new_stop[notes] = x[n:]
+
+    # notes snapped to nothing get the shortest step of their grid
+    collapsed = notes & (new_stop <= new_start)
+    length = numpy.maximum(numpy.rint(shortest), 1).astype(numpy.int64)
+    new_stop[collapsed] = new_start[collapsed] + length[best[:n][collapsed]]
+    return new_start, new_stop
+
+def quantize_window(time, start, stop, resolution, step=16):
+    '''
+    The container window for quantized start and stop arrays: the old window
+    snapped to the straight grid and stretched to cover the events.
+    '''
+    spacing = resolution * 4.0 / step
+    window = TimeRange(*( int(round(round(t / spacing) * spacing)) for t in time ))
+    if len(start):
+        window &= TimeRange(int(start.min()), int(stop.max()))
+    return window
+
+def quantize(container, step=16, grids=GRIDS, swing=2.0/3):
+    if not len(container):
+        return container
+    start, stop = quantize_times(container.start, container.stop, container.pitch >= 0,
+            container.resolution, step, grids, swing)
+    container.start, container.stop = start, stop
+
+    # re-sort the rows, keeping chords together and equal times in order
+    order = numpy.lexsort((container.event, stop, start))
+    result = container._derive(order, container.time)
+    for name, _ in COLUMNS:
+        setattr(container, name, getattr(result, name))
+    container.time = quantize_window(container.time, start, stop, container.resolution, step)
+    return container
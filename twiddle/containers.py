@@ -1,21 +1,202 @@
 import logging
 logger = logging.getLogger(__name__)
 
-from .objects import Note, Event, Instruction, Comment, TimeRange
-
-DEBUG = True
+import os
+import threading
+import weakref
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from operator import attrgetter
 
-if DEBUG:
-    logger.warn("Running sequence validation - decreased performance")
+from .objects import Note, Event, Instruction, Comment, TimeRange
+from .lily import iter_lily, write_lily
+from . import profiling
 
 class SequenceError(Exception):
     pass
 
+# Validation modes:
+#   off       no checks
+#   local     each change through an EventList checks the events next to it
+#   deferred  changed lists get a full validate() at the end of the
+#             validation() block (or at exit if set from the environment)
+# The mode is kept per thread, each starting with the environment's.
+OFF, LOCAL, DEFERRED = 'off', 'local', 'deferred'
+MODES = (OFF, LOCAL, DEFERRED)
+
+def _mode_from_environment():
+    mode = os.environ.get('TWIDDLE_VALIDATE', OFF).lower() or OFF
+    if mode not in MODES:
+        logger.warning("Ignoring TWIDDLE_VALIDATE=%s, expected one of %s", mode, ", ".join(MODES))
+        return OFF
+    return mode
+
+_default_mode = _mode_from_environment()
+
+_local = threading.local()
+
+def validation_mode():
+    ' The validation mode of this thread '
+    return getattr(_local, 'mode', _default_mode)
+
+# lists changed in deferred mode outside a validation() block, from any
+# thread, by id (the mode came from the environment so they wait for exit)
+_pending = weakref.WeakValueDictionary()
+_pending_lock = threading.Lock()
+
+def _defer(seq):
+    ' Records a list changed in deferred mode '
+    block = getattr(_local, 'deferred', None)
+    if block is not None:
+        block[id(seq)] = seq
+    else:
+        with _pending_lock:
+            _pending[id(seq)] = seq
+
+def validate_deferred():
+    '''
+    Runs the full validation of the lists changed in deferred mode: those of
+    this thread's validation() block, or outside one those of all threads.
+    '''
+    block = getattr(_local, 'deferred', None)
+    if block is not None:
+        pending = block.values()
+        block.clear()
+    else:
+        with _pending_lock:
+            pending = _pending.values()
+            _pending.clear()
+    for seq in pending:
+        seq.validate()
+
+@contextmanager
+def validation(mode=LOCAL):
+    '''
+    Sets the validation mode of this thread for a block:
+
+        with containers.validation(containers.DEFERRED):
+            track.extend(...)
+
+    In deferred mode the lists this thread changed are validated as the
+    block exits.
+    '''
+    if mode not in MODES:
+        raise ValueError("Unknown validation mode: %s" % mode)
+    previous = validation_mode()
+    outermost = mode == DEFERRED and previous != DEFERRED
+    if outermost:
+        outer_block = getattr(_local, 'deferred', None)
+        _local.deferred = weakref.WeakValueDictionary()
+    _local.mode = mode
+    try:
+        try:
+            yield
+        finally:
+            _local.mode = previous
+        if outermost:
+            validate_deferred()
+    finally:
+        if outermost:
+            _local.deferred = outer_block
+
+if _default_mode == DEFERRED:
+    import atexit
+    atexit.register(validate_deferred)
+
+# events are ordered by (start, stop)
+time_key = attrgetter('time')
+
+def _build_tree(values, size, combine, pad):
+    tree = [pad] * size + values + [pad] * (size - len(values))
+    for i in range(size - 1, 0, -1):
+        tree[i] = combine(tree[2 * i], tree[2 * i + 1])
+    return tree
+
+def _search_tree(tree, size, lo, hi, test):
+    '''
+    Returns the leaf indices in [lo, hi) that pass test, in order.
+    Subtrees whose aggregate fails the test are skipped.
+    '''
+    result = []
+    stack = [(1, 0, size)]
+    while stack:
+        node, l, r = stack.pop()
+        if r <= lo or l >= hi or not test(tree[node]):
+            continue
+        if node >= size:
+            result.append(node - size)
+            continue
+        m = (l + r) // 2
+        stack.append((2 * node + 1, m, r))
+        stack.append((2 * node, l, m))
+    return result
+
+class TimeIndex(object):
+    '''
+    Sorted start array over a sequence of events, augmented with max/min stop trees.
+    Answers the same questions as TimeRange.intersects() and TimeRange.contains()
+    in O(log n + k).
+    '''
+    __slots__ = ('starts', 'size', 'max_stops', 'min_stops', 'length')
+
+    def __init__(self, seq):
+        self.starts = [ e.time.start for e in seq ]
+        stops = [ e.time.stop for e in seq ]
+        self.length = len(self.starts)
+
+        size = 1
+        while size < self.length:
+            size *= 2
+        self.size = size
+        self.max_stops = _build_tree(stops, size, max, float('-inf'))
+        self.min_stops = _build_tree(stops, size, min, float('inf'))
+
+    @classmethod
+    def build(cls, seq):
+        ' Returns an index or None if the sequence is not ordered by start '
+        last = None
+        for e in seq:
+            if last is not None and e.time.start < last:
+                return None
+            last = e.time.start
+        return cls(seq)
+
+    def at(self, tick):
+        ' Indices of the events starting at the given tick '
+        return range(bisect_left(self.starts, tick), bisect_right(self.starts, tick))
+
+    def intersecting(self, window):
+        ' Indices of the events for which window.intersects(e.time) is true '
+        lo = bisect_left(self.starts, window.start)
+        hi = bisect_left(self.starts, window.stop)
+        # events starting before the window only count if they run into it
+        before = _search_tree(self.max_stops, self.size, 0, lo, lambda s: s > window.start)
+        return before + range(lo, max(lo, hi))
+
+    def contained(self, window):
+        ' Indices of the events for which window.contains(e.time) is true '
+        lo = bisect_left(self.starts, window.start)
+        hi = bisect_left(self.starts, window.stop)
+        return _search_tree(self.min_stops, self.size, lo, hi, lambda s: s <= window.stop)
+
 class EventList(list):
     '''
     A collection of Events
+
+    Window queries use a TimeIndex once the list grows past INDEX_THRESHOLD.
+    The index is rebuilt lazily after any change made through the list, but
+    changing the time of an Event in place requires a call to reindex().
+
+    render_track() keeps the rendered output bar by bar and edits made through
+    the list mark the time they cover as dirty, so the next render only redoes
+    the bars that changed.  Changing events or items in place needs a touch().
+    Streamed output (iter_lily(), write_lily()) reads the cache but doesn't fill it.
     '''
-    __slots__ = ('time', 'resolution')
+    __slots__ = ('time', 'resolution', '_index', '_dirty', '_fragments', '__weakref__')
+
+    INDEX_THRESHOLD = 32
+    # beyond this many dirty windows the whole render cache is dropped
+    DIRTY_LIMIT = 32
 
     def __init__(self, items=(), time=None, resolution=96):
         list.__init__(self, items)
@@ -23,6 +204,55 @@ class EventList(list):
             time = TimeRange.from_events(self)
         self.resolution = resolution
         self.time = time
+        self._index = None
+        self._dirty = []
+        self._fragments = None
+
+    def __reduce__(self):
+        # the index and render cache are rebuilt as needed
+        return self.__class__, (list(self), self.time, self.resolution)
+
+    def reindex(self):
+        ' Discards the time index so it is rebuilt on the next query '
+        self._index = None
+
+    def touch(self, window=None):
+        '''
+        Marks a TimeRange (default everything) as changed so that the next
+        render_track() re-renders the bars it covers.
+        '''
+        if window is None:
+            self._fragments = None
+            self._dirty = []
+        elif self._fragments:
+            self._dirty.append(window)
+
+    @property
+    def dirty(self):
+        ' TimeRanges changed since the last render, None if everything has '
+        if self._fragments is None:
+            return None
+        return list(self._dirty)
+
+    def dirty_bars(self, track_view):
+        ' Bar numbers changed since the last render, None if everything has '
+        if self._fragments is None:
+            return None
+        bars = set()
+        for r in self._dirty:
+            bars.update(range(track_view.bar_at(r.start), track_view.bar_at(max(r.start, r.stop - 1)) + 1))
+        return sorted(bars)
+
+    def time_index(self):
+        '''
+        Returns the TimeIndex for this list.
+        None if the list is too small or not ordered.
+        '''
+        if len(self) < self.INDEX_THRESHOLD:
+            return None
+        if self._index is None or self._index.length != len(self):
+            self._index = TimeIndex.build(self)
+        return self._index
 
     @property
     def duration(self):
@@ -39,11 +269,29 @@ class EventList(list):
     def set_time(self, **kwargs):
         self.time = self.time._replace(**kwargs)
 
-    def validate(self):
-        last = TimeRange(-1, -1)
-        for e in self:
-            if self.time | e.time == None: raise SequenceError("%r outside of %r" % (e, self.time))
-            if self.time < last: raise SequenceError("Sequence jumps back at %r" % e)
+    def validate(self, lo=0, hi=None):
+        '''
+        Checks that the events in lo:hi are in order and overlap the list's
+        time, raising SequenceError.  Nested containers are checked too.
+        '''
+        start, stop = self.time
+        last = None
+        for e in list.__getslice__(self, lo, len(self) if hi is None else hi):
+            if e.time.stop < start or e.time.start > stop:
+                raise SequenceError("%r outside of %r" % (e, self.time))
+            if last is not None and e.time < last:
+                raise SequenceError("Sequence jumps back at %r" % e)
+            last = e.time
+            if isinstance(e, CONTAINERS):
+                e.validate()
+
+    def _changed(self, lo, hi):
+        ' Validates a change to the events in lo:hi as the validation mode asks '
+        mode = validation_mode()
+        if mode == LOCAL:
+            self.validate(max(lo - 1, 0), hi + 1)
+        elif mode == DEFERRED:
+            _defer(self)
 
     def add_event(self, tick, event):
         if isinstance(event, basestring):
@@ -51,20 +299,40 @@ class EventList(list):
         self.insert(Event(TimeRange(tick, tick), event))
         return self
 
+    def insertion_point(self, time):
+        '''
+        Returns the position at which an event with the given time belongs.
+        Equal times are placed after existing events.
+        '''
+        get = list.__getitem__
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if time < get(self, mid).time:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
     def append(self, event, sequential=False):
         '''
         Appends an event.
-        If the event is out of sequence the container is sorted after.
+        If the event is out of sequence it is inserted in order.
         '''
         if sequential and event.time.start < self.time.stop:
             raise SequenceError("Cannot go back in time")
 
-        list.append(self, event)
-        if event.time.start < self.time.stop:
-            self.sort()
+        if len(self) == 0 or event.time >= list.__getitem__(self, -1).time:
+            i = len(self)
+            list.append(self, event)
+        else:
+            i = self.insertion_point(event.time)
+            list.insert(self, i, event)
+        self._index = None
+        self.touch(event.time)
 
         self.time &= event.time
-        if DEBUG: self.validate()
+        if validation_mode() != OFF: self._changed(i, i + 1)
         return self
 
     def insert(self, event):
@@ -78,9 +346,8 @@ class EventList(list):
         '''
         Does a deep copy, changing the resolution of all events.
         '''
-
         for x in self:
-            yield Event(x.time * (r, self.resolution), x.item)
+            yield rescaled(x, r, self.resolution)
 
     def clone(self):
         return self.slice(self.time)
@@ -95,12 +362,20 @@ class EventList(list):
 
         if seq.resolution != self.resolution:
             seq = self.__class__(seq.at_resolution(self.resolution))
-        
-        list.extend(self, seq)
+        items = sorted(seq, key=time_key)
+
+        n = len(self)
+        list.extend(self, items)
         self.time &= seq.time
 
-        self.sort()
-        if DEBUG: self.validate()
+        if n:
+            # two sorted runs - timsort merges them in linear time, and a list
+            # built out of order by the constructor is sorted as it used to be
+            self.sort(key=time_key)
+        self._index = None
+        self.touch(seq.time)
+        # the new items are sorted so only the join needs checking
+        if validation_mode() != OFF: self._changed(n, n + 1)
         return self
 
     def paste(self, seq, offset=0, start=None):
@@ -126,18 +401,43 @@ class EventList(list):
         at that position.
         '''
     
+        index = self.time_index()
+
         if isinstance(window, int):
-            seq = [ e for e in self if e.time.start == window ]
+            if index is None:
+                seq = [ e for e in self if e.time.start == window ]
+            else:
+                seq = [ self[i] for i in index.at(window) ]
             return EventList(seq, resolution=self.resolution)
 
-        return self.__class__([ x for x in self if window.contains(x.time) ], window, self.resolution)
+        if index is None:
+            seq = [ x for x in self if window.contains(x.time) ]
+        else:
+            seq = [ self[i] for i in index.contained(window) ]
+        return self.__class__(seq, window, self.resolution)
 
     def remove(self, window):
+        index = self.time_index()
+
         if isinstance(window, int):
-            seq = [ e for e in self if e.time.start != window ]
+            if index is None:
+                seq = [ e for e in self if e.time.start != window ]
+            else:
+                found = index.at(window)
+                seq = self[:found[0]] + self[found[-1]+1:] if found else self[:]
             return EventList(seq, resolution=self.resolution)
         logger.info("REMOVING %s %d", window, len(self))
-        self[:] = [ x for x in self if not window.contains(x.time) ]
+
+        if index is None:
+            list.__setslice__(self, 0, len(self), [ x for x in self if not window.contains(x.time) ])
+        else:
+            found = index.contained(window)
+            if found:
+                lo, hi = found[0], found[-1] + 1
+                found = set(found)
+                list.__setslice__(self, lo, hi, [ self[i] for i in range(lo, hi) if i not in found ])
+                self._index = None
+        self.touch(window)
     
     def replace(self, window, other):
         self.remove(window)
@@ -145,18 +445,31 @@ class EventList(list):
         return self.paste(other, start=window.start)
 
     def slice(self, window):
-        result = []
-        for e in self:
-            if window.intersects(e.time):
-                result.append(e.slice(window))
+        index = self.time_index()
+        if index is None:
+            seq = ( e for e in self if window.intersects(e.time) )
+        else:
+            seq = ( self[i] for i in index.intersecting(window) )
+        # events trimmed at the window start can land out of order
+        result = sorted(( e.slice(window) for e in seq ), key=time_key)
         return self.__class__(result, window, self.resolution)
 
+    def shift(self, offset):
+        ' Returns a copy moved by offset ticks, for pasting nested voices '
+        return self.__class__(( x.shift(offset) for x in self ), self.time + offset, self.resolution)
+
     def split(self, position):
         return (
             self.slice(TimeRange(self.time.start, position)),
             self.slice(TimeRange(position, self.time.stop))
         )
 
+    def view(self, window):
+        '''
+        Returns an EventView: slice() without copying the events.
+        '''
+        return EventView(self, (window, ))
+
     def __getitem__(self, key):
 
         if isinstance(key, TimeRange):
@@ -164,18 +477,102 @@ class EventList(list):
 
         return list.__getitem__(self, key)
 
+    def __setitem__(self, key, value):
+        self._index = None
+        self.touch()
+        list.__setitem__(self, key, value)
+        if validation_mode() != OFF:
+            if isinstance(key, slice):
+                self._changed(0, len(self))
+            else:
+                key %= len(self)
+                self._changed(key, key + 1)
+
+    def __delitem__(self, key):
+        self._index = None
+        self.touch()
+        n = len(self)
+        list.__delitem__(self, key)
+        if validation_mode() != OFF:
+            if isinstance(key, slice):
+                self._changed(0, len(self))
+            else:
+                key %= n
+                self._changed(key, key)
+
+    def __setslice__(self, i, j, seq):
+        self._index = None
+        self.touch()
+        n = len(self)
+        list.__setslice__(self, i, j, seq)
+        if validation_mode() != OFF:
+            i = min(max(i, 0), n)
+            self._changed(i, i + len(self) - n + max(min(j, n) - i, 0))
+
+    def __delslice__(self, i, j):
+        self._index = None
+        self.touch()
+        list.__delslice__(self, i, j)
+        if validation_mode() != OFF:
+            i = min(max(i, 0), len(self))
+            self._changed(i, i)
+
+    def event_iter(self):
+        ' Yields the events, including those within nested containers '
+        for x in self:
+            if isinstance(x, CONTAINERS):
+                for o in x.event_iter(): yield o
+            else:
+                yield x
+
     def note_iter(self):
         for x in self:
-            if isinstance(x.item, Note): yield x
-            if isinstance(x, EventList):
-                for o in x: yield o
+            if isinstance(x, CONTAINERS):
+                for o in x.note_iter(): yield o
+            elif isinstance(x.item, Note):
+                yield x
 
     def note_events(self):
-        return [ x for x in self if isinstance(x.item, Note) ]
+        '''
+        The Note events of this list, leaving out those in nested containers
+        so they run in order (note_iter() includes them).
+        '''
+        return [ x for x in self if not isinstance(x, CONTAINERS) and isinstance(x.item, Note) ]
 
     def add_attr(self, attr):
+        # notes are shared so each distinct one is only changed once
+        changed = {}
         for x in self.note_iter():
-            x.item.add_attr(attr)
+            item = x.item
+            try:
+                x.item = changed[item]
+            except KeyError:
+                x.item = changed[item] = item.with_attr(attr)
+        self.touch()
+
+    def diff(self, other, track_view=None):
+        '''
+        Returns the changes from this list to other by bar, with a patch of
+        (window, EventList) pairs for replace(), see twiddle.diff
+        '''
+        from .diff import diff
+        return diff(self, other, track_view)
+
+    def memory_report(self):
+        ' Bytes used by the list and its events by category, see twiddle.memory '
+        from . import memory
+        return memory.report(self)
+
+    def to_columns(self):
+        '''
+        Returns a numpy backed ColumnarEventList with the same events.
+        The columns are flat, so nested voices are merged into them.
+        '''
+        from .columnar import ColumnarEventList
+        events = self
+        if any(( isinstance(x, CONTAINERS) for x in self )):
+            events = EventList(sorted(self.event_iter(), key=time_key), self.time, self.resolution)
+        return ColumnarEventList.from_events(events)
 
     def get_track_view(self, **kwargs):
         from .views import TrackView
@@ -190,6 +587,9 @@ class EventList(list):
             f = getattr(functions, f)
 
         f(self, *args, **kwargs)
+        # functions are free to move events around in place
+        self._index = None
+        self.touch()
         return self
 
     def __and__(self, other):
@@ -206,69 +606,176 @@ class EventList(list):
     def __enter__(self):
         return self
 
-    def render_track(self, track_view=None, context={}, **kwargs):
+    def render_track(self, track_view=None, context={}, cache=True, **kwargs):
+        return "".join(self.iter_track(track_view, context, cache, **kwargs))
 
+    def iter_track(self, track_view=None, context={}, cache=False, **kwargs):
+        '''
+        Yields the rendered track piece by piece.
+        Bars that haven't changed since the last cached render come from the
+        render cache.  Only a render with cache (as render_track() does) fills
+        it, so streaming output doesn't keep the text it has written.
+        '''
         if track_view is None:
             track_view = self.get_track_view(**kwargs)
 
-        output = []
-        for bar_info, key, notes in track_view.split_sections(self):
+        fragments = self._valid_fragments()
+        rendered = {}
+        context['resolution'] = self.resolution
+        nl = context.get('new_line', ' ')
+
+        sep = ""
+        for bar_info, key, notes in profiling.timed_iter('sections', track_view.split_sections(self)):
             context['key'] = key
-            output.append(notes.render_section(bar_info, context))
-        return "\n".join(output)
+            yield sep
+            signature = render_signature(track_view, bar_info, context)
+            if signature is None:
+                pieces = notes.iter_section(bar_info, context)
+            else:
+                k = (signature, notes.time)
+                clean, chunks = fragments.get(k, (False, {}))
+                if clean:
+                    rendered[k] = chunks
+                    pieces = (section_text(chunks, nl), )
+                elif cache:
+                    pieces = self._iter_cached_section(notes, bar_info, context, chunks, rendered, k)
+                else:
+                    pieces = notes.iter_section(bar_info, context)
+            for x in profiling.timed_iter('render', pieces):
+                yield x
+            sep = "\n"
+
+        if cache:
+            # only keep what this render used
+            self._fragments = rendered
+            self._dirty = []
+
+    def _valid_fragments(self):
+        '''
+        The render cache less anything edits have touched.
+        Maps (signature, section window) to whether the section is clean and
+        a dict of the bodies of its bar chunks by window.
+        '''
+        if not self._fragments or len(self._dirty) > self.DIRTY_LIMIT:
+            return {}
+        if not self._dirty:
+            return dict(( (k, (True, chunks)) for k, chunks in self._fragments.items() ))
+
+        result = {}
+        for k, chunks in self._fragments.items():
+            dirty = [ r for r in self._dirty if k[1].intersects(r) ]
+            if dirty:
+                result[k] = False, dict(( (w, body) for w, body in chunks.items()
+                        if not any(( w.intersects(r) for r in dirty )) ))
+            else:
+                result[k] = True, chunks
+        return result
+
+    def _iter_cached_section(self, notes, bar_info, context, cached, rendered, k):
+        '''
+        iter_section() in chunks of whole bars, reusing the cached chunks.
+        The chunks are stored in rendered under k.
+        '''
+        if isinstance(notes, EventView):
+            with profiling.span('materialize'):
+                notes = notes.materialize()
+        context['resolution'] = self.resolution
+        nl = context.get('new_line', ' ')
+
+        chunks = rendered[k] = {}
+        yield "{" + nl
+        sep = ""
+        for window, lo, hi in bar_chunks(notes, bar_info):
+            try:
+                body = cached[window]
+            except KeyError:
+                body = "".join(notes._iter_body(list.__getslice__(notes, lo, hi), window, bar_info, context))
+            chunks[window] = body
+            if body:
+                yield sep + body
+                sep = " "
+        yield nl + "}"
 
     def render_section(self, bar_info=None, context={}, **kwargs):
-        clock = self.time.start
-        
+        return "".join(self.iter_section(bar_info, context, **kwargs))
+
+    def iter_section(self, bar_info=None, context={}, **kwargs):
+        '''
+        Yields the rendered section piece by piece.
+        '''
         if bar_info is None:
             bar_info = self.get_track_view(**kwargs).bar_info(1)
         context['resolution'] = self.resolution
+        nl = context.get('new_line', ' ')
 
-        output = []
-        for e in self:
+        yield "{" + nl
+        for x in self._iter_body(self, self.time, bar_info, context):
+            yield x
+        yield nl + "}"
+
+    def _iter_body(self, events, window, bar_info, context):
+        '''
+        Yields the space separated events and rests filling window.
+        '''
+        clock = window.start
+        sep = ""
+        for e in events:
             if clock < e.time.start: # need to add rests before
-                for r in bar_info.get_rests(clock, e.time.start-clock):
-                    output.append(r.to_lily(context))
+                rests = bar_info.get_rests(clock, e.time.start-clock)
+                for r in profiling.timed_iter('rests', rests):
+                    yield sep + r.to_lily(context)
+                    sep = " "
                 clock = e.time.start
 
             if e.time.start < clock:
                 logger.warning("Dropping overlapping note %s at bar %d" % 
                         (e.to_lily(context), bar_info.bar_at(e.time.start)))
             else:
-                if isinstance(e, EventList):
-                    output.append(e.render_section(bar_info, context))
+                if isinstance(e, CONTAINERS):
+                    yield sep
+                    for x in e.iter_section(bar_info, context):
+                        yield x
+                    sep = " "
                 elif isinstance(e.item, Note):
                     for n in bar_info.split_note(e):
-                        output.append(n.to_lily(context))
+                        yield sep + n.to_lily(context)
+                        sep = " "
                 else:
-                    output.append(e.to_lily(context))
+                    yield sep + e.to_lily(context)
+                    sep = " "
                 clock = e.time.stop
 
         # output any trailing rests
-        if clock < self.time.stop:
-            for r in bar_info.get_rests(clock, self.time.stop-clock):
-                output.append(r.to_lily(context))
-
-        nl = context.get('new_line', ' ')
-        return "{%s%s%s}" % (nl, " ".join(output), nl)
+        if clock < window.stop:
+            rests = bar_info.get_rests(clock, window.stop-clock)
+            for r in profiling.timed_iter('rests', rests):
+                yield sep + r.to_lily(context)
+                sep = " "
 
     def render_notes(self, context={}):
 
         return " ".join(( x.to_lily(context) for x in self))
 
-
     def to_lily(self, context={}):
+        return "".join(self.iter_lily(context))
+
+    def iter_lily(self, context={}):
         context['resolution'] = self.resolution
 
         if 'track_view' in context:
             new_context = { k: context[k] for k in context if k != 'track_view' }
-            return self.render_track(context['track_view'], new_context)
+            return self.iter_track(context['track_view'], new_context)
 
         if 'bar_info' in context:
-            return self.render_section(context['bar_info'], context)
+            return self.iter_section(context['bar_info'], context)
 
-        return self.render_notes(context)
+        return iter((self.render_notes(context), ))
 
+    def write_lily(self, stream, context={}):
+        '''
+        Writes the rendered output to a file like object as it is generated.
+        '''
+        return write_lily(self, stream, context)
 
     def items(self):
         return [ x.item for x in self ]
@@ -281,51 +788,363 @@ class EventList(list):
             output = ", ".join((repr(x) for x in self))
         return "[{0}]{1}".format(output, self.time)
 
+def render_signature(track_view, bar_info, context):
+    '''
+    Everything other than the events that a rendered section depends on,
+    or None if the context can't be used as a cache key.
+    '''
+    signature = (
+        tuple(track_view.meters), tuple(track_view.keys), track_view.partial, bar_info,
+        tuple(sorted(( x for x in context.items() if x[0] != 'tick_length' ))),
+    )
+    try:
+        hash(signature)
+    except TypeError:
+        return None
+    return signature
+
+def section_text(chunks, nl=" "):
+    ' A rendered section from the bodies of its bar chunks '
+    return "{" + nl + " ".join(( chunks[w] for w in sorted(chunks) if chunks[w] )) + nl + "}"
+
+def bar_chunks(events, bar_info):
+    '''
+    Splits a section into (window, lo, hi) chunks at bar lines, where lo:hi are
+    the positions of the events starting in the window.  Each chunk renders the
+    same on its own as it does within the section: a bar line is only used if
+    neither a rendered note nor a gap between notes crosses it.
+    '''
+    start, stop = events.time
+    length = bar_info.bar_length
+    get = list.__getitem__
+    n = len(events)
+
+    t = start - (start - bar_info.start_tick) % length + length
+    lo = i = 0
+    clock = start
+    while t < stop:
+        while i < n and get(events, i).time.start < t:
+            e = get(events, i)
+            # overlapping events are dropped when rendering
+            if e.time.start >= clock: clock = e.time.stop
+            i += 1
+        if clock == t or (clock < t and i < n and get(events, i).time.start == t):
+            yield TimeRange(start, t), lo, i
+            start, lo = t, i
+        t += length
+    yield TimeRange(start, stop), lo, n
+
+def rescaled(x, r, resolution):
+    ' A copy of an event or nested container at resolution r '
+    start, stop = x.time * (r, resolution)
+    time = TimeRange.interned(start, stop)
+    if isinstance(x, ParallelEventList):
+        result = ParallelEventList(time, x.bookends, x.separator)
+        list.extend(result, ( rescaled(v, r, resolution) for v in x ))
+        return result
+    if isinstance(x, EventList):
+        return x.__class__(x.at_resolution(r), time, r)
+    return Event(time, x.item)
+
+def trim(e, window):
+    ' Event.slice() but only copying events that cross the window edges '
+    if e.time.start < window.start or e.time.stop > window.stop:
+        return e.slice(window)
+    return e
+
+class EventView(object):
+    '''
+    A window onto an EventList that shares its events.
+
+    Behaves like the result of one or more slice() calls, but nothing is
+    copied up front: events cut by the windows (and given the ~ tie marker)
+    are only created when the view is iterated or rendered.  Events added to
+    the view are kept with the view and never reach the EventList.
+    '''
+    __slots__ = ('base', 'windows', 'extras', 'time')
+
+    def __init__(self, base, windows, extras=(), time=None):
+        self.base = base
+        self.windows = tuple(windows)
+        # (number of windows applied when added, event)
+        self.extras = list(extras)
+        self.time = self.windows[-1] if time is None else time
+
+    @property
+    def resolution(self):
+        return self.base.resolution
+
+    @property
+    def duration(self):
+        return self.time.ticks
+
+    def events(self):
+        '''
+        Returns the events in the view, trimming those that cross a window.
+        The windows are applied in turn exactly as repeated slice() calls would.
+        '''
+        window = self.windows[-1]
+        index = self.base.time_index()
+        if index is None:
+            events = [ e for e in self.base if window.intersects(e.time) ]
+        else:
+            get = list.__getitem__
+            events = [ get(self.base, i) for i in index.intersecting(window) ]
+
+        for level, w in enumerate(self.windows):
+            events = sorted(( trim(e, w) for e in events if w.intersects(e.time) ), key=time_key)
+            added = [ e for l, e in self.extras if l == level + 1 ]
+            if added:
+                # as EventList.append, after any events with the same time
+                events.extend(added)
+                events.sort(key=time_key)
+        return events
+
+    def materialize(self):
+        ' Returns the view as an EventList '
+        return EventList(self.events(), self.time, self.resolution)
+
+    def __iter__(self):
+        return iter(self.events())
+
+    def __len__(self):
+        return len(self.events())
+
+    def add_event(self, tick, event):
+        if isinstance(event, basestring):
+            event = Instruction(event)
+        e = Event(TimeRange(tick, tick), event)
+        self.extras.append((len(self.windows), e))
+        self.time &= e.time
+        return self
+
+    def slice(self, window):
+        return EventView(self.base, self.windows + (window, ), self.extras)
+
+    view = slice
+
+    def split(self, position):
+        return (
+            self.slice(TimeRange(self.time.start, position)),
+            self.slice(TimeRange(position, self.time.stop))
+        )
+
+    def items(self):
+        return [ x.item for x in self ]
+
+    def note_iter(self):
+        return self.materialize().note_iter()
+
+    def get_track_view(self, **kwargs):
+        return self.base.get_track_view(**kwargs)
+
+    def render_section(self, bar_info=None, context={}, **kwargs):
+        return self.materialize().render_section(bar_info, context, **kwargs)
+
+    def iter_section(self, bar_info=None, context={}, **kwargs):
+        with profiling.span('materialize'):
+            events = self.materialize()
+        return events.iter_section(bar_info, context, **kwargs)
+
+    def to_lily(self, context={}):
+        return self.materialize().to_lily(context)
+
+    def iter_lily(self, context={}):
+        return self.materialize().iter_lily(context)
+
+    def write_lily(self, stream, context={}):
+        return write_lily(self, stream, context)
+
+    def __repr__(self):
+        return repr(self.materialize())
+
 class ParallelEventList(list):
-    __slots__ = ('time', 'bookends')
+    '''
+    Simultaneous containers, usually EventList voices covering the same time.
+    Can be placed in an EventList like an event.
+    '''
+    __slots__ = ('time', 'bookends', 'separator')
 
-    def __init__(self, time=None, bookends=("<<", ">>")):
+    VOICES = " \\\\ "
+
+    def __init__(self, time=None, bookends=("<<", ">>"), separator=" "):
         list.__init__(self)
         if time is None:
             time = TimeRange(-1, -1)
         self.time = time
         self.bookends = bookends
+        self.separator = separator
+
+    def __reduce__(self):
+        return self.__class__, (self.time, self.bookends, self.separator), None, iter(self)
+
+    def event_iter(self):
+        for x in self:
+            for e in x.event_iter(): yield e
+
+    def note_iter(self):
+        for x in self:
+            for e in x.note_iter(): yield e
+
+    def validate(self):
+        '''
+        Checks that each voice overlaps this time and is valid itself,
+        raising SequenceError.
+        '''
+        start, stop = self.time
+        for voice in self:
+            if voice.time.stop < start or voice.time.start > stop:
+                raise SequenceError("%r outside of %r" % (voice, self.time))
+            voice.validate()
 
-    #def append(self, event):
-    #    for s in self:
-    #        try:
-    #            return s.append(event)
-    #        except SequenceError:
-    #            pass
-    #    list.append(self, SequentialEventList(time=self.time, resolution=self.resolution))
+    def slice(self, window):
+        # the voices are cut to the part of the window this covers
+        window = self.time | window
+        result = self.__class__(window, self.bookends, self.separator)
+        list.extend(result, ( x.slice(window) for x in self ))
+        return result
+
+    def shift(self, offset):
+        result = self.__class__(self.time + offset, self.bookends, self.separator)
+        list.extend(result, ( x.shift(offset) for x in self ))
+        return result
 
     def to_lily(self, context={}):
+        return "".join(self.iter_lily(context))
+
+    def iter_lily(self, context={}):
         nl = context.get('new_line', ' ')
-        items = " ".join(( x.to_lily(context) for x in self ))
-        return "".join([ self.bookends[0], nl, items, nl, self.bookends[1] ])
+        yield self.bookends[0] + nl
+        sep = ""
+        for x in self:
+            yield sep
+            for s in iter_lily(x, context):
+                yield s
+            sep = self.separator
+        yield nl + self.bookends[1]
+
+    def render_section(self, bar_info=None, context={}):
+        return "".join(self.iter_section(bar_info, context))
+
+    def iter_section(self, bar_info=None, context={}):
+        ' Renders each voice against the bar layout '
+        nl = context.get('new_line', ' ')
+        yield self.bookends[0] + nl
+        sep = ""
+        for x in self:
+            yield sep
+            for s in x.iter_section(bar_info, context):
+                yield s
+            sep = self.separator
+        yield nl + self.bookends[1]
+
+    def write_lily(self, stream, context={}):
+        return write_lily(self, stream, context)
+
+# containers that can be nested in an EventList in place of an event
+CONTAINERS = (EventList, ParallelEventList)
+
+def _call(job):
+    '''
+    Executor task: calls a method on a track, returning the result and, if
+    the method changes the track, the track itself.
+    '''
+    track, name, args, kwargs, mutates = job
+    result = getattr(track, name)(*args, **kwargs)
+    return (track if mutates else None), result
+
+def _render(job):
+    ' Executor task: renders a track '
+    track, context = job
+    return "".join(track.iter_lily(context))
 
 class VoiceList(dict):
+    '''
+    Named tracks.
 
-    def __init__(self, voices=()):
+    Given an executor (anything with an ordered map(), such as a
+    multiprocessing Pool or ThreadPool or a concurrent.futures executor) the
+    bulk operations and rendering run a task per track.  Results always come
+    back in the order the tracks are iterated.  With a process pool the tracks
+    are replaced by the copies the workers changed.
+    '''
+    executor = None
+    # the methods that change tracks, so the only ones whose tracks are written back
+    MUTATORS = ('add_event', 'apply', 'add_attr', 'append')
+
+    def __init__(self, voices=(), executor=None):
         dict.__init__(self, voices)
+        self.executor = executor
+
+    def _map(self, task, jobs):
+        if self.executor is None:
+            return map(task, jobs)
+        return self.executor.map(task, jobs)
+
+    def _fan_out(self, name, *args, **kwargs):
+        '''
+        Calls the named method on each track, returning a VoiceList of the results.
+        '''
+        names = list(self)
+        mutates = name in self.MUTATORS
+        jobs = [ (dict.__getitem__(self, k), name, args, kwargs, mutates) for k in names ]
+        result = VoiceList(executor=self.executor)
+        for k, (track, value) in zip(names, self._map(_call, jobs)):
+            # tracks come back changed from other processes
+            if mutates and track is not dict.__getitem__(self, k):
+                self[k] = track
+            result[k] = value
+        return result
 
     @classmethod
-    def from_midi(cls, filename, quantize=48):
-        import midi
-        from . import generators
-        pattern = midi.read_midifile(filename)
+    def from_midi(cls, filename, quantize=48, workers=None):
+        '''
+        Reads a MIDI file (filename or file object), one EventList per track.
+        Tracks are decoded in a pool of processes if workers is given.
+        '''
+        from . import generators, midifile
+        with profiling.span('midi.read'):
+            pattern = midifile.read_midifile(filename)
+
+        if workers:
+            from multiprocessing import Pool
+            pool = Pool(workers)
+            try:
+                # decoding and chord grouping both happen in the workers
+                with profiling.span('midi.decode'):
+                    packed = pool.map(midifile.decode_track, [ (track, quantize) for track in pattern ])
+            finally:
+                pool.close()
+                pool.join()
+            tracks = [ midifile.unpack_events(p) for p in packed ]
+        else:
+            tracks = []
+            for track in pattern:
+                notes = midifile.track_notes(track, quantize)
+                if profiling.enabled:
+                    # the stages are only separated to time them
+                    with profiling.span('midi.decode'):
+                        notes = list(notes)
+                with profiling.span('midi.chords'):
+                    tracks.append(list(generators.group_chords(notes)))
 
         result = VoiceList()
-        for i, track in enumerate(pattern):
-            #t = generators.sequence_builder(generators.notes_from_midi(track, quantize), pattern.resolution)
-            t = EventList(resolution=pattern.resolution).extend(generators.group_chords(generators.notes_from_midi(track, quantize)))
+        for i, track in enumerate(tracks):
+            # overlapping notes are split into voices rather than dropped
+            with profiling.span('midi.build'):
+                t = generators.sequence_builder(track, pattern.resolution)
             result['Track{0}'.format(chr(i+65))] = t
 
         result.resolution = pattern.resolution
         return result
 
+    def memory_report(self):
+        ' Bytes used in total and per track by category, see twiddle.memory '
+        from . import memory
+        return memory.report(self)
+
     def select(self, voices):
-        result = VoiceList()
+        result = VoiceList(executor=self.executor)
 
         if isinstance(voices, dict):
             for name, track in voices.items():
@@ -337,13 +1156,13 @@ class VoiceList(dict):
         return result
 
     def empty(self):
-        return VoiceList(( (name, EventList(resolution=self[name].resolution)) for name in self ))
+        return VoiceList(( (name, EventList(resolution=self[name].resolution)) for name in self ), self.executor)
 
     def get(self, r):
-        return VoiceList(( (name, self[name].get(r)) for name in self ))
+        return self._fan_out('get', r)
 
     def slice(self, r):
-        return VoiceList(( (name, self[name].slice(r)) for name in self ))
+        return self._fan_out('slice', r)
 
     def __iadd__(self, other):
         for k in self:
@@ -351,7 +1170,7 @@ class VoiceList(dict):
         return self
 
     def __add__(self, other):
-        return VoiceList(( (name, self[name].clone().paste(other[name])) for name in self ))
+        return VoiceList(( (name, self[name].clone().paste(other[name])) for name in self ), self.executor)
 
     def extend(self, v):
         for k in self:
@@ -373,22 +1192,39 @@ class VoiceList(dict):
 
     def __getattr__(self, name):
 
-        ALLOWED = ('add_event', 'apply', 'add_attr', 'append')
-
-        if not name in ALLOWED:
+        if not name in self.MUTATORS:
             raise AttributeError("Not a valid method: %s" % name)
 
         def f(*args, **kwargs):
-            result = VoiceList()
-            for k in self:
-                result[k] = getattr(self[k], name)(*args, **kwargs)
-            return result
+            return self._fan_out(name, *args, **kwargs)
 
         return f
 
     def to_lily(self, context={}):
+        return "".join(self.iter_lily(context))
+
+    def iter_lily(self, context={}):
 
         context['bar_breaks'] = True
 
-        return "\n\n".join([ "{0} = {{\n{1}\n}}".format(track, self[track].to_lily(context))
-            for track in self])
+        if self.executor is not None:
+            # each track gets its own context as tracks render at the same time
+            names = list(self)
+            rendered = self._map(_render, [ (dict.__getitem__(self, k), dict(context)) for k in names ])
+            tracks = zip(names, ( (text, ) for text in rendered ))
+        else:
+            tracks = ( (k, self[k].iter_lily(context)) for k in self )
+
+        sep = ""
+        for track, pieces in tracks:
+            yield "{0}{1} = {{\n".format(sep, track)
+            for s in pieces:
+                yield s
+            yield "\n}"
+            sep = "\n\n"
+
+    def write_lily(self, stream, context={}):
+        '''
+        Writes the rendered output to a file like object as it is generated.
+        '''
+        return write_lily(self, stream, context)
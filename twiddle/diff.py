@@ -0,0 +1,198 @@
+'''
+Structural diff between two EventLists.
+
+    changes = old.diff(new, track_view)
+    for bar in changes.bars:
+        print bar.bar, bar.inserted, bar.removed, bar.modified
+    changes.apply(old)      # old now has the events of new
+
+Events belong to the bar they start in.  Each bar is hashed from the times and
+items of its events, so bars that hash differently are known to have changed
+without looking at their events.  Bars with the same hash have their keys
+compared to make sure, and only the changed bars are matched event by event.
+
+The patch is a list of (window, EventList) pairs for EventList.replace(), one
+per run of changed bars.  A window covers the events that run past the end of
+its bars, and so takes in any later bar with an event it would contain.
+'''
+from collections import namedtuple
+
+from .objects import Event, Note, TimeRange
+
+# inserted and removed are lists of events, modified (old, new) pairs of
+# events that start at the same tick
+BarDiff = namedtuple('BarDiff', ('bar', 'inserted', 'removed', 'modified'))
+
+class Diff(object):
+    '''
+    The changed bars as BarDiffs and the patch that turns one list into the other.
+    '''
+    def __init__(self, bars, patch):
+        self.bars = bars
+        self.patch = patch
+
+    def __nonzero__(self):
+        return bool(self.patch)
+
+    def apply(self, container):
+        ' Applies the patch to (a copy of) the original list '
+        for window, events in self.patch:
+            container.replace(window, events)
+        return container
+
+    def __repr__(self):
+        return "<Diff {0} bars>".format(len(self.bars))
+
+def _item_key(item):
+    if isinstance(item, Note):
+        pitch = tuple(item.pitch) if isinstance(item.pitch, list) else item.pitch
+        return 'Note', pitch, item.attrs.values
+    if isinstance(item, basestring):
+        return type(item).__name__, item
+    slots = getattr(type(item), '__slots__', None)
+    if slots is None:
+        return type(item).__name__, repr(item)
+    return (type(item).__name__, ) + tuple(( getattr(item, s) for s in slots ))
+
+def _key(e, items):
+    '''
+    A hashable key for an event or nested container.
+    items memoizes the item keys by id as most items are shared.
+    '''
+    if isinstance(e, Event):
+        k = items.get(id(e.item))
+        if k is None:
+            k = items[id(e.item)] = _item_key(e.item)
+        return e.time, k
+    return type(e).__name__, e.time, tuple(( _key(x, items) for x in e ))
+
+def _bars(container, track_view, items):
+    ' Maps bar number to (hash, keys, events) for the events starting in each bar '
+    bars = track_view.bar_numbers([ e.time.start for e in container ])
+    if hasattr(bars, 'tolist'):
+        bars = bars.tolist()
+
+    events = list(container)
+    get = items.get
+    keys = []
+    for e in container:
+        if type(e) is Event:
+            k = get(id(e.item))
+            if k is None:
+                k = items[id(e.item)] = _item_key(e.item)
+            keys.append((e.time, k))
+        else:
+            keys.append(_key(e, items))
+
+    # the events of a bar are a run unless the list is out of order
+    grouped = {}
+    lo, n = 0, len(bars)
+    for i in range(1, n + 1):
+        if i == n or bars[i] != bars[lo]:
+            run = grouped.setdefault(bars[lo], ([], []))
+            run[0].extend(keys[lo:i])
+            run[1].extend(events[lo:i])
+            lo = i
+
+    return dict(( (bar, (hash(tuple(k)), k, events)) for bar, (k, events) in grouped.items() ))
+
+def _compare(bar, old, new):
+    ' Matches the events of a changed bar '
+    # old keys left over once new ones are matched off are the removed events
+    counts = {}
+    for k in old[1]:
+        counts[k] = counts.get(k, 0) + 1
+
+    inserted = []
+    for k, e in zip(*new[1:]):
+        if counts.get(k):
+            counts[k] -= 1
+        else:
+            inserted.append(e)
+
+    removed = []
+    for k, e in zip(*old[1:]):
+        if counts.get(k):
+            counts[k] -= 1
+            removed.append(e)
+
+    modified = []
+    starts = dict(( (e.time.start, e) for e in reversed(removed) ))
+    for e in list(inserted):
+        original = starts.pop(e.time.start, None)
+        if original is not None:
+            modified.append((original, e))
+            inserted.remove(e)
+            removed.remove(original)
+    return BarDiff(bar, inserted, removed, modified)
+
+def diff(a, b, track_view=None):
+    '''
+    Returns the Diff from EventList a to EventList b, by bar of track_view.
+    '''
+    from .containers import EventList
+
+    if track_view is None:
+        track_view = a.get_track_view()
+    if b.resolution != a.resolution:
+        b = EventList(b.at_resolution(a.resolution), resolution=a.resolution)
+
+    items = {}
+    old = _bars(a, track_view, items)
+    new = _bars(b, track_view, items)
+    empty = (None, [], [])
+
+    def differs(bar):
+        a, b = old.get(bar, empty), new.get(bar, empty)
+        # equal hashes are almost always equal bars
+        return a[0] != b[0] or a[1] != b[1]
+
+    changed = sorted(( bar for bar in set(old) | set(new) if differs(bar) ))
+
+    bars = [ _compare(bar, old.get(bar, empty), new.get(bar, empty)) for bar in changed ]
+
+    def bar_events(bar):
+        return old.get(bar, empty)[2] + new.get(bar, empty)[2]
+
+    extents = {}
+    def extent(bar):
+        ' The latest stop of the events in a bar of either list '
+        if bar not in extents:
+            extents[bar] = max([ e.time.stop for e in bar_events(bar) ] or [None])
+        return extents[bar]
+
+    def contained(bar, window):
+        ' Whether replace() would remove an event of the bar, as TimeRange.contains() '
+        return any(( window.contains(e.time) for e in bar_events(bar) ))
+
+    patch = []
+    pending = set(changed)
+    for first in changed:
+        if first not in pending:
+            continue
+        run = set([first])
+        pending.discard(first)
+        start = track_view.beat(first)
+        stop = max(track_view.beat(first + 1), extent(first))
+
+        # grow the window until it contains no event of a bar outside the run,
+        # taking in whole bars so all the events written are replaced
+        grown = True
+        while grown:
+            grown = False
+            bar = first + 1
+            while track_view.beat(bar) < stop:
+                if bar not in run and (bar in pending or contained(bar, TimeRange(start, stop))):
+                    run.add(bar)
+                    pending.discard(bar)
+                    end = max(track_view.beat(bar + 1), extent(bar))
+                    if end > stop:
+                        stop = end
+                        grown = True
+                bar += 1
+
+        events = [ e for bar in sorted(run) for e in new.get(bar, empty)[2] ]
+        window = TimeRange(start, stop)
+        patch.append((window, EventList(events, window, a.resolution)))
+
+    return Diff(bars, patch)
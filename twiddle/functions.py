@@ -1,86 +1,134 @@
 from .objects import Note, Event, TimeRange, Instruction
+from .containers import time_key, CONTAINERS, ParallelEventList
 
 import logging
 logger = logging.getLogger(__name__)
 
-def quantize(step):
-
-    def f(notes):
-        m = float(notes.resolution * 4 / step)
-        def f(i):
-            return int(round(i / m) * m)
-
-        for e in notes:
-            stop = e.start + e.item.duration
-            e.start = f(e.start)
-            new_duration = f(stop - e.start)
-            
-            e.item = e.item._replace(duration=new_duration)
-    return f
+def quantize(container, step=16, grids=None, swing=2.0/3):
+    '''
+    Snaps the events to the grid that fits each beat best: straight notes of
+    1/step, triplets of them or pairs swung by swing.  Notes are kept at
+    least one grid step long.  Needs numpy.
+    '''
+    from . import columnar
+    if grids is None:
+        grids = columnar.GRIDS
+    if getattr(container, 'columnar', False):
+        return columnar.quantize(container, step, grids, swing)
+
+    events = list(container.event_iter())
+    if not events:
+        return container
+    start, stop = columnar.quantize_times(
+            [ e.time.start for e in events ], [ e.time.stop for e in events ],
+            [ isinstance(e.item, Note) for e in events ],
+            container.resolution, step, grids, swing)
+
+    for e, time in zip(events, zip(start.tolist(), stop.tolist())):
+        if time != e.time:
+            e.time = TimeRange.interned(*time)
+    container.time = columnar.quantize_window(container.time, start, stop, container.resolution, step)
+
+    if any(( isinstance(x, CONTAINERS) for x in container )):
+        # the voices no longer fit so split them again
+        from .generators import sequence_builder
+        container[:] = sequence_builder(events, container.resolution)
+    else:
+        container.sort(key=time_key)
+        container.reindex()
+        container.touch()
+    return container
 
 def add_attr(container, attr):
-    for e in container:
-        try:
-            e.add_attr(attr)
-        except AttributeError: # not a Note event
-            pass
+    if getattr(container, 'columnar', False):
+        from . import columnar
+        return columnar.add_attr(container, attr)
+
+    # note_iter() takes in the notes of separated voices
+    for e in container.note_iter():
+        e.add_attr(attr)
+    container.touch()
     return container
 
 def group(container, interval, start, end):
 
     notes = container.note_events()
     for i in range(interval, len(notes)+1, interval):
-        notes[i-interval].item.add_attr(start)
-        notes[i-1].item.add_attr(end)
-    
+        notes[i-interval].add_attr(start)
+        notes[i-1].add_attr(end)
+
+    container.touch()
     return container
 
 def slur(container, interval=None):
     if interval is not None:
         return group(container, interval, '(', ')')
-    container[0].item.add_attr('(')
-    container[-1].item.add_attr(')')
+    container[0].add_attr('(')
+    container[-1].add_attr(')')
+    container.touch()
 
 def beam(container, interval):
     return group(container, interval, '[', ']')
 
 def cres(container):
     notes = container.note_events()
-    container[0].item.add_attr(r'\<')
-    container[-1].item.add_attr(r'\!')
+    container[0].add_attr(r'\<')
+    container[-1].add_attr(r'\!')
+    container.touch()
     return container
 
 def mark(container, opening, closing):
     list.insert(container, 0, Event(TimeRange(container.time.start, container.time.start), Instruction(opening)))
     container.add_event(container.time.stop, closing)
+    container.reindex()
+    container.touch()
     return container
 
 def extend(container, max_gap):
+    if getattr(container, 'columnar', False):
+        from . import columnar
+        return columnar.extend(container, max_gap)
+
     gap_ticks = float(container.resolution * 4 / max_gap)
     logger.debug("Removing gaps shorter than %d", gap_ticks)
 
-    notes = container.note_events() + [Event(TimeRange(container.time.stop, container.time.stop), None)]
-    for i in range(len(notes)-1):
-        gap = notes[i+1].time.start - notes[i].time.stop
-        if gap > 0 and gap <= gap_ticks:
-            # logger.debug("Extending note at %d by %d", notes[i].time.start, gap)
-
-            notes[i].set_time(stop=notes[i+1].time.start)
-            #if isinstance(notes[i], ParallelEventList):
-            #    for s in notes[i]: s.set_time(stop=notes[i].time.stop)
+    _extend_gaps(container, container.time.stop, gap_ticks)
+    container.touch()
+    return container
 
-    return container 
+def _extend_gaps(container, stop, gap_ticks):
+    '''
+    Extends each note up to the next item when the gap is at most gap_ticks.
+    Nested containers keep their time: notes before them stop at their start
+    and their voices are filled up to their end.
+    '''
+    items = [ x for x in container if isinstance(x, CONTAINERS) or isinstance(x.item, Note) ]
+    for i, x in enumerate(items):
+        if isinstance(x, CONTAINERS):
+            for voice in (x if isinstance(x, ParallelEventList) else (x, )):
+                _extend_gaps(voice, x.time.stop, gap_ticks)
+            continue
+        following = items[i+1].time.start if i + 1 < len(items) else stop
+        gap = following - x.time.stop
+        if gap > 0 and gap <= gap_ticks:
+            x.set_time(stop=following)
+    # the index holds the old stops
+    container.reindex()
 
 def transpose(container, offset):
+    if getattr(container, 'columnar', False):
+        from . import columnar
+        return columnar.transpose(container, offset)
+
     for note in container.note_iter():
-        if isinstance(note.item.pitch, int):
-            note.item.pitch = note.item.pitch + offset
-        else:
-            note.item.pitch = [ p + offset for p in note.item.pitch ]
+        note.item = note.item.transposed(offset)
 
+    container.touch()
     return container
 
 def flatten(container):
+    ' Replaces any nested containers with their events '
+    container[:] = sorted(container.event_iter(), key=time_key)
     return container
 
 def octave_up(container, r):
@@ -90,32 +138,19 @@ def octave_up(container, r):
 
 def attribute_list(container, items):
     for position, attr in items:
-        container.get(position).add_attr('\\' + attr)
+        found = container.get(position)
+        if not found:
+            continue
+        found.add_attr('\\' + attr)
+        container.touch(found.time)
     return container
 
 def sequential(container):
+    '''
+    Splits overlapping events into voices so the container renders without
+    dropping any of them.
+    '''
+    from .generators import sequence_builder
 
-    result = SequentialEventList(time=seq.time, resolution=seq.resolution)
-    parallel = None
-    last = TimeRange(-1, -1)
-
-    for event in container:
-        if parallel is not None and event.time.is_after(parallel.time): # can close our ParallelEventList
-            logger.debug("Closing simultaneous container at %d", multi.stop)
-            parallel.close()
-            parallel = None
-
-        if multi is None:
-            try:
-                result.append(event)
-            except SequenceError:
-                prev = result.pop()
-                logger.debug("Creating simultaneous container at %d", prev.time.start)
-                parallel = ParallelEventList(time=prev.time, resolution=resolution)
-                parallel.append(prev)
-                parallel.append(event)
-                result.append(parallel)
-        else:
-            parallel.append(event)
-
-    return result
+    container[:] = sequence_builder(container.event_iter(), container.resolution)
+    return container
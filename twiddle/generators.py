@@ -1,6 +1,8 @@
 #from mingus.containers import Note
+import heapq
+
 from .objects import Event, Note, TimeRange
-from .containers import EventList
+from .containers import EventList, ParallelEventList, time_key
 
 import logging
 logger = logging.getLogger(__name__)
@@ -14,7 +16,7 @@ def notes_from_string(s, clock=0):
         duration = int(duration)
         if note != 'R':
             pitch = NOTES.index(note) % 12 + 48
-            yield Event(TimeRange(clock, clock+duration), Note(pitch, ()))
+            yield Event(TimeRange.interned(clock, clock+duration), Note.interned(pitch))
         clock += duration
 
 def from_string(s, resolution=1, start=0):
@@ -31,6 +33,14 @@ def from_tuples(seq):
     return n
 
 def notes_from_midi(track, quantize=48):
+    '''
+    Note events from a raw track chunk or a python-midi Track.
+    '''
+    if isinstance(track, (str, bytearray)):
+        from .midifile import track_notes
+        for e in track_notes(track, quantize):
+            yield e
+        return
 
     clock = 0
     pending = {}
@@ -44,17 +54,21 @@ def notes_from_midi(track, quantize=48):
         if e.name == 'Note Off' or (e.name == 'Note On' and e.velocity == 0):
             start = pending[e.pitch]
             if start != clock:
-                yield Event(TimeRange(start, clock), Note(e.pitch, ()))
+                yield Event(TimeRange.interned(start, clock), Note.interned(e.pitch))
         elif e.name == 'Note On':
             pending[e.pitch] = clock
         else:
             logger.debug(e)
 
 def group_chords(seq):
-
+    '''
+    Merges Notes with the same time into chords.
+    seq: a sorted list of events
+    '''
     last = None
     for event in seq:
-        if last is not None and last.time == event.time:
+        if last is not None and last.time == event.time \
+                and isinstance(last.item, Note) and isinstance(event.item, Note):
             last.item &= event.item
         else:
             if last is not None: yield last
@@ -62,40 +76,71 @@ def group_chords(seq):
     if last is not None:
         yield last
 
+def assign_voices(events):
+    '''
+    Splits overlapping events between the fewest voices.
+    events: sorted by start time
+    Returns a list of voices, each a list of events that don't overlap.
+
+    A sweep over the starts keeps a heap of the voices still sounding by the
+    time they end, so each event costs O(log n).  Freed voices are reused
+    lowest first to keep the material in the upper voices.
+    '''
+    voices = []
+    active = []     # (stop, voice)
+    free = []       # voice numbers
+    for e in events:
+        start = e.time.start
+        while active and active[0][0] <= start:
+            heapq.heappush(free, heapq.heappop(active)[1])
+        if free:
+            v = heapq.heappop(free)
+        else:
+            v = len(voices)
+            voices.append([])
+        voices[v].append(e)
+        heapq.heappush(active, (e.time.stop, v))
+    return voices
 
+def clusters(events):
+    '''
+    Groups sorted events into runs that overlap, yielding (start, stop, events).
+    '''
+    cluster = []
+    start = stop = None
+    for e in events:
+        t = e.time
+        if cluster and t.start >= stop:
+            yield start, stop, cluster
+            cluster = []
+        if not cluster:
+            start, stop = t
+        elif t.stop > stop:
+            stop = t.stop
+        cluster.append(e)
+    if cluster:
+        yield start, stop, cluster
 
 def sequence_builder(seq, resolution):
     '''
-    seq: a sorted list of events
+    Builds an EventList without overlapping events from seq.
+    Overlapping material is split into voices, each run becoming a
+    ParallelEventList of EventLists in place of its events.
     '''
+    events = list(group_chords(sorted(seq, key=time_key)))
 
-    result = SequentialContainer(resolution=resolution)
-    multi = None
-    last = None
-
-
-    for event in seq:
-        if multi is not None and event.start >= multi.stop: # can close our multi
-            logger.debug("Closing simultaneous container at %d", multi.stop)
-            multi.close()
-            multi = None
-
-        if multi is None:
-            try:
-                if last and last.start == event.start and last.stop == event.stop:
-                    last.item &= event.item
-                else:
-                    last = event
-                    result.append(event)
-            except SequenceError:
-                prev = result.pop()
-                logger.debug("Creating simultaneous container at %d", prev.start)
-                multi = SimultaneousContainer(start=prev.start, resolution=resolution)
-                multi.place_item(prev)
-                multi.place_item(event)
-                result.append(multi)
+    items = []
+    for start, stop, cluster in clusters(events):
+        if len(cluster) == 1:
+            items.append(cluster[0])
         else:
-            multi.place_item(event)
-
-    return result
-
+            logger.debug("Splitting %d overlapping events at %d", len(cluster), start)
+            window = TimeRange.interned(start, stop)
+            parallel = ParallelEventList(window, separator=ParallelEventList.VOICES)
+            for voice in assign_voices(cluster):
+                parallel.append(EventList(voice, window, resolution))
+            items.append(parallel)
+
+    # runs are in order so the last one ends last
+    time = TimeRange(items[0].time.start, stop) if items else TimeRange(-1, -1)
+    return EventList(items, time, resolution)
@@ -10,19 +10,14 @@ OCTAVE_UP       = r'\ottava #1'
 OCTAVE_NORMAL   = r'\ottava #0'
 OCTAVE_DOWN     = r'\ottava #-1'
 
-def int_to_note(i, key=0, accidentals=('es', 'is')):
-
-    if i is None:
-        return "r"
-
-    if isinstance(i, (list, tuple)):
-        if len(i) == 1: return int_to_note(i[0])
-        return "<{0}>".format(" ".join([ int_to_note(x, key) for x in i ]))
-
+def spell_note(i, sharp, accidentals=('es', 'is')):
+    '''
+    Spells a single pitch, using sharps or flats for the black notes.
+    '''
     pitch = LILY_NOTES[i % 12]
     a = ""
     if pitch == "_":
-        if key >= 0:
+        if sharp:
             i -=1
             a = accidentals[1]
         else:
@@ -32,8 +27,34 @@ def int_to_note(i, key=0, accidentals=('es', 'is')):
 
     return "%s%s" % (pitch, LILY_OCTAVES[i/12])
 
+# (flats, sharps) spellings for every pitch in range, by accidentals
+SPELLINGS = {}
 
-def duration_to_length(d, resolution):
+def spelling_table(accidentals=('es', 'is')):
+    try:
+        return SPELLINGS[accidentals]
+    except KeyError:
+        pitches = range(len(LILY_OCTAVES) * 12)
+        table = SPELLINGS[accidentals] = tuple(
+            [ spell_note(i, sharp, accidentals) for i in pitches ] for sharp in (False, True))
+        return table
+
+def int_to_note(i, key=0, accidentals=('es', 'is')):
+
+    if i is None:
+        return "r"
+
+    if isinstance(i, (list, tuple)):
+        if len(i) == 1: return int_to_note(i[0])
+        return "<{0}>".format(" ".join([ int_to_note(x, key) for x in i ]))
+
+    table = spelling_table(accidentals)[key >= 0]
+    if 0 <= i < len(table):
+        return table[i]
+    return spell_note(i, key >= 0, accidentals)
+
+
+def length_token(d, resolution):
     '''
     3/? = 1 dot
     7/? = 2 dot
@@ -74,17 +95,73 @@ def duration_to_length(d, resolution):
     for i in (1, 2, 4, 8, 16, 32):
         if 1.0 / i < f: return "{0}*{1}".format(i, f*i)
 
+# tick length -> token for every representable duration, by resolution
+DURATIONS = {}
+
+def duration_table(resolution):
+    try:
+        return DURATIONS[resolution]
+    except KeyError:
+        table = DURATIONS[resolution] = {}
+        whole = resolution * 4
+        for denominator in (1, 2, 4, 8, 16, 32, 64, 128):
+            for numerator in (1, 3, 7, 15, 31, 63):
+                d, r = divmod(whole * numerator, denominator)
+                if r == 0:
+                    table.setdefault(d, length_token(d, resolution))
+        return table
+
+def duration_to_length(d, resolution):
+    '''
+    Lilypond duration for the given length in ticks.
+    See length_token() for the rules.
+    '''
+    try:
+        return duration_table(resolution)[d]
+    except KeyError:
+        return length_token(d, resolution)
+
+
+def iter_lily(x, context={}):
+    '''
+    Rendered output of any renderable as an iterable of strings.
+    Containers stream their output, anything else is rendered in one go.
+    '''
+    f = getattr(x, 'iter_lily', None)
+    if f is None:
+        return (x.to_lily(context), )
+    return f(context)
+
+def write_lily(x, stream, context={}):
+    '''
+    Writes the rendered output to a file like object as it is generated.
+    '''
+    for s in iter_lily(x, context):
+        stream.write(s)
+    return stream
+
 class LilyBlock(list):
     glue = " "
     ends = "{}"
     newlines = "\n"
-	
+
     def to_lily(self, state={}):
-	if len(self) == 0: raise Exception("No content")
+        return "".join(self.iter_lily(state))
+
+    def iter_lily(self, state={}):
+        if len(self) == 0: raise Exception("No content")
+
+        yield "".join(["\\new ", self.__class__.__name__, " ", self.ends[0], self.newlines])
+        glue = ""
+        for x in self:
+            yield glue
+            for s in iter_lily(x, state):
+                yield s
+            glue = self.glue
+        yield self.newlines + self.ends[1]
 
-	output = self.glue.join([ x.to_lily(state) for x in self ])
-		
-	return "".join(["\\new ", self.__class__.__name__, " ", self.ends[0], self.newlines, output, self.newlines, self.ends[1]])
+    def write_lily(self, stream, state={}):
+        return write_lily(self, stream, state)
 
 
 class Staff(LilyBlock):
@@ -93,4 +170,3 @@ class Staff(LilyBlock):
 class PianoStaff(LilyBlock):
     ends = ("<<", ">>")
     glue = "\n"
-	
@@ -0,0 +1,249 @@
+'''
+Memory accounting for scores.
+
+report() walks an EventList or VoiceList and adds up sys.getsizeof() of
+everything it holds by category, counting each object once however many
+events share it:
+
+    containers    the lists themselves and their time ranges
+    events        Event objects
+    time_ranges   event TimeRanges and their ticks
+    notes         Notes and their pitches
+    attributes    AttributeSets with their tuples, strings and caches
+    objects       other items (instructions, comments, keys...)
+    index         TimeIndex arrays
+    render_cache  rendered bars kept for render_track()
+    columns       numpy columns of a ColumnarEventList
+
+A VoiceList report has a report per track as well as the total, and as
+interned objects are shared the tracks can add up to more than the total.
+
+allocations() measures what a block of code allocates, with tracemalloc
+where it is available and from the objects the garbage collector gained
+otherwise:
+
+    with memory.allocations() as found:
+        voices = VoiceList.from_midi('score.mid')
+    memory.write_allocations(found, sys.stdout)
+'''
+import gc
+import sys
+from collections import defaultdict
+from contextlib import contextmanager
+
+from .objects import Event, Note
+
+CATEGORIES = ('containers', 'events', 'time_ranges', 'notes', 'attributes',
+        'objects', 'index', 'render_cache', 'columns')
+
+class Counter(object):
+    ' Bytes and object counts by category, each object counted once '
+
+    def __init__(self, seen=None):
+        self.seen = set() if seen is None else seen
+        self.bytes = defaultdict(int)
+        self.count = defaultdict(int)
+
+    def add(self, category, obj):
+        ' Adds obj and returns True if it hasn\'t been counted before '
+        if id(obj) in self.seen:
+            return False
+        self.seen.add(id(obj))
+        self.bytes[category] += sys.getsizeof(obj)
+        self.count[category] += 1
+        return True
+
+    def add_all(self, category, seq):
+        for x in seq:
+            self.add(category, x)
+
+def _time(counter, category, time):
+    if counter.add(category, time):
+        counter.add_all(category, time)
+
+def _attributes(counter, attrs):
+    if not counter.add('attributes', attrs):
+        return
+    counter.add('attributes', attrs.values)
+    counter.add_all('attributes', attrs.values)
+    counter.add('attributes', attrs.suffix)
+    for cache in (attrs._added, attrs._removed, attrs._merged):
+        counter.add('attributes', cache)
+
+def _note(counter, note):
+    if not counter.add('notes', note):
+        return
+    if isinstance(note.pitch, list):
+        counter.add('notes', note.pitch)
+        counter.add_all('notes', note.pitch)
+    else:
+        counter.add('notes', note.pitch)
+    _attributes(counter, note.attrs)
+
+def _columns(counter, container):
+    if counter.add('containers', container):
+        counter.bytes['columns'] += container.nbytes
+        counter.count['columns'] += len(container.start)
+        _time(counter, 'containers', container.time)
+
+def _walk(counter, container):
+    if getattr(container, 'columnar', False):
+        return _columns(counter, container)
+    if not counter.add('containers', container):
+        return
+    _time(counter, 'containers', container.time)
+
+    index = getattr(container, '_index', None)
+    if index is not None and counter.add('index', index):
+        for values in (index.starts, index.max_stops, index.min_stops):
+            counter.add('index', values)
+            counter.add_all('index', values)
+
+    fragments = getattr(container, '_fragments', None)
+    if fragments and counter.add('render_cache', fragments):
+        for chunks in fragments.values():
+            counter.add('render_cache', chunks)
+            counter.add_all('render_cache', chunks.values())
+
+    for e in container:
+        if not isinstance(e, Event):
+            # a nested container
+            _walk(counter, e)
+            continue
+        if not counter.add('events', e):
+            continue
+        _time(counter, 'time_ranges', e.time)
+        if isinstance(e.item, Note):
+            _note(counter, e.item)
+        else:
+            counter.add('objects', e.item)
+
+def _summary(counter, events, notes):
+    total = sum(counter.bytes.values())
+    return {
+        'bytes': total,
+        'events': events,
+        'notes': notes,
+        'bytes_per_note': float(total) / notes if notes else None,
+        'categories': dict(( (name, { 'bytes': counter.bytes[name], 'count': counter.count[name] })
+            for name in CATEGORIES if counter.count[name] )),
+    }
+
+def _sizes(container):
+    if getattr(container, 'columnar', False):
+        return len(container), len(container.note_events())
+    events = notes = 0
+    for e in container.event_iter():
+        events += 1
+        if isinstance(e.item, Note):
+            notes += 1
+    return events, notes
+
+def report(obj):
+    '''
+    Memory used by an EventList, ColumnarEventList or VoiceList as a dict of
+    bytes, events, notes, bytes_per_note and the bytes and object count of
+    each category, plus a report for each track of a VoiceList.
+    '''
+    if not isinstance(obj, dict):
+        counter = Counter()
+        _walk(counter, obj)
+        return _summary(counter, *_sizes(obj))
+
+    total = Counter()
+    total.add('containers', obj)
+    tracks = {}
+    events = notes = 0
+    for name in obj:
+        track = dict.__getitem__(obj, name)
+        counter = Counter()
+        _walk(counter, track)
+        _walk(total, track)
+        sizes = _sizes(track)
+        events += sizes[0]
+        notes += sizes[1]
+        tracks[name] = _summary(counter, *sizes)
+    result = _summary(total, events, notes)
+    result['tracks'] = tracks
+    return result
+
+def write_report(report, stream):
+    stream.write("%-14s %12s %10s\n" % ("category", "bytes", "objects"))
+    for name in CATEGORIES:
+        if name in report['categories']:
+            c = report['categories'][name]
+            stream.write("%-14s %12d %10d\n" % (name, c['bytes'], c['count']))
+    stream.write("%-14s %12d\n" % ("total", report['bytes']))
+    if report['notes']:
+        stream.write("%d events, %d notes, %.1f bytes per note\n" %
+                (report['events'], report['notes'], report['bytes_per_note']))
+    for name in sorted(report.get('tracks', ())):
+        track = report['tracks'][name]
+        stream.write("  %-12s %12d bytes %8d notes\n" % (name, track['bytes'], track['notes']))
+
+class Allocations(object):
+    '''
+    What a block allocated: bytes is the net growth and top lists the
+    biggest (where, bytes, count) changes.  method is 'tracemalloc' or
+    'objects', where where is a type name and the bytes are the
+    sys.getsizeof() of the new objects the garbage collector tracks (so not
+    strings, numbers or tuples of them).
+    '''
+    def __init__(self, method):
+        self.method = method
+        self.bytes = 0
+        self.top = []
+
+def _new_objects(before):
+    ' Maps type name to [bytes, count] of the tracked objects whose ids are not in before '
+    new = [ x for x in gc.get_objects() if id(x) not in before ]
+    found = defaultdict(lambda: [0, 0])
+    for x in new:
+        entry = found[type(x).__name__]
+        entry[0] += sys.getsizeof(x)
+        entry[1] += 1
+    return found
+
+@contextmanager
+def allocations(limit=10):
+    ' Measures the allocations made in the block, see Allocations '
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+
+    if tracemalloc is not None:
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        result = Allocations('tracemalloc')
+        before = tracemalloc.take_snapshot()
+        try:
+            yield result
+            after = tracemalloc.take_snapshot()
+        finally:
+            if started:
+                tracemalloc.stop()
+        stats = after.compare_to(before, 'lineno')
+        result.bytes = sum(( s.size_diff for s in stats ))
+        result.top = [ (str(s.traceback), s.size_diff, s.count_diff) for s in stats[:limit] ]
+        return
+
+    result = Allocations('objects')
+    gc.collect()
+    # the objects are kept alive so no new one can reuse their ids
+    alive = gc.get_objects()
+    before = set(( id(x) for x in alive ))
+    before.update((id(alive), id(before)))
+    yield result
+    gc.collect()
+    found = _new_objects(before)
+    del alive
+    result.bytes = sum(( size for size, n in found.values() ))
+    grown = sorted(( (name, size, n) for name, (size, n) in found.items() ), key=lambda x: -x[1])
+    result.top = grown[:limit]
+
+def write_allocations(found, stream):
+    stream.write("%d bytes allocated (%s)\n" % (found.bytes, found.method))
+    for where, size, count in found.top:
+        stream.write("%12d %10d  %s\n" % (size, count, where))
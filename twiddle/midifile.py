@@ -0,0 +1,227 @@
+'''
+Standard MIDI File support.
+
+Reads the chunk structure up front but only decodes a track when its notes
+are iterated, straight from the bytes without building an object per message.
+'''
+import struct
+from array import array
+
+from .objects import Event, Note, TimeRange
+
+import logging
+logger = logging.getLogger(__name__)
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+META = 0xFF
+END_OF_TRACK = 0x2F
+SYSEX = (0xF0, 0xF7)
+
+# number of data bytes for each channel message type
+DATA_BYTES = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
+
+class MidiError(Exception):
+    pass
+
+class MidiFile(object):
+    '''
+    The header fields and raw track chunks of a Standard MIDI File.
+    '''
+    __slots__ = ('format', 'resolution', 'tracks')
+
+    def __init__(self, format, resolution, tracks):
+        self.format = format
+        self.resolution = resolution
+        self.tracks = tracks
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __iter__(self):
+        return iter(self.tracks)
+
+def read_midifile(source):
+    '''
+    Reads a MIDI file from a filename or file object.
+    '''
+    if isinstance(source, basestring):
+        with open(source, 'rb') as f:
+            return parse_midifile(f.read())
+    return parse_midifile(source.read())
+
+def parse_midifile(data):
+    data = bytearray(data)
+
+    if data[:4] != b'MThd':
+        raise MidiError("Not a MIDI file")
+    if len(data) < 14:
+        raise MidiError("Truncated header")
+    length, format, count, division = struct.unpack('>LHHH', bytes(data[4:14]))
+    if division & 0x8000:
+        raise MidiError("SMPTE time division is not supported")
+
+    tracks = []
+    pos = 8 + length
+    while pos + 8 <= len(data):
+        kind = data[pos:pos+4]
+        length, = struct.unpack('>L', bytes(data[pos+4:pos+8]))
+        pos += 8
+        if kind == b'MTrk':
+            tracks.append(data[pos:pos+length])
+        else:
+            logger.debug("Skipping %s chunk", kind)
+        pos += length
+
+    if len(tracks) != count:
+        logger.warning("Header declares %d tracks but found %d", count, len(tracks))
+    return MidiFile(format, division, tracks)
+
+def read_vlq(data, pos):
+    ' Decodes a variable length quantity, returning (value, new position) '
+    value = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        value = (value << 7) | (b & 0x7F)
+        if not b & 0x80:
+            return value, pos
+
+def note_messages(data):
+    '''
+    Decodes a track chunk, yielding (tick, pitch, velocity) for every note message.
+    Note offs are given a velocity of 0.
+    '''
+    pos = 0
+    tick = 0
+    status = 0
+    end = len(data)
+
+    try:
+        while pos < end:
+            delta, pos = read_vlq(data, pos)
+            tick += delta
+
+            b = data[pos]
+            if b & 0x80:
+                pos += 1
+                if b == META:
+                    kind = data[pos]
+                    length, pos = read_vlq(data, pos + 1)
+                    pos += length
+                    if kind == END_OF_TRACK:
+                        return
+                    continue
+                if b in SYSEX:
+                    length, pos = read_vlq(data, pos)
+                    pos += length
+                    status = 0
+                    continue
+                if b >= 0xF0:
+                    # system common and real time messages don't belong in a file
+                    raise MidiError("Unexpected status byte 0x%02X at byte %d" % (b, pos - 1))
+                status = b
+            elif not status:
+                raise MidiError("Running status without a previous status at byte %d" % pos)
+
+            kind = status & 0xF0
+            if kind == NOTE_ON:
+                yield tick, data[pos], data[pos+1]
+            elif kind == NOTE_OFF:
+                yield tick, data[pos], 0
+            pos += DATA_BYTES[kind]
+    except IndexError:
+        raise MidiError("Track data ends in the middle of a message")
+
+def track_notes(data, quantize=48):
+    '''
+    Yields a note Event for each note on/off pair in a track chunk.
+    Ticks are quantized as they are read and notes that quantize to nothing are dropped.
+    '''
+    pending = {}
+
+    for tick, pitch, velocity in note_messages(data):
+        clock = int(round(float(tick) / quantize)) * quantize
+        if velocity:
+            pending[pitch] = clock
+            continue
+        try:
+            start = pending.pop(pitch)
+        except KeyError:
+            logger.debug("Note off without note on for %d at %d", pitch, tick)
+            continue
+        if start != clock:
+            yield Event(TimeRange.interned(start, clock), Note.interned(pitch))
+
+def pack_events(seq):
+    '''
+    Packs note Events into flat arrays for cheap pickling between processes.
+    Returns (starts, stops, counts, pitches) where counts gives the number of pitches per event.
+    '''
+    starts, stops, counts, pitches = array('l'), array('l'), array('B'), array('B')
+    for e in seq:
+        starts.append(e.time.start)
+        stops.append(e.time.stop)
+        if isinstance(e.item.pitch, (list, tuple)):
+            counts.append(len(e.item.pitch))
+            pitches.extend(e.item.pitch)
+        else:
+            counts.append(1)
+            pitches.append(e.item.pitch)
+    return starts, stops, counts, pitches
+
+def unpack_events(packed):
+    ' Inverse of pack_events() '
+    starts, stops, counts, pitches = packed
+    i = 0
+    for start, stop, count in zip(starts, stops, counts):
+        if count == 1:
+            pitch = pitches[i]
+        else:
+            pitch = list(pitches[i:i+count])
+        i += count
+        yield Event(TimeRange.interned(start, stop), Note.interned(pitch))
+
+def decode_track(args):
+    '''
+    Process pool worker: decodes a track chunk into packed, chord grouped notes.
+    '''
+    from .generators import group_chords
+    data, quantize = args
+    events = sorted(group_chords(track_notes(data, quantize)), key=lambda e: e.time)
+    return pack_events(events)
+
+def write_vlq(value):
+    result = [value & 0x7F]
+    value >>= 7
+    while value:
+        result.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytearray(reversed(result))
+
+def write_midifile(f, tracks, resolution=96):
+    '''
+    Writes tracks of note Events as a format 1 MIDI file.
+    The notes of EventLists are taken from note_iter(), so nested voices are included.
+    '''
+    f.write(b'MThd' + struct.pack('>LHHH', 6, 1, len(tracks), resolution))
+
+    for track in tracks:
+        messages = []
+        for e in (track.note_iter() if hasattr(track, 'note_iter') else track):
+            pitches = e.item.pitch if isinstance(e.item.pitch, (list, tuple)) else (e.item.pitch, )
+            for p in pitches:
+                messages.append((e.time.start, 1, p))
+                messages.append((e.time.stop, 0, p))
+        # note offs sort before note ons at the same tick
+        messages.sort()
+
+        chunk = bytearray()
+        tick = 0
+        for t, on, p in messages:
+            chunk += write_vlq(t - tick)
+            chunk += bytearray((NOTE_ON if on else NOTE_OFF, p, 64))
+            tick = t
+        chunk += bytearray((0, META, END_OF_TRACK, 0))
+
+        f.write(b'MTrk' + struct.pack('>L', len(chunk)) + bytes(chunk))
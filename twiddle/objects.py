@@ -7,11 +7,42 @@ logger = logging.getLogger(__name__)
 class TimeError(Exception):
     pass
 
+# entries kept by each intern table before it starts again
+INTERN_SIZE = 1 << 16
+
+class InternTable(dict):
+    '''
+    Maps values to a shared equal instance, built by factory on first use.
+    The table is simply emptied when it fills up, unless size is None.
+    '''
+    __slots__ = ('factory', 'size')
+
+    def __init__(self, factory, size=INTERN_SIZE):
+        dict.__init__(self)
+        self.factory = factory
+        self.size = size
+
+    def __missing__(self, key):
+        if self.size is not None and len(self) >= self.size:
+            self.clear()
+        value = self.factory(key)
+        # a value equal to its key can stand in for it
+        self[value if value == key else key] = value
+        return value
+
+# consecutive events share their boundary ticks
+TICKS = InternTable(lambda x: x)
+
 class TimeRange(namedtuple('TimeRange', ('start', 'stop'))):
     '''
 
     '''
 
+    @staticmethod
+    def interned(start, stop):
+        ' A shared TimeRange, for events that are kept around '
+        return TIME_RANGES[start, stop]
+
     @staticmethod
     def from_events(seq):
         try:
@@ -86,6 +117,8 @@ class TimeRange(namedtuple('TimeRange', ('start', 'stop'))):
     def __repr__(self):
         return "(%r,%r)" % (self.start, self.stop)
 
+TIME_RANGES = InternTable(lambda x: TimeRange(TICKS[x[0]], TICKS[x[1]]))
+
 class Event(object):
     """
     An Event has a time and an item.
@@ -97,6 +130,9 @@ class Event(object):
         self.time = time
         self.item = item
 
+    def __reduce__(self):
+        return Event, (self.time, self.item)
+
     @property
     def duration(self):
         return self.time.ticks
@@ -108,14 +144,27 @@ class Event(object):
         '''
         Returns a copy of the event bounded by the given tick range
         '''
-        e = Event(self.time | tick_range, self.item)
+        time = self.time
+        if time.start < tick_range.start or time.stop > tick_range.stop:
+            time = TIME_RANGES[time | tick_range]
+        e = Event(time, self.item)
         if self.time.stop > tick_range.stop:
             e.item += "~"
 
         return e
 
     def shift(self, offset):
-        return Event(self.time + offset, self.item)
+        return Event(TimeRange.interned(self.time.start + offset, self.time.stop + offset), self.item)
+
+    def add_attr(self, attr):
+        ' Adds an attribute to the item, replacing rather than changing a shared Note '
+        self.item = self.item.with_attr(attr)
+
+    def remove_attr(self, attr):
+        self.item = self.item.without_attr(attr)
+
+    def __lt__(self, other):
+        return self.time < other.time
 
     def __gt__(self, other):
         return self.time > other.time
@@ -139,42 +188,131 @@ def merge(a, b, t):
     return t(set(result))
 
 
+class AttributeSet(object):
+    '''
+    An ordered tuple of Note attributes, shared through the ATTRS registry.
+    Sets compare by identity, which the registry makes the same as by value.
+
+    Adding, removing and merging attributes are cached on the set, so passes
+    applying the same markers to many notes are dictionary lookups, and the
+    rendered suffix is only joined once.
+    '''
+    __slots__ = ('values', 'suffix', '_added', '_removed', '_merged')
+
+    def __init__(self, values=()):
+        self.values = tuple(values)
+        self.suffix = "".join(self.values)
+        self._added = {}
+        self._removed = {}
+        self._merged = {}
+
+    @staticmethod
+    def get(values):
+        ' The shared set for an attribute tuple (or set) '
+        if isinstance(values, AttributeSet):
+            return values
+        return ATTRS[tuple(values)]
+
+    def add(self, attr):
+        try:
+            return self._added[attr]
+        except KeyError:
+            result = self._added[attr] = ATTRS[self.values + (attr, )]
+            return result
+
+    def remove(self, attr):
+        try:
+            return self._removed[attr]
+        except KeyError:
+            result = self._removed[attr] = ATTRS[tuple(( x for x in self.values if x != attr ))]
+            return result
+
+    def merge(self, other):
+        try:
+            return self._merged[other.values]
+        except KeyError:
+            result = self._merged[other.values] = ATTRS[merge(self.values, other.values, tuple)]
+            return result
+
+    def __repr__(self):
+        return "AttributeSet(%r)" % (self.values, )
+
+# never emptied, as sets compare by identity (and there are few of them)
+ATTRS = InternTable(AttributeSet, size=None)
+
 class Note(object):
-    __slots__ = ('pitch', 'attr')
+    '''
+    A pitch (or list of pitches for a chord) with its attributes.
+
+    Attributes are kept as a shared AttributeSet, with attr giving the tuple.
+    Notes from interned() are shared between events so a Note is never
+    changed in place: with_attr() and without_attr() return the changed note
+    (see Event.add_attr()).
+    '''
+    __slots__ = ('pitch', 'attrs')
 
     def __init__(self, pitch, attr=()):
         self.pitch = pitch
-        self.attr = attr
+        self.attrs = AttributeSet.get(attr)
 
-    def add_attr(self, attr):
-        '''
-        Appends the given attribute to this note.
-        '''
-        self.attr += (attr, )
+    def __reduce__(self):
+        # unpickled notes are shared again
+        if isinstance(self.pitch, list):
+            return Note, (self.pitch, self.attrs.values)
+        return interned_note, (self.pitch, self.attrs.values)
 
-    def remove_attr(self, attr):
-        '''
-        Removes a given attribute
-        '''
-        self.attr = tuple(( x for x in self.attr if x != attr ))
+    @property
+    def attr(self):
+        return self.attrs.values
+
+    @staticmethod
+    def interned(pitch, attr=()):
+        ' A shared Note, chords get a Note of their own '
+        if isinstance(pitch, list):
+            return Note(pitch, attr)
+        return INTERNED_NOTES[pitch, AttributeSet.get(attr)]
+
+    def with_attr(self, attr):
+        ' A copy of the note with the attribute added '
+        if isinstance(self.pitch, list):
+            return Note(self.pitch, self.attrs.add(attr))
+        return INTERNED_NOTES[self.pitch, self.attrs.add(attr)]
+
+    def without_attr(self, attr):
+        ' A copy of the note without the attribute '
+        if isinstance(self.pitch, list):
+            return Note(self.pitch, self.attrs.remove(attr))
+        return INTERNED_NOTES[self.pitch, self.attrs.remove(attr)]
+
+    def transposed(self, offset):
+        ' A copy of the note shifted by offset semitones '
+        if isinstance(self.pitch, int):
+            return Note.interned(self.pitch + offset, self.attrs)
+        return Note([ p + offset for p in self.pitch ], self.attrs)
 
     def __add__(self, attr):
-        return Note(self.pitch, self.attr + (attr, ))
+        return self.with_attr(attr)
 
     def __and__(self, other):
         '''
         Returns the union of the two Notes.
         Pitches are combined.
         '''
-        return Note(merge(self.pitch, other.pitch, list), merge(self.attr, other.attr, tuple))
+        return Note(merge(self.pitch, other.pitch, list), self.attrs.merge(other.attrs))
 
     def to_lily(self, context={}):
         d = duration_to_length(context['tick_length'], context['resolution'])
         return "{0}{1}{2}".format(int_to_note(self.pitch, key=context.get('key', 'c')), 
-                d, "".join(self.attr))
+                d, self.attrs.suffix)
 
     def __repr__(self):
-        return "%r%s" % (self.pitch, "".join(self.attr))
+        return "%r%s" % (self.pitch, self.attrs.suffix)
+
+INTERNED_NOTES = InternTable(lambda x: Note(*x))
+
+def interned_note(pitch, attr=()):
+    ' Note.interned() as a plain function for pickle '
+    return Note.interned(pitch, attr)
 
 class Rest(object):
     __slots__ = ('c', 'repeat')
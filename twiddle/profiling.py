@@ -0,0 +1,177 @@
+'''
+Stage timing for the conversion pipeline.
+
+The expensive stages are wrapped in named spans
+
+    with profiling.span('midi.decode'):
+        ...
+
+which do nothing until profiling is enabled.  Spans nest, and each finished
+span is recorded against its path (the names of the enclosing spans) with
+its total and own time.  Hooks are called with (path, elapsed) as each span
+finishes.
+
+start() enables profiling with cProfile alongside and writes a summary,
+the cProfile stats and collapsed stacks (for flamegraph.pl and friends)
+when the process exits.
+'''
+import threading
+from timeit import default_timer as clock
+
+import logging
+logger = logging.getLogger(__name__)
+
+enabled = False
+
+# path -> [count, total seconds, own seconds]
+stats = {}
+hooks = []
+
+_local = threading.local()
+_lock = threading.Lock()
+
+class NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Span(object):
+    __slots__ = ('name', 'start', 'children')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = _stack()
+        self.children = 0.0
+        stack.append(self)
+        self.start = clock()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = clock() - self.start
+        stack = _stack()
+        path = tuple(( s.name for s in stack ))
+        stack.pop()
+        if stack:
+            stack[-1].children += elapsed
+        record(path, elapsed, elapsed - self.children)
+        return False
+
+def _stack():
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+def span(name):
+    ' Context manager timing a stage '
+    if not enabled:
+        return NULL_SPAN
+    return Span(name)
+
+def timed_iter(name, iterable):
+    '''
+    Times the work done producing each item of a generator, leaving out the
+    time the consumer spends between items.  Each item counts as a call.
+    '''
+    if not enabled:
+        return iterable
+    return _timed_iter(Span(name), iter(iterable))
+
+def _timed_iter(s, it):
+    while True:
+        with s:
+            try:
+                x = next(it)
+            except StopIteration:
+                return
+        yield x
+
+def record(path, elapsed, own):
+    with _lock:
+        try:
+            entry = stats[path]
+        except KeyError:
+            entry = stats[path] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] += own
+    for hook in hooks:
+        hook(path, elapsed)
+
+def add_hook(f):
+    ' f(path, elapsed) is called as each span finishes '
+    hooks.append(f)
+
+def remove_hook(f):
+    hooks.remove(f)
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    with _lock:
+        stats.clear()
+
+def summary():
+    ' Per stage totals as (name, count, total, own), totals across all paths '
+    stages = {}
+    with _lock:
+        for path, (count, total, own) in stats.items():
+            entry = stages.setdefault(path[-1], [0, 0.0, 0.0])
+            entry[0] += count
+            # recursive spans are only counted once in the total
+            if path[-1] not in path[:-1]:
+                entry[1] += total
+            entry[2] += own
+    return sorted(( (name, ) + tuple(v) for name, v in stages.items() ), key=lambda x: -x[2])
+
+def write_summary(stream):
+    stream.write("%-24s %10s %12s %12s\n" % ("stage", "calls", "total", "own"))
+    for name, count, total, own in summary():
+        stream.write("%-24s %10d %11.4fs %11.4fs\n" % (name, count, total, own))
+
+def write_collapsed(stream):
+    ' Own time per path in microseconds, one "a;b;c value" line each '
+    with _lock:
+        items = sorted(stats.items())
+    for path, (count, total, own) in items:
+        stream.write("%s %d\n" % (";".join(path), int(own * 1e6)))
+
+def start(prefix):
+    '''
+    Enables profiling for the rest of the process, writing PREFIX.txt (stage summary),
+    PREFIX.prof (cProfile stats) and PREFIX.folded (collapsed stacks) at exit.
+    '''
+    import atexit
+    import cProfile
+
+    profile = cProfile.Profile()
+
+    def finish():
+        profile.disable()
+        disable()
+        profile.dump_stats(prefix + '.prof')
+        with open(prefix + '.txt', 'w') as f:
+            write_summary(f)
+        with open(prefix + '.folded', 'w') as f:
+            write_collapsed(f)
+        logger.info("Profile written to %s.{txt,prof,folded}", prefix)
+
+    atexit.register(finish)
+    enable()
+    profile.enable()
+    return profile
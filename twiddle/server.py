@@ -0,0 +1,329 @@
+'''
+A long running conversion server, saving the process start up per file.
+
+    python -m twiddle.server --port 8765 -j 4
+    python -m twiddle.server --socket /tmp/twiddle.sock
+
+POST the MIDI file to /render and the LilyPond output comes back:
+
+    curl --data-binary @score.mid 'http://localhost:8765/render?meter=3/4&key=F'
+
+Query parameters are quantize (48), meter (4/4), key (C) and partial (0).
+GET /status returns the request counts as JSON.
+
+Connections are handled in threads and the conversions run in a pool of
+worker processes.  Workers keep the modules and spelling tables loaded, the
+TrackViews (with their rest layouts) they have used and an LRU of the files
+they have parsed, keyed by SHA-1, so repeated requests only re-render.
+'''
+import hashlib
+import json
+import os
+import stat
+import sys
+import threading
+import time
+import traceback
+import BaseHTTPServer
+import httplib
+import socket
+from collections import OrderedDict
+from io import BytesIO
+from SocketServer import ThreadingMixIn, UnixStreamServer
+from urlparse import urlparse, parse_qsl
+
+from .midifile import MidiError
+
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+
+# parsed files and track views kept by each worker
+PARSED_SIZE = 32
+VIEWS_SIZE = 64
+
+# largest request body accepted
+MAX_BODY = 16 << 20
+
+class RequestError(ValueError):
+    pass
+
+class LRU(object):
+    '''
+    A small least recently used mapping.
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, key, factory):
+        ' Returns the value for key, calling factory() to make it when missing '
+        try:
+            value = self.items.pop(key)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            value = factory()
+            if len(self.items) >= self.size:
+                self.items.popitem(last=False)
+        self.items[key] = value
+        return value
+
+    def __len__(self):
+        return len(self.items)
+
+def parse_options(query):
+    '''
+    Conversion options from a query string, raising RequestError for bad values.
+    '''
+    from .views import KEYS
+
+    params = dict(parse_qsl(query))
+    options = {
+        'quantize': 48,
+        'meter': (4, 4),
+        'key': 'C',
+        'partial': 0,
+    }
+    try:
+        for name in ('quantize', 'partial'):
+            if name in params:
+                options[name] = int(params.pop(name))
+        if 'meter' in params:
+            options['meter'] = tuple(( int(x) for x in params.pop('meter').split('/') ))
+    except ValueError as e:
+        raise RequestError(str(e))
+    if 'key' in params:
+        options['key'] = params.pop('key')
+
+    if options['quantize'] < 1:
+        raise RequestError("quantize must be positive")
+    if len(options['meter']) != 2 or min(options['meter']) < 1:
+        raise RequestError("meter must be like 3/4")
+    if options['key'] not in KEYS:
+        raise RequestError("Unknown key: %s" % options['key'])
+    if params:
+        raise RequestError("Unknown parameters: %s" % ", ".join(sorted(params)))
+    return options
+
+# state of the process doing the conversions
+_parsed = LRU(PARSED_SIZE)
+_views = LRU(VIEWS_SIZE)
+
+def warm():
+    ' Pool initializer: loads everything a conversion needs up front '
+    from . import containers, lily, midifile, views
+    lily.spelling_table()
+
+def render(job):
+    '''
+    Converts MIDI bytes, returning the LilyPond text.
+    Not thread safe: cached files are rendered in place.
+    '''
+    digest, data, options = job
+    from .containers import VoiceList
+    from .views import TrackView
+
+    voices = _parsed.get((digest, options['quantize']),
+            lambda: VoiceList.from_midi(BytesIO(data), options['quantize']))
+    key = (voices.resolution, options['partial'], options['meter'], options['key'])
+    view = _views.get(key, lambda: TrackView(*key))
+    return voices.to_lily({ 'track_view': view })
+
+class Converter(object):
+    '''
+    Runs render() in a pool of worker processes, or in this process one
+    request at a time if workers is 0.
+    '''
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.requests = self.errors = 0
+        self.started = time.time()
+        if workers == 0:
+            warm()
+            self.pool = None
+        else:
+            from multiprocessing import Pool
+            self.pool = Pool(workers, warm)
+
+    def convert(self, data, options):
+        job = (hashlib.sha1(data).hexdigest(), data, options)
+        with self.lock:
+            self.requests += 1
+        try:
+            if self.pool is None:
+                with self.lock:
+                    return render(job)
+            return self.pool.apply(render, (job, ))
+        except Exception:
+            with self.lock:
+                self.errors += 1
+            raise
+
+    def status(self):
+        result = {
+            'requests': self.requests,
+            'errors': self.errors,
+            'uptime': time.time() - self.started,
+            'workers': self.workers,
+        }
+        if self.pool is None:
+            result['cache'] = { 'parsed': len(_parsed), 'hits': _parsed.hits, 'misses': _parsed.misses }
+        return result
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    server_version = 'twiddle'
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/status':
+            return self.send_error(404)
+        self.respond(200, json.dumps(self.server.converter.status()), 'application/json')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/render':
+            return self.send_error(404)
+        try:
+            options = parse_options(url.query)
+            length = int(self.headers.get('Content-Length', 0))
+            if not 0 < length <= MAX_BODY:
+                raise RequestError("Expected a MIDI file of up to %d bytes" % MAX_BODY)
+        except (RequestError, ValueError) as e:
+            return self.respond(400, "%s\n" % e)
+
+        data = self.rfile.read(length)
+        start = time.time()
+        try:
+            text = self.server.converter.convert(data, options)
+        except MidiError as e:
+            return self.respond(400, "Bad MIDI file: %s\n" % e)
+        except Exception:
+            logger.exception("Conversion failed")
+            return self.respond(500, traceback.format_exc())
+        logger.info("Rendered %d bytes in %.3fs", length, time.time() - start)
+        self.respond(200, text)
+
+    def respond(self, code, body, content_type='text/plain; charset=utf-8'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # unix socket peers have no address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'local'
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+class HTTPServer(ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+def remove_socket(path):
+    '''
+    Removes a unix socket left at path, returning False if something
+    other than a socket is there.
+    '''
+    try:
+        mode = os.lstat(path).st_mode
+    except OSError:
+        return True
+    if not stat.S_ISSOCK(mode):
+        return False
+    os.unlink(path)
+    return True
+
+def make_server(converter, host='127.0.0.1', port=DEFAULT_PORT, path=None):
+    '''
+    Returns a server listening on the unix socket path or on host:port.
+    '''
+    if path is not None:
+        if not remove_socket(path):
+            raise IOError("Not replacing %s, it is not a socket" % path)
+        server = UnixHTTPServer(path, Handler)
+    else:
+        server = HTTPServer((host, port), Handler)
+    server.converter = converter
+    return server
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+
+    def __init__(self, path, timeout=None):
+        httplib.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+def request(data, host='127.0.0.1', port=DEFAULT_PORT, path=None, timeout=None, **options):
+    '''
+    Client: converts MIDI bytes on a running server, returning the LilyPond text.
+    '''
+    from urllib import urlencode
+
+    if path is not None:
+        connection = UnixHTTPConnection(path, timeout)
+    else:
+        connection = httplib.HTTPConnection(host, port, timeout=timeout)
+    try:
+        url = '/render'
+        if options:
+            url += '?' + urlencode(sorted(options.items()))
+        connection.request('POST', url, data, { 'Content-Type': 'audio/midi' })
+        response = connection.getresponse()
+        body = response.read()
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise RequestError("%d %s: %s" % (response.status, response.reason, body.strip()))
+    return body
+
+def main(argv=None):
+    import argparse
+    from multiprocessing import cpu_count
+
+    parser = argparse.ArgumentParser(description="Serve MIDI to LilyPond conversions")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument('-s', '--socket', help="Listen on a unix socket instead")
+    parser.add_argument('-j', '--jobs', type=int, default=cpu_count(),
+            help="Worker processes (default all cores, 0 to convert in the server)")
+    parser.add_argument('-l', '--level', default="info", help="Logging level")
+
+    options = parser.parse_args(argv)
+    logging.basicConfig(level=getattr(logging, options.level.upper(), logging.INFO))
+
+    converter = Converter(options.jobs)
+    server = make_server(converter, options.host, options.port, options.socket)
+    logger.info("Listening on %s with %d workers", options.socket or "%s:%d" % server.server_address, options.jobs)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        converter.close()
+        if options.socket and not remove_socket(options.socket):
+            logger.warning("Leaving %s, it is no longer a socket", options.socket)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
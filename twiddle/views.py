@@ -1,4 +1,6 @@
 from collections import namedtuple
+from fractions import gcd
+from bisect import bisect_right
 from .containers import EventList
 from .objects import TimeRange, Event, Instruction, Rest, BarCheck, KeySignature
 
@@ -18,17 +20,38 @@ def lcd(a, b):
     ValueError: No common denominator for 3 and 5
 
     '''
-    for i in range(2, min(a, b)+1):
-        if a % i == 0 and b % i == 0: return i
+    g = gcd(a, b) if min(a, b) > 1 else 1
+    i = 2
+    while i * i <= g:
+        if g % i == 0: return i
+        i += 1
+    if g > 1: return g
     raise ValueError("No common denominator for %d and %d" % (a, b))
 
+# bounded memo of rest_layout() results
+REST_LAYOUTS = {}
+REST_CACHE_SIZE = 1024
+
 def rest_layout(rest_length, bar_length, divisions):
     '''
     Layout rests as best as possible
     >>> rest_layout(12, 12, 4)
     [12]
+    >>> rest_layout(9, 12, 4)
+    [6, 3]
     '''
-
+    key = (rest_length, bar_length, divisions)
+    try:
+        return list(REST_LAYOUTS[key])
+    except KeyError:
+        pass
+
+    if len(REST_LAYOUTS) >= REST_CACHE_SIZE:
+        REST_LAYOUTS.clear()
+    result = REST_LAYOUTS[key] = _rest_layout(rest_length, bar_length, divisions)
+    return list(result)
+
+def _rest_layout(rest_length, bar_length, divisions):
     l = bar_length
     result = []
     while True:
@@ -43,7 +66,7 @@ def rest_layout(rest_length, bar_length, divisions):
             result.append(l)
             break
 
-    return result
+    return tuple(result)
 
 class Boundary(namedtuple('Boundary', ('start_bar', 'start_tick', 'bar_length', 'divisions'))):
 
@@ -80,17 +103,47 @@ class Boundary(namedtuple('Boundary', ('start_bar', 'start_tick', 'bar_length',
             raise IndexError('Cannot calculate bar prior to %d' % self.start_tick)
 
         tick -= self.start_tick
+        offset = tick % self.bar_length
+        origin = tick - offset
+
+        for start, stop, repeat in self.rest_shape(offset, tick_length):
+            if repeat is None:
+                yield Event(TimeRange(origin + start, origin + start),
+                        BarCheck(self.bar_at(origin + start + self.start_tick)))
+            elif repeat:
+                yield Event(TimeRange(origin + start, origin + stop), Rest('R', repeat))
+            else:
+                yield Event(TimeRange(origin + start, origin + stop), Rest('r'))
+
+    def rest_shape(self, tick, tick_length):
+        '''
+        The rests for a gap starting tick into a bar, as (start, stop, repeat) tuples.
+        Repeat is 0 for a plain rest, the bar count for full bar rests and None for a bar check.
+        Shapes are cached on the Boundary as sparse parts repeat the same gaps over and over.
+        '''
+        cache = self.__dict__.setdefault('_rest_shapes', {})
+        try:
+            return cache[tick, tick_length]
+        except KeyError:
+            pass
+
+        if len(cache) >= REST_CACHE_SIZE:
+            cache.clear()
+        shape = cache[tick, tick_length] = tuple(self._rest_shape(tick, tick_length))
+        return shape
+
+    def _rest_shape(self, tick, tick_length):
 
         # first need to get to a bar start
         if tick % self.bar_length:
             rest_ticks = min(tick_length, self.bar_length - tick % self.bar_length)
 
             for r in sorted(rest_layout(rest_ticks, self.bar_length, self.divisions)):
-                yield Event(TimeRange(tick, tick+r), Rest('r'))
+                yield tick, tick+r, 0
                 tick += r
             tick_length -= rest_ticks
             if tick % self.bar_length == 0:
-                yield Event(TimeRange(tick, tick), BarCheck(self.bar_at(tick+self.start_tick)))
+                yield tick, tick, None
             else:
                 return
 
@@ -98,15 +151,15 @@ class Boundary(namedtuple('Boundary', ('start_bar', 'start_tick', 'bar_length',
         full_bars = int(tick_length  / self.bar_length)
         if full_bars:
             rest_length = full_bars * self.bar_length
-            yield Event(TimeRange(tick, tick + rest_length), Rest('R', full_bars))
+            yield tick, tick + rest_length, full_bars
             tick_length -= rest_length
             tick += rest_length
-            yield Event(TimeRange(tick, tick), BarCheck(self.bar_at(tick+self.start_tick)))
+            yield tick, tick, None
 
         # remaining rests
         if tick_length:
             for r in rest_layout(tick_length, self.bar_length, self.divisions):
-                yield Event(TimeRange(tick, tick+r), Rest('r'))
+                yield tick, tick+r, 0
                 tick += r
         
 
@@ -114,32 +167,53 @@ def calc_bar_length(resolution, meter):
     return resolution * 4  * meter[0] / meter[1]
 
 class TrackView(object):
+    '''
+    Maps bars and beats to ticks.
+    Boundaries and keys are kept sorted with parallel start tables for bisect lookups.
+    '''
 
     def __init__(self, resolution, partial=0, meter=(4, 4), key="C"):
         self.resolution = resolution
         self.partial = partial
         self.meters = []
+        self._boundaries = []
+        self._bar_starts = []
+        self._tick_starts = []
         self.keys = [(0, KEYS.index(key)-7)]
+        self._key_ticks = [0]
         self.set_meter(1, meter)
 
     def set_meter(self, start, meter):
-        self.meters.append((start, meter))
-        self.meters.sort()
-       
-        current_bar = 1 
-        bar_length = 0
-        if self.partial:
-            initial = self.meters[0][1]
-            bar_length = calc_bar_length(self.resolution, initial)
-            ticks = self.partial * bar_length / initial[0]
+        i = bisect_right(self.meters, (start, meter))
+        self.meters.insert(i, (start, meter))
+        self._update_boundaries(i)
+
+    def _update_boundaries(self, i):
+        '''
+        Recalculates the boundaries from meter i onwards.
+        '''
+        del self._boundaries[i:]
+        del self._bar_starts[i:]
+        del self._tick_starts[i:]
+
+        if i:
+            current_bar, ticks, bar_length, _ = self._boundaries[i-1]
         else:
-            ticks = 0
+            current_bar = 1 
+            bar_length = 0
+            if self.partial:
+                initial = self.meters[0][1]
+                bar_length = calc_bar_length(self.resolution, initial)
+                ticks = self.partial * bar_length / initial[0]
+            else:
+                ticks = 0
 
-        self._boundaries = []
-        for start_bar, meter in self.meters:
+        for start_bar, meter in self.meters[i:]:
             ticks += bar_length * (start_bar-current_bar)
             bar_length = calc_bar_length(self.resolution, meter)
             self._boundaries.append(Boundary(start_bar, ticks, bar_length, meter[0]))
+            self._bar_starts.append(start_bar)
+            self._tick_starts.append(ticks)
             current_bar = start_bar
 
     def set_key(self, bar, key):
@@ -147,15 +221,24 @@ class TrackView(object):
             k = KEYS.index(key) - 7
         except ValueError:
             raise IndexError("No such key: %s" % key)
-        self.keys.append((self.beat(bar), k))
-        self.keys.sort()
+        key = (self.beat(bar), k)
+        i = bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self._key_ticks.insert(i, key[0])
 
     def transpose(self, offset):
         self.keys = [ (s, n+offset) for s, n in self.keys ]
 
+    def boundary(self, bar):
+        '''
+        Returns the Boundary in effect at the given bar.
+        Bars before the first boundary are counted back from it.
+        '''
+        i = bisect_right(self._bar_starts, bar) - 1
+        return self._boundaries[max(i, 0)]
+
     def beat(self, bar, beat=1, divisions=None):
-        for b in self._boundaries:
-            if b.start_bar >= bar: break
+        b = self.boundary(bar)
 
         bar_start = b.start_tick + b.bar_length * (bar-b.start_bar)
         if beat == 1: return bar_start
@@ -165,12 +248,35 @@ class TrackView(object):
         return bar_start + (beat - 1) * b.bar_length / divisions
 
     def key(self, bar):
-        tick = self.beat(bar)
-        last = 'c'
-        for start, key in self.keys:
-            if start > tick: break
-            last = key
-        return last
+        i = bisect_right(self._key_ticks, self.beat(bar)) - 1
+        if i < 0:
+            return 'c'
+        return self.keys[i][1]
+
+    def bar_at(self, tick):
+        '''
+        Returns the bar number for the given tick.
+        Ticks before the first boundary (a partial bar) are counted back from it.
+        '''
+        i = bisect_right(self._tick_starts, tick) - 1
+        b = self._boundaries[max(i, 0)]
+        return b.start_bar + (tick - b.start_tick) // b.bar_length
+
+    def bar_numbers(self, ticks):
+        '''
+        Bar numbers for a sequence of ticks in one call.
+        Returns a numpy array if numpy is available, a list otherwise.
+        '''
+        try:
+            import numpy
+        except ImportError:
+            return [ self.bar_at(t) for t in ticks ]
+
+        ticks = numpy.asarray(ticks)
+        i = numpy.maximum(numpy.searchsorted(self._tick_starts, ticks, 'right') - 1, 0)
+        table = numpy.array([ b[:3] for b in self._boundaries ])
+        start_bar, start_tick, bar_length = table[i].T
+        return start_bar + (ticks - start_tick) // bar_length
 
     def bar(self, n):
         ' Returns the notes within the given bar '
@@ -193,11 +299,10 @@ class TrackView(object):
 
     def bar_info(self, tick):
         ' Returns the Boundary object at the given tick '
-        last = None
-        for b in self._boundaries:
-            if tick < b.start_tick: break
-            last = b
-        return last
+        i = bisect_right(self._tick_starts, tick) - 1
+        if i < 0:
+            return None
+        return self._boundaries[i]
 
     def split_sections(self, notes):
         clock = notes.time.start
@@ -208,7 +313,7 @@ class TrackView(object):
             b = boundaries[i]
             stop = boundaries[i+1].start_tick
 
-            section = notes.slice(TimeRange(b.start_tick, stop))
+            section = notes.view(TimeRange(b.start_tick, stop))
             section.add_event(b.start_tick, Instruction(r"\time %d/%d" % b.meter(notes.resolution)))
 
             for start, key in self.keys: